@@ -0,0 +1,130 @@
+"""
+Admission control for heavy endpoints.
+
+Heavy endpoint classes (paginated lists, reports, exports) each get a
+concurrency limit and a bounded wait queue so a burst of them can't take
+every database connection away from the point-of-sale lookups and updates,
+which are never limited. A request that finds the queue full is rejected
+straight away with 429; one that waits longer than ADMISSION_QUEUE_TIMEOUT
+gets 503. Both carry Retry-After.
+
+    @api_bp.route('/medicines/reports/inventory')
+    @admit('report')
+    def get_inventory_report(): ...
+
+Limits come from the ADMISSION_LIMITS config and are per worker process.
+"""
+
+import threading
+import time
+from functools import wraps
+from flask import jsonify, current_app
+from metrics import register_metrics_source
+
+DEFAULT_LIMITS = {
+    'list': {'concurrency': 8, 'queue': 16},
+    'report': {'concurrency': 4, 'queue': 8},
+    'export': {'concurrency': 1, 'queue': 0},
+}
+DEFAULT_QUEUE_TIMEOUT = 2.0
+DEFAULT_RETRY_AFTER = 1
+
+ADMITTED, REJECTED, TIMED_OUT = 'admitted', 'rejected', 'timed_out'
+
+
+class AdmissionLimiter:
+    """Counting gate with a bounded, timed wait queue"""
+
+    def __init__(self, name, concurrency, queue):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.active = 0
+        self.waiting = 0
+        self.counts = {ADMITTED: 0, REJECTED: 0, TIMED_OUT: 0}
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout):
+        with self._cond:
+            if self.active < self.concurrency and self.waiting == 0:
+                self.active += 1
+                self.counts[ADMITTED] += 1
+                return ADMITTED
+            if self.waiting >= self.queue:
+                self.counts[REJECTED] += 1
+                return REJECTED
+
+            self.waiting += 1
+            deadline = time.monotonic() + timeout
+            try:
+                while self.active >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counts[TIMED_OUT] += 1
+                        return TIMED_OUT
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            self.counts[ADMITTED] += 1
+            return ADMITTED
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def snapshot(self):
+        with self._cond:
+            return dict(
+                self.counts,
+                concurrency=self.concurrency,
+                queue=self.queue,
+                active=self.active,
+                waiting=self.waiting
+            )
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name):
+    """Limiter for an endpoint class, built from config on first use"""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                limits = current_app.config.get('ADMISSION_LIMITS', DEFAULT_LIMITS)
+                settings = limits.get(name, DEFAULT_LIMITS[name])
+                limiter = _limiters[name] = AdmissionLimiter(name, settings['concurrency'], settings['queue'])
+    return limiter
+
+
+def _collect():
+    return {name: limiter.snapshot() for name, limiter in sorted(_limiters.items())}
+
+
+register_metrics_source('admission', _collect)
+
+
+def admit(name):
+    """Decorator: run the view only once admitted to endpoint class ``name``"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            limiter = get_limiter(name)
+            outcome = limiter.acquire(current_app.config.get('ADMISSION_QUEUE_TIMEOUT', DEFAULT_QUEUE_TIMEOUT))
+            if outcome != ADMITTED:
+                status = 429 if outcome == REJECTED else 503
+                response = jsonify({'error': f'Too many concurrent {name} requests, retry shortly'})
+                response.status_code = status
+                response.headers['Retry-After'] = str(current_app.config.get('ADMISSION_RETRY_AFTER', DEFAULT_RETRY_AFTER))
+                return response
+            try:
+                return view(*args, **kwargs)
+            finally:
+                limiter.release()
+        return wrapper
+    return decorator
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Columnar analytics export of medicines and inventory aggregates.
+
+Medicines joined with their branch, manufacturer and category names are
+streamed from a server-side cursor in chunks and written as Parquet (or
+Arrow IPC) files, hive-partitioned by category or expiry month so they load
+straight into pandas / pyarrow / DuckDB datasets:
+
+    <output>/full-20261019T120000000000/medicines/category=Tablets/part-0.parquet
+    <output>/full-20261019T120000000000/aggregates/by_category.parquet
+    <output>/full-20261019T120000000000/manifest.json
+
+Incremental runs export rows whose updated_at is past the high-water mark
+stored in <output>/export_state.json, minus ANALYTICS_EXPORT_OVERLAP seconds.
+updated_at is set when a row is written, not when its transaction commits, so
+a slow transaction can become visible with a timestamp below a mark that was
+already saved. The overlap re-reads that window; rows may therefore appear in
+two consecutive runs, and consumers keep the latest row per id. Deleted rows
+are not tracked.
+
+Usage: python analytics_export.py [--partition-by expiry_month] [--format arrow] [--incremental]
+Needs the optional ``pyarrow`` package.
+"""
+
+import os
+import sys
+import json
+from datetime import datetime, timedelta
+from flask import current_app
+from urllib.parse import quote
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = pc = pq = None
+
+from models import db, Medicine, Manufacturer, MedicineCategory, Branch
+
+PARTITION_COLUMNS = ('category', 'expiry_month')
+FORMATS = ('parquet', 'arrow')
+DEFAULT_CHUNK_SIZE = 10000
+# Seconds re-read below the high-water mark, longer than any write transaction
+DEFAULT_OVERLAP = 300
+STATE_FILE = 'export_state.json'
+
+
+def _schema():
+    return pa.schema([
+        ('id', pa.int64()),
+        ('branch_id', pa.int64()),
+        ('branch', pa.string()),
+        ('name', pa.string()),
+        ('description', pa.string()),
+        ('batch_number', pa.string()),
+        ('dosage', pa.string()),
+        ('form', pa.string()),
+        ('manufacturer_id', pa.int64()),
+        ('manufacturer', pa.string()),
+        ('category_id', pa.int64()),
+        ('category', pa.string()),
+        ('quantity', pa.int64()),
+        ('minimum_stock', pa.int64()),
+        ('cost_price', pa.float64()),
+        ('selling_price', pa.float64()),
+        ('purchase_date', pa.date32()),
+        ('expiry_date', pa.date32()),
+        ('expiry_month', pa.string()),
+        ('created_at', pa.timestamp('us')),
+        ('updated_at', pa.timestamp('us')),
+    ])
+
+
+def _medicines_select(since=None, branch_id=None):
+    stmt = db.select(
+        Medicine.id,
+        Medicine.branch_id,
+        Branch.name.label('branch'),
+        Medicine.name,
+        Medicine.description,
+        Medicine.batch_number,
+        Medicine.dosage,
+        Medicine.form,
+        Medicine.manufacturer_id,
+        db.func.coalesce(Manufacturer.name, Medicine.manufacturer, 'Unknown').label('manufacturer'),
+        Medicine.category_id,
+        db.func.coalesce(MedicineCategory.name, Medicine.category, 'Unknown').label('category'),
+        Medicine.quantity,
+        Medicine.minimum_stock,
+        Medicine.cost_price,
+        Medicine.selling_price,
+        Medicine.purchase_date,
+        Medicine.expiry_date,
+        Medicine.created_at,
+        Medicine.updated_at
+    ).select_from(Medicine).outerjoin(
+        Branch, Branch.id == Medicine.branch_id
+    ).outerjoin(
+        Manufacturer, Manufacturer.id == Medicine.manufacturer_id
+    ).outerjoin(
+        MedicineCategory, MedicineCategory.id == Medicine.category_id
+    )
+    if since is not None:
+        stmt = stmt.where(Medicine.updated_at > since)
+    if branch_id is not None:
+        stmt = stmt.where(Medicine.branch_id == branch_id)
+    return stmt.order_by(Medicine.id)
+
+
+def _chunk_columns(rows):
+    """Transpose a chunk of result rows into schema-ordered column lists"""
+    columns = {field: [] for field in _schema().names}
+    for row in rows:
+        for field, value in row._mapping.items():
+            if field in ('cost_price', 'selling_price') and value is not None:
+                value = float(value)
+            columns[field].append(value)
+        columns['expiry_month'].append(
+            row.expiry_date.strftime('%Y-%m') if row.expiry_date else 'unknown'
+        )
+    return columns
+
+
+class _Writers:
+    """One open Parquet/Arrow writer per partition value"""
+
+    def __init__(self, root, partition_by, fmt, schema):
+        self.root = root
+        self.partition_by = partition_by
+        self.fmt = fmt
+        self.schema = schema
+        self.writers = {}
+        self.files = []
+
+    def _open(self, value):
+        directory = os.path.join(self.root, f'{self.partition_by}={quote(str(value), safe="")}')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'part-0.{self.fmt}')
+        if self.fmt == 'parquet':
+            writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+        else:
+            writer = pa.ipc.new_file(path, self.schema)
+        self.files.append(path)
+        return writer
+
+    def write(self, table):
+        # Sort once, then each partition value is one contiguous slice
+        table = table.sort_by(self.partition_by)
+        runs = pc.value_counts(table.column(self.partition_by))
+        offset = 0
+        for value, count in zip(runs.field('values').to_pylist(), runs.field('counts').to_pylist()):
+            if value not in self.writers:
+                self.writers[value] = self._open(value)
+            self.writers[value].write_table(table.slice(offset, count))
+            offset += count
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+def _write_aggregates(root, fmt, branch_id=None):
+    """Per-branch, per-category and per-manufacturer totals"""
+    os.makedirs(root, exist_ok=True)
+    files = []
+    for dimension, column in (('branch', Medicine.branch_id),
+                              ('category', Medicine.category_id),
+                              ('manufacturer', Medicine.manufacturer_id)):
+        query = db.session.query(
+            column,
+            db.func.count(Medicine.id),
+            db.func.coalesce(db.func.sum(Medicine.quantity), 0),
+            db.func.coalesce(db.func.sum(Medicine.selling_price * Medicine.quantity), 0),
+            db.func.coalesce(db.func.sum(Medicine.cost_price * Medicine.quantity), 0)
+        )
+        if branch_id is not None:
+            query = query.filter(Medicine.branch_id == branch_id)
+        rows = query.group_by(column).all()
+
+        table = pa.table({
+            f'{dimension}_id': pa.array([row[0] for row in rows], pa.int64()),
+            'medicine_count': pa.array([row[1] for row in rows], pa.int64()),
+            'total_quantity': pa.array([int(row[2]) for row in rows], pa.int64()),
+            'selling_value': pa.array([float(row[3]) for row in rows], pa.float64()),
+            'cost_value': pa.array([float(row[4]) for row in rows], pa.float64()),
+        })
+        path = os.path.join(root, f'by_{dimension}.{fmt}')
+        if fmt == 'parquet':
+            pq.write_table(table, path)
+        else:
+            with pa.ipc.new_file(path, table.schema) as writer:
+                writer.write_table(table)
+        files.append(path)
+    return files
+
+
+def _load_state(output_dir):
+    path = os.path.join(output_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_state(output_dir, state):
+    path = os.path.join(output_dir, STATE_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def export_medicines(output_dir, partition_by='category', fmt='parquet',
+                     incremental=False, chunk_size=DEFAULT_CHUNK_SIZE, branch_id=None, overlap=None):
+    """Export medicines (and aggregates on full runs), returns the run manifest"""
+    if pa is None:
+        raise RuntimeError('pyarrow is required for analytics exports')
+    if partition_by not in PARTITION_COLUMNS:
+        raise ValueError(f'partition_by must be one of: {", ".join(PARTITION_COLUMNS)}')
+    if fmt not in FORMATS:
+        raise ValueError(f'format must be one of: {", ".join(FORMATS)}')
+
+    os.makedirs(output_dir, exist_ok=True)
+    state = _load_state(output_dir)
+    state_key = f'branch_{branch_id}' if branch_id is not None else 'all'
+    since = None
+    if incremental and state.get(state_key):
+        since = datetime.fromisoformat(state[state_key])
+    if overlap is None:
+        overlap = current_app.config.get('ANALYTICS_EXPORT_OVERLAP', DEFAULT_OVERLAP)
+
+    started = datetime.utcnow()
+    run_name = f"{'incremental' if since else 'full'}-{started.strftime('%Y%m%dT%H%M%S%f')}"
+    run_dir = os.path.join(output_dir, run_name)
+
+    schema = _schema()
+    writers = _Writers(os.path.join(run_dir, 'medicines'), partition_by, fmt, schema)
+    rows_written = 0
+    high_water = since
+
+    read_from = since - timedelta(seconds=overlap) if since else None
+    stmt = _medicines_select(read_from, branch_id).execution_options(
+        stream_results=True, yield_per=chunk_size
+    )
+    try:
+        result = db.session.execute(stmt)
+        for rows in result.partitions(chunk_size):
+            columns = _chunk_columns(rows)
+            writers.write(pa.table(columns, schema=schema))
+            rows_written += len(rows)
+            latest = max((u for u in columns['updated_at'] if u is not None), default=None)
+            if latest is not None and (high_water is None or latest > high_water):
+                high_water = latest
+    finally:
+        writers.close()
+
+    files = list(writers.files)
+    if since is None:
+        files += _write_aggregates(os.path.join(run_dir, 'aggregates'), fmt, branch_id)
+
+    manifest = {
+        'run': run_name,
+        'mode': 'incremental' if since else 'full',
+        'since': since.isoformat() if since else None,
+        'read_from': read_from.isoformat() if read_from else None,
+        'partition_by': partition_by,
+        'format': fmt,
+        'branch_id': branch_id,
+        'rows': rows_written,
+        'files': [os.path.relpath(path, output_dir) for path in files],
+        'started_at': started.isoformat(),
+        'finished_at': datetime.utcnow().isoformat()
+    }
+    os.makedirs(run_dir, exist_ok=True)
+    with open(os.path.join(run_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    if high_water is not None:
+        state[state_key] = high_water.isoformat()
+        _save_state(output_dir, state)
+    return manifest
+
+
+def list_exports(output_dir):
+    """Manifests of previous runs, newest first"""
+    if not os.path.isdir(output_dir):
+        return []
+    manifests = []
+    for name in sorted(os.listdir(output_dir), reverse=True):
+        path = os.path.join(output_dir, name, 'manifest.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                manifests.append(json.load(f))
+    return manifests
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Add the current directory to Python path
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+    from app import app
+
+    parser = argparse.ArgumentParser(description="Export medicines to Parquet/Arrow for analytics")
+    parser.add_argument("--output", help="Output directory (default: ANALYTICS_EXPORT_DIR)")
+    parser.add_argument("--partition-by", choices=PARTITION_COLUMNS, default="category")
+    parser.add_argument("--format", choices=FORMATS, default="parquet")
+    parser.add_argument("--incremental", action="store_true", help="Only rows updated since the last run")
+    parser.add_argument("--branch-id", type=int, help="Only export one branch")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+
+    args = parser.parse_args()
+
+    with app.app_context():
+        try:
+            manifest = export_medicines(
+                args.output or app.config["ANALYTICS_EXPORT_DIR"],
+                partition_by=args.partition_by,
+                fmt=args.format,
+                incremental=args.incremental,
+                chunk_size=args.chunk_size,
+                branch_id=args.branch_id
+            )
+            print(f"✅ Exported {manifest['rows']} medicines to {manifest['run']} ({len(manifest['files'])} files)")
+        except Exception as e:
+            print(f"❌ Error exporting: {str(e)}")
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Archival of expired and depleted batches.
+
+Expired batches and batches sold down to zero are kept forever in
+medicines and slow every list, alert and report scan. This job moves
+batches that expired, or hit zero quantity, more than ``retention_days``
+ago into medicines_archive. It works in chunks of ``chunk_size`` rows and
+commits after each chunk, so locks stay short. On PostgreSQL each chunk is
+one statement:
+
+    WITH moved AS (DELETE FROM medicines WHERE id IN (SELECT id ... LIMIT n FOR UPDATE SKIP LOCKED)
+                   RETURNING *)
+    INSERT INTO medicines_archive SELECT ... FROM moved RETURNING id
+
+Other databases copy and then delete the same id chunk. Rows derived from a
+moved batch (its expiry status and forecast) are removed with it. Price
+history, usage and the stock ledger are kept. Batches with pending ledger
+movements are skipped until compaction has applied them.
+
+Runs nightly as the 'archive_batches' job, or by hand:
+    python archival.py [--retention-days 90] [--chunk-size 1000] [--dry-run]
+"""
+
+import os
+import sys
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import or_, and_
+from models import db, Medicine, ArchivedMedicine, MedicineExpiryStatus, ExpiryRiskForecast, StockMovement
+from scheduler import register_job
+
+DEFAULT_RETENTION_DAYS = 90
+DEFAULT_CHUNK_SIZE = 1000
+
+COLUMNS = [column.name for column in Medicine.__table__.columns]
+
+
+def archivable(retention_days=DEFAULT_RETENTION_DAYS, today=None):
+    """WHERE clause matching batches due for archival"""
+    today = today or date.today()
+    cutoff = today - timedelta(days=retention_days)
+    # Batches with uncompacted ledger movements wait until their quantity is final
+    pending = db.select(StockMovement.medicine_id).where(StockMovement.compacted_at.is_(None))
+    return and_(or_(
+        Medicine.expiry_date < cutoff,
+        and_(Medicine.quantity <= 0, Medicine.updated_at < datetime.combine(cutoff, datetime.min.time()))
+    ), Medicine.id.notin_(pending))
+
+
+def _move_chunk_postgresql(criteria, chunk_size, now):
+    candidates = db.select(Medicine.id).where(criteria).order_by(Medicine.id).limit(
+        chunk_size
+    ).with_for_update(skip_locked=True)
+    moved = Medicine.__table__.delete().where(Medicine.id.in_(candidates)).returning(
+        *Medicine.__table__.columns
+    ).cte('moved')
+    archive = ArchivedMedicine.__table__
+    return db.session.execute(
+        archive.insert().from_select(
+            COLUMNS + ['archived_at'],
+            db.select(*[moved.c[name] for name in COLUMNS], db.literal(now))
+        ).returning(archive.c.id)
+    ).scalars().all()
+
+
+def _move_chunk_generic(criteria, chunk_size, now):
+    ids = [row[0] for row in db.session.execute(
+        db.select(Medicine.id).where(criteria).order_by(Medicine.id).limit(chunk_size)
+    )]
+    if not ids:
+        return ids
+    source = db.select(*[getattr(Medicine, name) for name in COLUMNS], db.literal(now)).where(Medicine.id.in_(ids))
+    db.session.execute(ArchivedMedicine.__table__.insert().from_select(COLUMNS + ['archived_at'], source))
+    db.session.execute(Medicine.__table__.delete().where(Medicine.id.in_(ids)))
+    return ids
+
+
+def archive_batches(retention_days=None, chunk_size=None, dry_run=False, max_chunks=None):
+    """Move due batches into medicines_archive, returns a summary string"""
+    config = current_app.config
+    retention_days = retention_days if retention_days is not None else config.get('ARCHIVE_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    chunk_size = chunk_size or config.get('ARCHIVE_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    criteria = archivable(retention_days)
+
+    if dry_run:
+        count = db.session.query(db.func.count(Medicine.id)).filter(criteria).scalar()
+        return f'{count} batches due for archival'
+
+    move_chunk = _move_chunk_postgresql if db.engine.dialect.name == 'postgresql' else _move_chunk_generic
+    moved = chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        ids = move_chunk(criteria, chunk_size, datetime.utcnow())
+        if not ids:
+            break
+        # Foreign keys may be absent (partitioned medicines, SQLite), clean up explicitly
+        for table in (MedicineExpiryStatus.__table__, ExpiryRiskForecast.__table__):
+            db.session.execute(table.delete().where(table.c.medicine_id.in_(ids)))
+        db.session.commit()
+        moved += len(ids)
+        chunks += 1
+        if len(ids) < chunk_size:
+            break
+
+    if moved:
+        # Bulk deletes bypass the session events that maintain the typeahead index
+        from suggest_index import suggest_index
+        suggest_index.stale = True
+    return f'{moved} batches archived in {chunks} chunks'
+
+
+register_job('archive_batches', archive_batches, at='02:00')
+
+
+def find_archived(medicine_id, branch_id=None):
+    query = ArchivedMedicine.query.filter(ArchivedMedicine.id == medicine_id)
+    if branch_id is not None:
+        query = query.filter(ArchivedMedicine.branch_id == branch_id)
+    return query.first()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Add the current directory to Python path
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+    from app import app
+
+    parser = argparse.ArgumentParser(description="Archive expired and depleted batches")
+    parser.add_argument("--retention-days", type=int, help="Keep batches this many days after expiry/depletion")
+    parser.add_argument("--chunk-size", type=int, help="Rows moved per transaction")
+    parser.add_argument("--max-chunks", type=int, help="Stop after this many chunks")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the batches due")
+
+    args = parser.parse_args()
+
+    with app.app_context():
+        try:
+            print(f"✅ {archive_batches(args.retention_days, args.chunk_size, args.dry_run, args.max_chunks)}")
+        except Exception as e:
+            print(f"❌ Error archiving batches: {str(e)}")
+            db.session.rollback()
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Asynchronous audit log of medicine changes.
+
+Session events record the before/after values of AUDITED_FIELDS for every
+medicine a transaction creates, updates or deletes, together with the actor
+(JWT identity, else ``X-User``, else the client address) and the request
+path. Nothing is written inside the transaction: after commit the entries
+go onto a bounded in-process queue that a background thread drains into
+audit_log with batched inserts, so writes keep their latency.
+
+When the queue is full, or a batch insert fails, entries are appended to
+AUDIT_SPILL_PATH (JSON lines, fsynced) instead of being dropped. The
+``audit_spill_replay`` job loads spilled entries back into audit_log.
+Entries still queued at interpreter exit are spilled too.
+
+Core statements bypass the ORM events and write no entries here. Every
+such path that changes medicines keeps its own record instead, stamped
+with the same ``current_actor()``:
+
+- repricing.reprice, bulk UPDATE of prices: medicine_price_history
+- stock_take.reconcile with apply, bulk UPDATE of quantity: stock_movements
+  (one adjustment row per corrected batch)
+- stock_ledger.compact_movements, batched UPDATE of quantity:
+  stock_movements, which is the audit record for quantity changes made
+  through the ledger (kind, reference, actor and time per movement)
+- archival.archive_batches, Core DELETE into medicines_archive: the whole
+  row is kept in medicines_archive with its archived_at
+- branches.partition_medicines moves rows between partitions without
+  changing them; migrate.py backfills and seed.py --clear are maintenance
+  scripts, not audited
+
+    python audit.py --replay-spill
+    python audit.py --benchmark --events 50000
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime, date
+from decimal import Decimal
+from flask import request, has_app_context, has_request_context, current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from models import db, Medicine, AuditLog
+from scheduler import register_job
+from metrics import register_metrics_source
+
+try:
+    from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+except ImportError:  # actor falls back to X-User / remote address
+    verify_jwt_in_request = get_jwt_identity = None
+
+AUDITED_FIELDS = (
+    'quantity', 'minimum_stock',
+    'selling_price', 'cost_price', 'price',
+    'purchase_date', 'expiry_date',
+)
+CREATE, UPDATE, DELETE = 'create', 'update', 'delete'
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_SPILL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audit_spill.jsonl')
+REPLAY_BATCH_SIZE = 1000
+
+_STOP = object()
+
+
+def _jsonable(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def current_actor():
+    """JWT identity, else ``X-User``, else the client address; 'system' outside requests"""
+    if not has_request_context():
+        return 'system'
+    if verify_jwt_in_request is not None:
+        try:
+            verify_jwt_in_request(optional=True)
+            identity = get_jwt_identity()
+            if identity is not None:
+                return str(identity)[:100]
+        except Exception:
+            pass
+    return (request.headers.get('X-User') or request.remote_addr or 'anonymous')[:100]
+
+
+# =============================================================================
+# BACKGROUND WRITER
+# =============================================================================
+
+class AuditWriter:
+    """Bounded queue drained by one writer thread per process"""
+
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._engine = None
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self.batch_size = DEFAULT_BATCH_SIZE
+        self.flush_interval = DEFAULT_FLUSH_INTERVAL
+        self.spill_path = DEFAULT_SPILL_PATH
+        self.counts = {'enqueued': 0, 'written': 0, 'batches': 0, 'spilled': 0,
+                       'replayed': 0, 'failed_batches': 0}
+        self._counts_lock = threading.Lock()
+        self._stopping = False
+
+    def count(self, name, amount=1):
+        with self._counts_lock:
+            self.counts[name] += amount
+
+    def _ensure_started(self, engine):
+        """Start the queue and thread lazily, once per process (after any fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            config = current_app.config if has_app_context() else {}
+            self.batch_size = config.get('AUDIT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+            self.flush_interval = config.get('AUDIT_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+            self.spill_path = config.get('AUDIT_SPILL_PATH') or DEFAULT_SPILL_PATH
+            self._engine = engine
+            self._queue = queue.Queue(maxsize=config.get('AUDIT_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.stop)
+
+    def enqueue(self, entries, engine):
+        """Hand entries to the writer without blocking; spills what doesn't fit"""
+        self._ensure_started(engine)
+        overflow = []
+        for entry in entries:
+            try:
+                self._queue.put_nowait(entry)
+            except queue.Full:
+                overflow.append(entry)
+        self.count('enqueued', len(entries) - len(overflow))
+        if overflow:
+            self.spill(overflow)
+
+    def _next_batch(self):
+        """Up to batch_size entries, or whatever arrived within flush_interval"""
+        entry = self._queue.get()
+        if entry is _STOP:
+            self._queue.task_done()
+            return None
+        batch = [entry]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                entry = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                self._queue.task_done()
+                self._stopping = True
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        self._stopping = False
+        while not self._stopping:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self.write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def write(self, batch):
+        """Insert one batch, spilling it if the database refuses"""
+        try:
+            with Session(self._engine) as session:
+                session.execute(db.insert(AuditLog), batch)
+                session.commit()
+            self.count('written', len(batch))
+            self.count('batches')
+        except Exception:
+            self.count('failed_batches')
+            self.spill(batch)
+
+    def spill(self, entries):
+        """Append entries to the local spill file and fsync it"""
+        lines = ''.join(json.dumps(dict(entry, changed_at=entry['changed_at'].isoformat())) + '\n'
+                        for entry in entries)
+        with self._spill_lock:
+            with open(self.spill_path, 'a') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        self.count('spilled', len(entries))
+
+    def drain(self, timeout=30.0):
+        """Wait until everything queued so far is written or spilled"""
+        if self._pid != os.getpid():
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stop(self, timeout=5.0):
+        """Flush the queue at exit; whatever the thread can't write in time is spilled"""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+            self._thread.join(timeout)
+        except queue.Full:
+            pass
+        leftover = []
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not _STOP:
+                leftover.append(entry)
+        if leftover:
+            self.spill(leftover)
+
+    def stats(self):
+        with self._counts_lock:
+            counts = dict(self.counts)
+        return dict(counts, queued=self._queue.qsize() if self._pid == os.getpid() else 0)
+
+
+audit_writer = AuditWriter()
+register_metrics_source('audit', audit_writer.stats)
+
+
+def replay_spill(path=None, batch_size=REPLAY_BATCH_SIZE):
+    """Load spilled entries into audit_log; returns a summary"""
+    path = path or current_app.config.get('AUDIT_SPILL_PATH') or DEFAULT_SPILL_PATH
+    if os.path.exists(path):
+        # Claim the file so concurrent appends go to a fresh one
+        os.replace(path, f'{path}.{os.getpid()}.{int(time.time())}.replay')
+
+    replayed = 0
+    for claimed in sorted(glob.glob(f'{path}.*.replay')):
+        with open(claimed) as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        for entry in entries:
+            entry['changed_at'] = datetime.fromisoformat(entry['changed_at'])
+        for start in range(0, len(entries), batch_size):
+            db.session.execute(db.insert(AuditLog), entries[start:start + batch_size])
+        db.session.commit()
+        os.remove(claimed)
+        replayed += len(entries)
+    audit_writer.count('replayed', replayed)
+    return f'{replayed} spilled audit entries replayed'
+
+
+register_job('audit_spill_replay', replay_spill, every=60)
+
+
+def audit_history(medicine_id, branch_id=None, limit=100):
+    """Newest audit entries of one medicine"""
+    query = AuditLog.query.filter(AuditLog.medicine_id == medicine_id)
+    if branch_id is not None:
+        query = query.filter(AuditLog.branch_id == branch_id)
+    return query.order_by(AuditLog.changed_at.desc(), AuditLog.id.desc()).limit(limit).all()
+
+
+# =============================================================================
+# CAPTURE ON WRITES
+# =============================================================================
+
+def _diff(medicine, action):
+    changes = {}
+    state = inspect(medicine)
+    for field in AUDITED_FIELDS:
+        if action == UPDATE:
+            history = state.attrs[field].history
+            if not history.has_changes():
+                continue
+            old = history.deleted[0] if history.deleted else None
+            new = history.added[0] if history.added else None
+        elif action == CREATE:
+            old, new = None, getattr(medicine, field)
+        else:
+            # Deleted rows may have expired attributes; never reload them
+            old, new = state.dict.get(field), None
+        old, new = _jsonable(old), _jsonable(new)
+        if old != new:
+            changes[field] = [old, new]
+    return changes
+
+
+@event.listens_for(Session, 'after_flush')
+def _capture_changes(session, flush_context):
+    if has_app_context() and not current_app.config.get('AUDIT_ENABLED', True):
+        return
+    captured = []
+    for action, objects in ((CREATE, session.new), (UPDATE, session.dirty), (DELETE, session.deleted)):
+        for obj in objects:
+            if isinstance(obj, Medicine):
+                changes = _diff(obj, action)
+                if changes or action != UPDATE:
+                    captured.append((obj.id, obj.branch_id, action, changes))
+    if not captured:
+        return
+    actor = current_actor()
+    path = request.path[:255] if has_request_context() else None
+    now = datetime.utcnow()
+    session.info.setdefault('audit_entries', []).extend(
+        {'medicine_id': medicine_id, 'branch_id': branch_id, 'action': action, 'changes': changes,
+         'actor': actor, 'request_path': path, 'changed_at': now}
+        for medicine_id, branch_id, action, changes in captured
+    )
+
+
+@event.listens_for(Session, 'after_commit')
+def _enqueue_after_commit(session):
+    entries = session.info.pop('audit_entries', None)
+    if entries:
+        audit_writer.enqueue(entries, session.get_bind())
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('audit_entries', None)
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def benchmark(events, batch_size=None):
+    """Time the commit-path cost of auditing and the writer's insert throughput.
+
+    Synthetic entries (action 'benchmark') go through the same queue as
+    after_commit's, then are deleted again. The benchmark waits for queue
+    space instead of spilling, so no synthetic entries reach the spill file. Compare end-to-end write latency
+    with ``AUDIT_ENABLED=0`` vs ``1`` using ``loadtest.py``.
+    """
+    if batch_size:
+        current_app.config['AUDIT_BATCH_SIZE'] = batch_size
+    current_app.config['AUDIT_QUEUE_SIZE'] = max(current_app.config.get('AUDIT_QUEUE_SIZE', DEFAULT_QUEUE_SIZE), events)
+    engine = db.engine
+    audit_writer._ensure_started(engine)
+    entries = [{'medicine_id': 0, 'branch_id': 0, 'action': 'benchmark',
+                'changes': {'quantity': [i + 1, i]}, 'actor': 'benchmark',
+                'request_path': None, 'changed_at': datetime.utcnow()} for i in range(events)]
+    spilled_before = audit_writer.counts['spilled']
+
+    started = time.perf_counter()
+    for entry in entries:
+        audit_writer._queue.put(entry)
+    enqueued = time.perf_counter()
+    audit_writer.drain(timeout=600)
+    finished = time.perf_counter()
+
+    deleted = AuditLog.query.filter(AuditLog.action == 'benchmark').delete(synchronize_session=False)
+    db.session.commit()
+    return {
+        'events': events,
+        'batch_size': audit_writer.batch_size,
+        'enqueue_us_per_event': round((enqueued - started) / events * 1e6, 2),
+        'write_seconds': round(finished - started, 3),
+        'events_per_second': round(events / (finished - started)),
+        'spilled': audit_writer.counts['spilled'] - spilled_before,
+        'rows_cleaned_up': deleted
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Add the current directory to Python path
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+    from app import app
+
+    parser = argparse.ArgumentParser(description="Audit log maintenance and benchmark")
+    parser.add_argument("--replay-spill", action="store_true", help="Load spilled entries into audit_log")
+    parser.add_argument("--benchmark", action="store_true", help="Measure enqueue cost and writer throughput")
+    parser.add_argument("--events", type=int, default=20000, help="Synthetic entries for --benchmark")
+    parser.add_argument("--batch-size", type=int, help="Writer batch size for --benchmark")
+
+    args = parser.parse_args()
+
+    with app.app_context():
+        try:
+            if args.replay_spill:
+                print(f"✅ {replay_spill()}")
+            elif args.benchmark:
+                result = benchmark(args.events, args.batch_size)
+                print(f"📊 {result['events']} events, batch size {result['batch_size']}")
+                print(f"   enqueue: {result['enqueue_us_per_event']} µs/event on the commit path")
+                print(f"   writer:  {result['events_per_second']} events/s ({result['write_seconds']} s)")
+                if result['spilled']:
+                    print(f"⚠️  {result['spilled']} events spilled (queue full or insert failed)")
+            else:
+                parser.print_help()
+        except Exception as e:
+            print(f"❌ Error: {str(e)}")
+            db.session.rollback()
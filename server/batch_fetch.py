@@ -0,0 +1,56 @@
+"""
+Fetch many medicines by id in one round trip.
+
+Clients resolving cart lines, reorder lists or change-feed ids used to call
+``GET /medicines/<id>`` once per id. ``fetch_medicines`` loads the whole
+list with one query: ``id = ANY(:ids)`` with a single array parameter on
+PostgreSQL, a plain ``IN`` elsewhere. Names come from the reference cache
+in ``to_dict()``, so no relationships need loading. Results are keyed by id
+and ids that are missing, or outside the request's branch, map to None.
+"""
+
+from sqlalchemy import any_, bindparam, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from models import db, Medicine, ArchivedMedicine
+
+DEFAULT_MAX_IDS = 5000
+
+
+def parse_ids(values, max_ids):
+    """Deduplicated ids in request order; raises ValueError on bad input"""
+    if isinstance(values, str):
+        values = [value for value in values.split(',') if value.strip()]
+    if not isinstance(values, list) or not values:
+        raise ValueError('ids must be a non-empty list of integers')
+    ids = []
+    for value in values:
+        if isinstance(value, bool):
+            raise ValueError(f'Invalid id: {value}')
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid id: {value}')
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > max_ids:
+        raise ValueError(f'At most {max_ids} ids per request')
+    return ids
+
+
+def _id_filter(column, ids):
+    if db.engine.dialect.name == 'postgresql':
+        return column == any_(bindparam('ids', ids, type_=ARRAY(Integer)))
+    return column.in_(ids)
+
+
+def fetch_medicines(ids, branch_id=None, include_archived=False):
+    """``{id: Medicine | ArchivedMedicine | None}`` in the order of ``ids``"""
+    found = {}
+    for model in (Medicine, ArchivedMedicine) if include_archived else (Medicine,):
+        remaining = [medicine_id for medicine_id in ids if medicine_id not in found]
+        if not remaining:
+            break
+        query = model.query.filter(_id_filter(model.id, remaining))
+        if branch_id is not None:
+            query = query.filter(model.branch_id == branch_id)
+        found.update((row.id, row) for row in query)
+    return {medicine_id: found.get(medicine_id) for medicine_id in ids}
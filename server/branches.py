@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Branch scoping and optional PostgreSQL partitioning of medicines.
+
+Every api_bp request may be scoped to one branch with a ``branch_id`` query
+argument or an ``X-Branch-Id`` header; ``load_branch_scope`` validates it
+and stores it on ``g.branch_id`` (None means all branches).
+
+Large multi-branch installs can convert medicines into a table partitioned
+by LIST (branch_id), one partition per branch plus a default partition:
+
+    python branches.py --partition      # one-off conversion
+    python branches.py --add-partitions # after creating new branches
+
+Partitioned tables need the partition key in every unique constraint, so the
+primary key becomes (id, branch_id) and ids stay unique only through the
+shared medicines_id_seq. Foreign keys that reference medicines(id) are
+recreated on (medicine_id, branch_id) -> medicines (id, branch_id) with
+ON DELETE CASCADE ON UPDATE CASCADE; that covers medicine_expiry_status and
+expiry_risk_forecast. A referencing table without a branch_id column loses
+its foreign key and is named in the result, so its rows must be cleaned up
+explicitly (archival does this for the tables above too). Migrations that
+add a table referencing medicines must use the same composite key on a
+partitioned database (see the expiry_risk_forecast migration).
+"""
+
+import os
+import sys
+from flask import request, jsonify, g
+from sqlalchemy import text
+from models import db, Branch
+from reference_cache import reference_cache
+
+
+def load_branch_scope():
+    """before_request hook: parse the branch scope into g.branch_id"""
+    value = request.args.get('branch_id') or request.headers.get('X-Branch-Id')
+    g.branch_id = None
+    if value in (None, ''):
+        return None
+    try:
+        g.branch_id = int(value)
+    except ValueError:
+        return jsonify({'error': 'branch_id must be an integer'}), 400
+    if not reference_cache.branch_exists(g.branch_id):
+        return jsonify({'error': 'Branch not found'}), 404
+    return None
+
+
+def scope_to_branch(query, column, branch_id=None):
+    """Filter ``query`` on ``column`` when the request is branch scoped.
+
+    Pass ``branch_id`` explicitly from code that runs outside the request
+    thread, where ``g`` belongs to a different context.
+    """
+    if branch_id is None:
+        branch_id = g.get('branch_id')
+    if branch_id is not None:
+        query = query.filter(column == branch_id)
+    return query
+
+
+# =============================================================================
+# POSTGRESQL PARTITIONING
+# =============================================================================
+
+def _partition_name(branch_id):
+    return f'medicines_b{int(branch_id)}'
+
+
+def is_partitioned():
+    """True when medicines is a partitioned table (PostgreSQL only)"""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return bool(db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt "
+        "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = 'medicines'"
+    )).scalar())
+
+
+def partition_medicines():
+    """Convert medicines into a LIST (branch_id) partitioned table"""
+    if db.engine.dialect.name != 'postgresql':
+        raise RuntimeError('Partitioning is only supported on PostgreSQL')
+    if is_partitioned():
+        return 'already partitioned'
+
+    # Foreign keys must go before the old table can be dropped
+    referencing = db.session.execute(text(
+        "SELECT c.conrelid::regclass::text, c.conname, a.attname FROM pg_constraint c "
+        "JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1] "
+        "WHERE c.contype = 'f' AND c.confrelid = 'medicines'::regclass"
+    )).fetchall()
+    for table_name, constraint, _ in referencing:
+        db.session.execute(text(f'ALTER TABLE {table_name} DROP CONSTRAINT "{constraint}"'))
+
+    indexes = db.session.execute(text(
+        "SELECT indexname, indexdef FROM pg_indexes "
+        "WHERE tablename = 'medicines' AND indexname <> 'medicines_pkey'"
+    )).fetchall()
+
+    db.session.execute(text("ALTER TABLE medicines RENAME TO medicines_unpartitioned"))
+    for index_name, _ in indexes:
+        db.session.execute(text(f'DROP INDEX IF EXISTS "{index_name}"'))
+    db.session.execute(text(
+        "CREATE TABLE medicines (LIKE medicines_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        "PARTITION BY LIST (branch_id)"
+    ))
+    db.session.execute(text("ALTER TABLE medicines ADD PRIMARY KEY (id, branch_id)"))
+    db.session.execute(text(
+        "ALTER TABLE medicines ADD FOREIGN KEY (branch_id) REFERENCES branches (id)"
+    ))
+    db.session.execute(text("CREATE TABLE medicines_default PARTITION OF medicines DEFAULT"))
+    for branch_id, in db.session.query(Branch.id).all():
+        db.session.execute(text(
+            f"CREATE TABLE {_partition_name(branch_id)} PARTITION OF medicines FOR VALUES IN ({int(branch_id)})"
+        ))
+
+    db.session.execute(text("INSERT INTO medicines SELECT * FROM medicines_unpartitioned"))
+    db.session.execute(text("ALTER SEQUENCE IF EXISTS medicines_id_seq OWNED BY medicines.id"))
+    db.session.execute(text("DROP TABLE medicines_unpartitioned"))
+
+    # Recreate the indexes on the parent, they cascade to every partition
+    for _, index_def in indexes:
+        db.session.execute(text(index_def))
+
+    # Point dependents at the new (id, branch_id) key
+    dropped = []
+    for table_name, constraint, column in referencing:
+        has_branch = db.session.execute(text(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_name = :table AND column_name = 'branch_id'"
+        ), {'table': table_name}).scalar()
+        if not has_branch:
+            dropped.append(table_name)
+            continue
+        db.session.execute(text(
+            f'ALTER TABLE {table_name} ADD CONSTRAINT "{constraint}" '
+            f'FOREIGN KEY ({column}, branch_id) REFERENCES medicines (id, branch_id) '
+            f'ON DELETE CASCADE ON UPDATE CASCADE'
+        ))
+
+    db.session.commit()
+    result = f'medicines partitioned across {db.session.query(Branch).count()} branches'
+    if dropped:
+        result += f'; foreign keys dropped from {", ".join(sorted(set(dropped)))}'
+    return result
+
+
+
+def ensure_branch_partitions():
+    """Create a partition for every branch that lacks one.
+
+    Rows already in the default partition are moved into a standalone table
+    that is then attached, since a partition can't be created while the
+    default partition holds rows for it.
+    """
+    if not is_partitioned():
+        return 'not partitioned'
+
+    existing = {row[0] for row in db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'medicines'::regclass"
+    ))}
+    created = 0
+    for branch_id, in db.session.query(Branch.id).all():
+        name = _partition_name(branch_id)
+        if name in existing:
+            continue
+        db.session.execute(text(
+            f"CREATE TABLE {name} (LIKE medicines INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        ))
+        db.session.execute(text(
+            f"WITH moved AS (DELETE FROM medicines_default WHERE branch_id = {int(branch_id)} RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ))
+        db.session.execute(text(
+            f"ALTER TABLE medicines ATTACH PARTITION {name} FOR VALUES IN ({int(branch_id)})"
+        ))
+        created += 1
+
+    db.session.commit()
+    return f'{created} partitions created'
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Add the current directory to Python path
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+    from app import app
+
+    parser = argparse.ArgumentParser(description="Partition medicines by branch (PostgreSQL)")
+    parser.add_argument("--partition", action="store_true", help="Convert medicines into a partitioned table")
+    parser.add_argument("--add-partitions", action="store_true", help="Create partitions for new branches")
+
+    args = parser.parse_args()
+
+    with app.app_context():
+        try:
+            if args.partition:
+                print(f"✅ {partition_medicines()}")
+            elif args.add_partitions:
+                print(f"✅ {ensure_branch_partitions()}")
+            else:
+                parser.print_help()
+        except Exception as e:
+            print(f"❌ Error partitioning medicines: {str(e)}")
+            db.session.rollback()
@@ -0,0 +1,129 @@
+"""
+Expiry calendar: stock expiring per day, week or month.
+
+Counts, units and selling/cost value of batches expiring in each bucket over
+the next ``horizon_days`` are aggregated by one grouped query. The expiry
+range is a range scan of ix_medicines_branch_expiry when the request is
+scoped to a branch, and of the partial ix_medicines_expiry_in_stock
+(expiry_date WHERE quantity > 0) across all branches. The bucket expression
+is date_trunc on PostgreSQL and the equivalent date() modifiers elsewhere.
+Buckets with nothing expiring are filled with zeros so charts get a
+continuous axis.
+"""
+
+from datetime import date, timedelta
+from models import db, Medicine
+from reference_cache import reference_cache
+from valuation import period_start, DAY, WEEK, MONTH
+
+BUCKETS = (DAY, WEEK, MONTH)
+SPLITS = ('category', 'manufacturer')
+DEFAULT_HORIZON_DAYS = 365
+MAX_HORIZON_DAYS = 1095
+
+
+def _bucket_expression(column, bucket):
+    """First day of the bucket containing ``column``, as SQL"""
+    if bucket == DAY:
+        return column
+    if db.engine.dialect.name == 'postgresql':
+        return db.cast(db.func.date_trunc(bucket, column), db.Date)
+    if bucket == WEEK:
+        # Forward to Sunday (or stay), then back to that week's Monday
+        return db.func.date(column, 'weekday 0', '-6 days')
+    return db.func.date(column, 'start of month')
+
+
+def _next_bucket(day, bucket):
+    if bucket == DAY:
+        return day + timedelta(days=1)
+    if bucket == WEEK:
+        return day + timedelta(days=7)
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def expiry_histogram(bucket=MONTH, horizon_days=DEFAULT_HORIZON_DAYS, split_by=None, branch_id=None):
+    """Bucketed expiry totals, optionally split by category or manufacturer"""
+    if bucket not in BUCKETS:
+        raise ValueError(f'bucket must be one of: {", ".join(BUCKETS)}')
+    if split_by is not None and split_by not in SPLITS:
+        raise ValueError(f'split_by must be one of: {", ".join(SPLITS)}')
+    if not 1 <= horizon_days <= MAX_HORIZON_DAYS:
+        raise ValueError(f'horizon_days must be between 1 and {MAX_HORIZON_DAYS}')
+
+    today = date.today()
+    until = today + timedelta(days=horizon_days)
+    bucket_start = _bucket_expression(Medicine.expiry_date, bucket).label('bucket_start')
+    split_column = {'category': Medicine.category_id, 'manufacturer': Medicine.manufacturer_id}.get(split_by)
+
+    group_columns = [bucket_start] + ([split_column] if split_column is not None else [])
+    query = db.session.query(
+        *group_columns,
+        db.func.count(Medicine.id),
+        db.func.coalesce(db.func.sum(Medicine.quantity), 0),
+        db.func.coalesce(db.func.sum(Medicine.selling_price * Medicine.quantity), 0),
+        db.func.coalesce(db.func.sum(Medicine.cost_price * Medicine.quantity), 0)
+    ).filter(
+        Medicine.expiry_date >= today,
+        Medicine.expiry_date <= until,
+        Medicine.quantity > 0
+    )
+    if branch_id is not None:
+        query = query.filter(Medicine.branch_id == branch_id)
+    rows = query.group_by(*group_columns).all()
+
+    names = {}
+    if split_by == 'category':
+        names = reference_cache.categories()
+    elif split_by == 'manufacturer':
+        names = reference_cache.manufacturers()
+
+    totals = {}
+    for row in rows:
+        start = _as_date(row[0])
+        entry = totals.setdefault(start, {'batches': 0, 'quantity': 0, 'selling_value': 0.0,
+                                          'cost_value': 0.0, 'splits': []})
+        batches, quantity, selling, cost = row[-4:]
+        entry['batches'] += batches
+        entry['quantity'] += int(quantity)
+        entry['selling_value'] += float(selling)
+        entry['cost_value'] += float(cost)
+        if split_column is not None:
+            entry['splits'].append({
+                f'{split_by}_id': row[1],
+                split_by: names.get(row[1], 'Unknown'),
+                'batches': batches,
+                'quantity': int(quantity),
+                'selling_value': round(float(selling), 2),
+                'cost_value': round(float(cost), 2)
+            })
+
+    buckets = []
+    start = period_start(today, bucket)
+    while start <= until:
+        entry = totals.get(start, {'batches': 0, 'quantity': 0, 'selling_value': 0.0,
+                                   'cost_value': 0.0, 'splits': []})
+        item = {
+            'bucket_start': start.isoformat(),
+            'batches': entry['batches'],
+            'quantity': entry['quantity'],
+            'selling_value': round(entry['selling_value'], 2),
+            'cost_value': round(entry['cost_value'], 2)
+        }
+        if split_column is not None:
+            item[f'by_{split_by}'] = sorted(entry['splits'], key=lambda s: -s['selling_value'])
+        buckets.append(item)
+        start = _next_bucket(start, bucket)
+
+    return {
+        'bucket': bucket,
+        'horizon_days': horizon_days,
+        'from': today.isoformat(),
+        'to': until.isoformat(),
+        'split_by': split_by,
+        'buckets': buckets
+    }
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Expiry-risk forecast: stock projected to expire before it sells.
+
+Alerts only flag a batch 30 days before expiry, which is too late to move
+a large batch. This forecast assumes each product keeps selling at its
+recent average daily demand (see reorder.average_daily_demand) and that
+batches are sold first-expiry-first-out. Batches are sorted by product and
+expiry date, so within a product each batch k has a cumulative quantity
+Q_k and total demand D_k = rate * days_to_expiry_k before it expires.
+Units sold from batches 1..k by then follow the FEFO recurrence
+
+    S_k = min(S_{k-1} + q_k, D_k) = Q_k + min(0, min_{j<=k}(D_j - Q_j))
+
+so the whole catalogue is one segmented cumulative minimum in NumPy.
+Demand is rounded down to whole units first, so the recurrence runs in
+exact integer arithmetic. Batch k sells S_k - S_{k-1}, and the rest is
+projected unsold. The unsold units are valued at cost (or at the selling
+price when cost is unknown).
+
+The nightly 'expiry_forecast' job caches the result in expiry_risk_forecast.
+GET /medicines/expiry-risk and the CLI read from that cache, and
+POST /medicines/expiry-risk/refresh or --refresh recompute it.
+
+Usage: python expiry_forecast.py [--refresh] [--limit 20] [--branch-id 1]
+Needs the optional ``numpy`` package.
+"""
+
+import os
+import sys
+from datetime import date
+from decimal import Decimal
+from sqlalchemy import event
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+from models import db, Medicine, ExpiryRiskForecast, SnapshotState
+from reorder import average_daily_demand, product_key, DEFAULT_WINDOW
+from scheduler import register_job
+
+SNAPSHOT_NAME = 'expiry_forecast'
+
+
+def _segmented_cummin(values, group_starts):
+    """Running minimum of ``values`` that restarts at every group start"""
+    group = np.cumsum(group_starts) - 1
+    span = int(np.ptp(values)) + 1 if len(values) else 1
+    # Later groups sit strictly below earlier ones, so minima never leak across
+    shifted = values - group * span
+    return np.minimum.accumulate(shifted) + group * span
+
+
+def _units_demanded(rate, days):
+    """Whole units sold before expiry; the epsilon absorbs float error in rate * days"""
+    return np.floor(rate * days + 1e-9).astype(np.int64)
+
+
+def _fefo_sold(starts, demand, quantity):
+    """Units each batch sells; int64 arrays sorted by product, then expiry"""
+    group = np.cumsum(starts) - 1
+    cumulative = np.cumsum(quantity)
+    q_cum = cumulative - (cumulative - quantity)[np.flatnonzero(starts)][group]
+    sold_cum = q_cum + np.minimum(0, _segmented_cummin(demand - q_cum, starts))
+    sold_before = np.where(starts, 0, np.concatenate(([0], sold_cum[:-1])))
+    return sold_cum - sold_before
+
+
+def forecast_expiry_risk(window=DEFAULT_WINDOW, today=None, branch_id=None):
+    """Project unsold units per batch; returns rows with projected_unsold > 0"""
+    if np is None:
+        raise RuntimeError('numpy is required for the expiry-risk forecast')
+    today = today or date.today()
+
+    query = db.session.query(
+        Medicine.id, Medicine.branch_id, Medicine.name, Medicine.dosage, Medicine.form,
+        Medicine.quantity, Medicine.expiry_date,
+        db.func.coalesce(Medicine.cost_price, Medicine.selling_price), Medicine.selling_price
+    ).filter(Medicine.quantity > 0, Medicine.expiry_date >= today)
+    if branch_id is not None:
+        query = query.filter(Medicine.branch_id == branch_id)
+    batches = query.all()
+    if not batches:
+        return []
+
+    rates = average_daily_demand(window, today, branch_id)
+    products = {}
+    product_idx = np.empty(len(batches), dtype=np.int64)
+    rate = np.empty(len(batches))
+    days = np.empty(len(batches))
+    quantity = np.empty(len(batches), dtype=np.int64)
+    cost = np.empty(len(batches))
+    retail = np.empty(len(batches))
+    for i, (_, branch, name, dosage, form, qty, expiry, unit_cost, unit_price) in enumerate(batches):
+        key = (branch, product_key(name, dosage, form))
+        product_idx[i] = products.setdefault(key, len(products))
+        rate[i] = rates.get(key, 0.0)
+        days[i] = (expiry - today).days
+        quantity[i] = qty
+        cost[i] = float(unit_cost or 0)
+        retail[i] = float(unit_price or 0)
+
+    # FEFO order: by product, then expiry
+    order = np.lexsort((days, product_idx))
+    product_idx, rate, days, quantity = product_idx[order], rate[order], days[order], quantity[order]
+    cost, retail = cost[order], retail[order]
+
+    starts = np.ones(len(order), dtype=bool)
+    starts[1:] = product_idx[1:] != product_idx[:-1]
+    demand = _units_demanded(rate, days)
+
+    sold = _fefo_sold(starts, demand, quantity)
+    unsold = quantity - sold
+
+    at_risk = np.flatnonzero(unsold > 0)
+    at_risk = at_risk[np.argsort(-(unsold[at_risk] * cost[at_risk]), kind='stable')]
+    return [{
+        'medicine_id': batches[order[i]][0],
+        'branch_id': batches[order[i]][1],
+        'quantity': int(quantity[i]),
+        'days_to_expiry': int(days[i]),
+        'daily_demand': round(float(rate[i]), 3),
+        'projected_sold': int(sold[i]),
+        'projected_unsold': int(unsold[i]),
+        'value_at_risk': round(float(unsold[i] * cost[i]), 2),
+        'retail_at_risk': round(float(unsold[i] * retail[i]), 2)
+    } for i in at_risk.tolist()]
+
+
+def refresh_expiry_forecast(today=None):
+    """Recompute the forecast for every branch and replace the cache"""
+    today = today or date.today()
+    rows = forecast_expiry_risk(today=today)
+
+    db.session.query(ExpiryRiskForecast).delete()
+    if rows:
+        db.session.execute(ExpiryRiskForecast.__table__.insert(), [
+            dict(row, daily_demand=Decimal(str(row['daily_demand'])),
+                 value_at_risk=Decimal(str(row['value_at_risk'])),
+                 retail_at_risk=Decimal(str(row['retail_at_risk'])), as_of=today)
+            for row in rows
+        ])
+
+    state = db.session.get(SnapshotState, SNAPSHOT_NAME)
+    if state is None:
+        state = SnapshotState(name=SNAPSHOT_NAME, as_of=today)
+        db.session.add(state)
+    state.as_of = today
+    db.session.commit()
+    return f'{len(rows)} batches at risk'
+
+
+register_job('expiry_forecast', refresh_expiry_forecast, at='00:30')
+
+
+def cached_forecast(branch_id=None, limit=100):
+    """(as_of, rows) from the cache, most value at risk first"""
+    state = db.session.get(SnapshotState, SNAPSHOT_NAME)
+    query = ExpiryRiskForecast.query
+    if branch_id is not None:
+        query = query.filter(ExpiryRiskForecast.branch_id == branch_id)
+    totals = query.with_entities(
+        db.func.count(ExpiryRiskForecast.medicine_id),
+        db.func.coalesce(db.func.sum(ExpiryRiskForecast.projected_unsold), 0),
+        db.func.coalesce(db.func.sum(ExpiryRiskForecast.value_at_risk), 0)
+    ).one()
+    rows = query.order_by(ExpiryRiskForecast.value_at_risk.desc()).limit(limit).all()
+    return {
+        'as_of': state.as_of.isoformat() if state else None,
+        'batches_at_risk': totals[0],
+        'units_at_risk': int(totals[1]),
+        'value_at_risk': float(totals[2]),
+        'batches': [row.to_dict() for row in rows]
+    }
+
+
+
+@event.listens_for(Medicine, 'before_delete')
+def _drop_forecast(mapper, connection, target):
+    # The foreign key may be missing (SQLite without enforcement), don't rely on its cascade
+    table = ExpiryRiskForecast.__table__
+    connection.execute(table.delete().where(table.c.medicine_id == target.id))
+
+if __name__ == "__main__":
+    import argparse
+
+    # Add the current directory to Python path
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+    from app import app
+
+    parser = argparse.ArgumentParser(description="Forecast stock that will expire before it sells")
+    parser.add_argument("--refresh", action="store_true", help="Recompute the forecast before reporting")
+    parser.add_argument("--branch-id", type=int, help="Only one branch")
+    parser.add_argument("--limit", type=int, default=20, help="Batches to list")
+
+    args = parser.parse_args()
+
+    with app.app_context():
+        try:
+            if args.refresh:
+                print(f"✅ {refresh_expiry_forecast()}")
+            result = cached_forecast(args.branch_id, args.limit)
+            if result['as_of'] is None:
+                print("⚠️  No forecast yet, run with --refresh")
+            else:
+                print(f"📅 Forecast as of {result['as_of']}: {result['batches_at_risk']} batches, "
+                      f"{result['units_at_risk']} units, {result['value_at_risk']:.2f} at risk")
+                for row in result['batches']:
+                    print(f"   ⏳ {row['name']} {row['batch_number']} (expires {row['expiry_date']}): "
+                          f"{row['projected_unsold']}/{row['quantity']} unsold, {row['value_at_risk']:.2f}")
+        except Exception as e:
+            print(f"❌ Error forecasting expiry risk: {str(e)}")
+            db.session.rollback()
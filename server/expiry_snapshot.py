@@ -0,0 +1,151 @@
+"""
+Materialised expiry snapshot.
+
+Expired / expiring-soon status only changes when the date rolls over or a
+batch is written, so instead of range-scanning expiry_date on every request
+the classification is kept in the medicine_expiry_status table. A daily
+scheduler job rebuilds it at midnight and mapper events patch single rows
+whenever a medicine is inserted, updated or deleted. Every process also
+rebuilds it at startup and worker warm-up when it is not current for today.
+
+Without a scheduler (``python scheduler.py --loop`` or SCHEDULER_ENABLED)
+the snapshot goes stale at midnight and filter_by_expiry falls back to the
+expiry_date range scan until the next restart: still correct, just slower.
+
+Rebuild manually with: python scheduler.py --run expiry_snapshot
+"""
+
+from datetime import date, timedelta
+from sqlalchemy import event, inspect, case, literal, and_
+from models import db, Medicine, MedicineExpiryStatus, SnapshotState
+from scheduler import register_job
+
+SNAPSHOT_NAME = 'expiry'
+EXPIRING_SOON_DAYS = 30
+
+EXPIRED = 'expired'
+EXPIRING_SOON = 'expiring_soon'
+
+# Date the snapshot was last confirmed current for in this process
+_current_for = None
+
+
+def classify(expiry_date, today=None):
+    """Expiry status of a single batch, None when it needs no attention"""
+    if expiry_date is None:
+        return None
+    today = today or date.today()
+    if expiry_date < today:
+        return EXPIRED
+    if expiry_date <= today + timedelta(days=EXPIRING_SOON_DAYS):
+        return EXPIRING_SOON
+    return None
+
+
+def rebuild_expiry_snapshot(today=None):
+    """Recompute the whole snapshot with one INSERT ... SELECT"""
+    global _current_for
+    today = today or date.today()
+    soon_date = today + timedelta(days=EXPIRING_SOON_DAYS)
+    status_table = MedicineExpiryStatus.__table__
+
+    classified = db.select(
+        Medicine.id,
+        Medicine.branch_id,
+        case((Medicine.expiry_date < today, EXPIRED), else_=EXPIRING_SOON),
+        literal(today)
+    ).where(Medicine.expiry_date <= soon_date)
+
+    db.session.execute(status_table.delete())
+    db.session.execute(
+        status_table.insert().from_select(['medicine_id', 'branch_id', 'status', 'as_of'], classified)
+    )
+
+    state = db.session.get(SnapshotState, SNAPSHOT_NAME)
+    if state is None:
+        state = SnapshotState(name=SNAPSHOT_NAME, as_of=today)
+        db.session.add(state)
+    state.as_of = today
+    db.session.commit()
+
+    _current_for = today
+    return db.session.query(db.func.count(MedicineExpiryStatus.medicine_id)).scalar()
+
+
+def snapshot_is_current():
+    """True when the snapshot was rebuilt for today's date"""
+    global _current_for
+    today = date.today()
+    if _current_for == today:
+        return True
+    state = db.session.get(SnapshotState, SNAPSHOT_NAME)
+    if state is not None and state.as_of == today:
+        _current_for = today
+        return True
+    return False
+
+
+def filter_by_expiry(query, status, branch_id=None):
+    """Restrict a Medicine query to one expiry status.
+
+    Reads the snapshot when it is current and falls back to the
+    expiry_date range scan when the midnight rebuild has not run yet.
+    Pass ``branch_id`` so the snapshot lookup uses its (branch_id, status)
+    index instead of every branch's rows.
+    """
+    if snapshot_is_current():
+        statuses = db.select(MedicineExpiryStatus.medicine_id).where(
+            MedicineExpiryStatus.status == status
+        )
+        if branch_id is not None:
+            statuses = statuses.where(MedicineExpiryStatus.branch_id == branch_id)
+        return query.filter(Medicine.id.in_(statuses))
+
+    today = date.today()
+    if status == EXPIRED:
+        return query.filter(Medicine.expiry_date < today)
+    soon_date = today + timedelta(days=EXPIRING_SOON_DAYS)
+    return query.filter(
+        and_(
+            Medicine.expiry_date >= today,
+            Medicine.expiry_date <= soon_date
+        )
+    )
+
+
+def expiry_snapshot_job():
+    """Rebuild unless already current; scheduler, startup and warm-up entry point"""
+    if snapshot_is_current():
+        return 'already current'
+    return f'{rebuild_expiry_snapshot()} batches classified'
+
+
+register_job('expiry_snapshot', expiry_snapshot_job, at='00:00')
+
+
+# =============================================================================
+# INCREMENTAL PATCHING ON WRITES
+# =============================================================================
+
+@event.listens_for(Medicine, 'after_insert')
+@event.listens_for(Medicine, 'after_update')
+def _patch_expiry_status(mapper, connection, target):
+    attrs = inspect(target).attrs
+    if not (attrs.expiry_date.history.has_changes() or attrs.branch_id.history.has_changes()):
+        return
+
+    status_table = MedicineExpiryStatus.__table__
+    today = date.today()
+    status = classify(target.expiry_date, today)
+
+    connection.execute(status_table.delete().where(status_table.c.medicine_id == target.id))
+    if status:
+        connection.execute(status_table.insert().values(
+            medicine_id=target.id, branch_id=target.branch_id, status=status, as_of=today
+        ))
+
+
+@event.listens_for(Medicine, 'before_delete')
+def _drop_expiry_status(mapper, connection, target):
+    status_table = MedicineExpiryStatus.__table__
+    connection.execute(status_table.delete().where(status_table.c.medicine_id == target.id))
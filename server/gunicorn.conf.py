@@ -0,0 +1,59 @@
+"""
+gunicorn settings for serving wsgi:app in production.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Tune with environment variables:
+
+    BIND / PORT            listen address (default 0.0.0.0:8000)
+    WEB_CONCURRENCY        worker processes (default 2 * CPUs + 1)
+    GUNICORN_THREADS       threads per worker (default 4, gthread workers)
+    GUNICORN_TIMEOUT       seconds before a silent worker is restarted (default 30)
+    GUNICORN_MAX_REQUESTS  recycle workers after this many requests (default 0, off)
+
+The app is preloaded in the master, which loads the reference cache, the
+typeahead index and today's expiry snapshot once; workers inherit them
+across fork instead of each querying for them again. Connections must not
+be shared, so every worker disposes the pool it inherited right after fork.
+It then warms up (see warmup.py): opens fresh connections and serves the
+warm-up paths, rebuilding only what the master failed to load. Size
+DB_POOL_SIZE to cover GUNICORN_THREADS plus PARALLEL_QUERY_WORKERS.
+"""
+
+import os
+import multiprocessing
+
+# The scheduler thread must not run in the preloading master, use `scheduler.py --loop`
+os.environ.setdefault("SCHEDULER_ENABLED", "0")
+
+bind = os.environ.get("BIND", f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ.get("WEB_CONCURRENCY", str(multiprocessing.cpu_count() * 2 + 1)))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+worker_class = "gthread"
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    """Drop pooled connections inherited from the master without closing them"""
+    from app import app
+    from models import db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    """Warm the worker up before its first request"""
+    from app import app
+    from warmup import warm_up
+
+    state = warm_up(app)
+    worker.log.info(f"Worker {worker.pid} warm in {state['warmup_seconds']}s" if state['ready']
+                    else f"Worker {worker.pid} warm-up failed: {state['error']}")
@@ -0,0 +1,232 @@
+"""
+Idempotency-Key support for mutating routes.
+
+Clients send ``Idempotency-Key: <unique string>`` with a write. The first
+request claims the key and its response is stored in idempotency_keys;
+retries with the same key get the stored response back (with an
+``Idempotent-Replayed: true`` header) without running the view or touching
+medicines. Reusing a key for a different method, path, branch or body is
+rejected with 422, and a retry that arrives while the first attempt is
+still running gets 409.
+
+Keys live in their own short transactions, so a rolled-back write never
+loses its claim. Only successful (< 400) responses are stored. Errors
+changed nothing (validation, conflicts, 429/503 from admission control, 5xx)
+and release the key, so the client can retry with it. Put ``@admit`` outside
+``@idempotent`` so a rejected request never claims a key at all.
+Replays carry the stored body, status and REPLAY_HEADERS (ETag and friends).
+Entries expire after IDEMPOTENCY_TTL seconds and the table is capped at
+IDEMPOTENCY_MAX_KEYS rows. Every IDEMPOTENCY_PRUNE_EVERY-th claim in a
+process enforces both, so the table stays bounded without a scheduler, and
+the scheduled purge catches up on idle periods. Request bodies are hashed
+in chunks into a spooled copy that the view then reads, so keyed uploads
+are never held in memory whole.
+"""
+
+import hashlib
+import itertools
+import json
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, jsonify, make_response, current_app
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import db, IdempotencyKey
+from scheduler import register_job
+from metrics import register_metrics_source
+
+HEADER = 'Idempotency-Key'
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_KEYS = 100000
+DEFAULT_PRUNE_EVERY = 1000
+# Bodies are hashed in chunks of this size; spooled copies larger than SPOOL_MEMORY go to disk
+BODY_CHUNK_SIZE = 64 * 1024
+SPOOL_MEMORY = 1024 * 1024
+# A pending claim older than this is assumed abandoned by a crashed worker
+PENDING_TIMEOUT = timedelta(seconds=60)
+# Headers stored with the response and sent again on replay
+REPLAY_HEADERS = ('ETag', 'Last-Modified', 'Location', 'Vary')
+
+CLAIMED, REPLAY, IN_PROGRESS, MISMATCH = 'claimed', 'replay', 'in_progress', 'mismatch'
+
+_counts = {'executed': 0, 'replayed': 0, 'in_progress': 0, 'mismatch': 0}
+_counts_lock = threading.Lock()
+_claims = itertools.count(1)
+
+
+def _count(field):
+    with _counts_lock:
+        _counts[field] += 1
+
+
+register_metrics_source('idempotency', lambda: dict(_counts))
+
+
+def _fingerprint():
+    digest = hashlib.sha256()
+    for part in (request.method, request.path, request.headers.get('X-Branch-Id', ''),
+                 request.query_string.decode()):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    _hash_body(digest)
+    return digest.hexdigest()
+
+
+def _hash_body(digest):
+    """Feed the body to ``digest`` and leave an identical stream for the view"""
+    stream = request.stream
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY)
+    for chunk in iter(lambda: stream.read(BODY_CHUNK_SIZE), b''):
+        digest.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    # request.stream is a cached property, form parsing and get_data() read the copy
+    request.__dict__['stream'] = spool
+
+
+def _prune(session, now, max_keys):
+    """Drop expired keys and trim the oldest beyond ``max_keys``; caller commits"""
+    expired = session.query(IdempotencyKey).filter(
+        IdempotencyKey.expires_at < now
+    ).delete(synchronize_session=False)
+
+    # The expires_at index finds the (max_keys + 1)-th newest key without counting the table
+    cutoff = session.query(IdempotencyKey.expires_at).order_by(
+        IdempotencyKey.expires_at.desc()
+    ).offset(max_keys).limit(1).scalar()
+    trimmed = 0
+    if cutoff is not None:
+        trimmed = session.query(IdempotencyKey).filter(
+            IdempotencyKey.expires_at <= cutoff
+        ).delete(synchronize_session=False)
+    return expired, trimmed
+
+
+def _claim(key, fingerprint, ttl, max_keys, prune=False):
+    """Claim ``key`` for this request or return the stored record"""
+    with Session(db.engine) as session:
+        now = datetime.utcnow()
+        record = session.get(IdempotencyKey, key)
+        if record is not None and record.expires_at < now:
+            session.delete(record)
+            session.commit()
+            record = None
+
+        if record is None:
+            session.add(IdempotencyKey(
+                key=key, fingerprint=fingerprint, created_at=now,
+                expires_at=now + timedelta(seconds=ttl)
+            ))
+            try:
+                session.commit()
+            except IntegrityError:
+                # Another worker claimed it first
+                session.rollback()
+                record = session.get(IdempotencyKey, key)
+                if record is None:
+                    # ...and already released it, let the client retry
+                    return IN_PROGRESS, None
+            else:
+                if prune:
+                    _prune(session, now, max_keys)
+                    session.commit()
+                return CLAIMED, None
+
+        if record.fingerprint != fingerprint:
+            return MISMATCH, None
+        if record.status_code is None:
+            if now - record.created_at > PENDING_TIMEOUT:
+                # Only one of several retries may take over an abandoned claim
+                reclaimed = session.query(IdempotencyKey).filter(
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.status_code.is_(None),
+                    IdempotencyKey.created_at == record.created_at
+                ).update({'created_at': now}, synchronize_session=False)
+                session.commit()
+                if reclaimed:
+                    return CLAIMED, None
+            return IN_PROGRESS, None
+        session.expunge(record)
+        return REPLAY, record
+
+
+def _store(key, response):
+    with Session(db.engine) as session:
+        record = session.get(IdempotencyKey, key)
+        if record is None:
+            return
+        if response.status_code >= 400:
+            # Errors changed nothing, the client may retry with the same key
+            session.delete(record)
+        else:
+            record.status_code = response.status_code
+            record.content_type = response.content_type
+            record.response_body = response.get_data(as_text=True)
+            record.response_headers = json.dumps({
+                name: response.headers[name] for name in REPLAY_HEADERS if name in response.headers
+            })
+        session.commit()
+
+
+def _release(key):
+    with Session(db.engine) as session:
+        session.query(IdempotencyKey).filter_by(key=key).delete()
+        session.commit()
+
+
+def idempotent(view):
+    """Decorator: honour an Idempotency-Key header on a mutating route"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'error': f'{HEADER} must be at most 255 characters'}), 400
+
+        config = current_app.config
+        outcome, record = _claim(
+            key, _fingerprint(),
+            config.get('IDEMPOTENCY_TTL', DEFAULT_TTL),
+            config.get('IDEMPOTENCY_MAX_KEYS', DEFAULT_MAX_KEYS),
+            prune=next(_claims) % config.get('IDEMPOTENCY_PRUNE_EVERY', DEFAULT_PRUNE_EVERY) == 0
+        )
+        if outcome == MISMATCH:
+            _count('mismatch')
+            return jsonify({'error': f'{HEADER} was already used for a different request'}), 422
+        if outcome == IN_PROGRESS:
+            _count('in_progress')
+            return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409
+        if outcome == REPLAY:
+            _count('replayed')
+            response = current_app.response_class(
+                record.response_body, status=record.status_code, content_type=record.content_type
+            )
+            response.headers.update(json.loads(record.response_headers or '{}'))
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        _count('executed')
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            _release(key)
+            raise
+        _store(key, response)
+        return response
+    return wrapper
+
+
+def purge_idempotency_keys():
+    """Drop expired keys and cap the table at IDEMPOTENCY_MAX_KEYS"""
+    expired, trimmed = _prune(
+        db.session, datetime.utcnow(),
+        current_app.config.get('IDEMPOTENCY_MAX_KEYS', DEFAULT_MAX_KEYS)
+    )
+    db.session.commit()
+    return f'{expired} expired, {trimmed} trimmed'
+
+
+register_job('idempotency_purge', purge_idempotency_keys, every=900)
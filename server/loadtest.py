@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Closed-loop load generator with a pharmacy-shaped workload mix.
+
+Each virtual user keeps one keep-alive connection open and repeatedly picks
+a route from the weighted mix. It sends the request, waits for the
+response, optionally thinks, and then goes again. Throughput is therefore
+what the server sustains with N concurrent users, not a fixed arrival rate.
+After the run it prints throughput, per-route latency percentiles and error
+rates, and saves them as JSON so runs can be compared.
+
+    python loadtest.py --seed --start-server --users 20 --duration 60
+    python loadtest.py --url http://localhost:8000 --mix search=50,update=30,report=20
+    python loadtest.py --url http://localhost:8000 --compare loadtest_results/<previous>.json
+
+--seed runs seed.py against the database app.py is configured for, and
+--start-server runs the app on a local threaded development server. For
+production-like numbers, point --url at a server started the way
+production runs it instead.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import string
+import argparse
+import threading
+import subprocess
+import http.client
+from datetime import datetime
+from urllib.parse import urlsplit, quote
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(SERVER_DIR, 'loadtest_results')
+
+# Default traffic shape: mostly lookups and stock updates, a few reports and creates
+DEFAULT_MIX = {
+    'search': 30,
+    'suggest': 15,
+    'list': 10,
+    'get': 10,
+    'update': 20,
+    'alerts': 5,
+    'report': 4,
+    'expiry_calendar': 3,
+    'create': 3,
+}
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class Catalog:
+    """Ids, names and reference data sampled from the server before the run"""
+
+    def __init__(self, medicine_ids, names, manufacturer_ids, category_ids):
+        self.medicine_ids = medicine_ids
+        self.names = names
+        self.manufacturer_ids = manufacturer_ids
+        self.category_ids = category_ids
+
+    @classmethod
+    def load(cls, base_url, max_pages=20):
+        conn = _connect(base_url)
+        medicine_ids, names = [], []
+        for page in range(1, max_pages + 1):
+            status, body = _request(conn, base_url, 'GET', f'/api/medicines?page={page}&per_page=200')
+            if status != 200:
+                raise RuntimeError(f'GET /api/medicines returned {status}')
+            medicines = json.loads(body)['medicines']
+            medicine_ids += [m['id'] for m in medicines]
+            names += [m['name'] for m in medicines]
+            if len(medicines) < 200:
+                break
+        manufacturers = json.loads(_request(conn, base_url, 'GET', '/api/manufacturers')[1])['manufacturers']
+        categories = json.loads(_request(conn, base_url, 'GET', '/api/categories')[1])['categories']
+        conn.close()
+        if not medicine_ids:
+            raise RuntimeError('No medicines to drive load against, run with --seed')
+        return cls(medicine_ids, names, [m['id'] for m in manufacturers], [c['id'] for c in categories])
+
+    def search_term(self):
+        name = random.choice(self.names)
+        return name.split()[0][:random.randint(3, 6)]
+
+
+# =============================================================================
+# WORKLOAD
+# =============================================================================
+
+def _search(catalog, user):
+    return 'GET', f'/api/medicines?search={quote(catalog.search_term())}&per_page=20', None
+
+
+def _suggest(catalog, user):
+    return 'GET', f'/api/medicines/suggest?q={quote(catalog.search_term()[:3])}', None
+
+
+def _list(catalog, user):
+    return 'GET', f'/api/medicines?page={random.randint(1, 5)}&per_page=20', None
+
+
+def _get(catalog, user):
+    return 'GET', f'/api/medicines/{random.choice(catalog.medicine_ids)}', None
+
+
+def _update(catalog, user):
+    return 'PUT', f'/api/medicines/{random.choice(catalog.medicine_ids)}', {'quantity': random.randint(0, 500)}
+
+
+def _alerts(catalog, user):
+    return 'GET', '/api/medicines/alerts', None
+
+
+def _report(catalog, user):
+    return 'GET', '/api/medicines/reports/inventory', None
+
+
+def _expiry_calendar(catalog, user):
+    return 'GET', f"/api/medicines/reports/expiry-calendar?bucket={random.choice(['week', 'month'])}", None
+
+
+def _create(catalog, user):
+    user.created += 1
+    suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+    return 'POST', '/api/medicines', {
+        'name': f'Loadtest {random.choice(catalog.names)}',
+        'batch_number': f'LT{user.number}-{user.created}-{suffix}',
+        'selling_price': round(random.uniform(5, 500), 2),
+        'cost_price': round(random.uniform(1, 5), 2),
+        'quantity': random.randint(10, 500),
+        'manufacturer_id': random.choice(catalog.manufacturer_ids),
+        'category_id': random.choice(catalog.category_ids),
+        'expiry_date': f'{datetime.now().year + 2}-06-30'
+    }
+
+
+ROUTES = {
+    'search': _search,
+    'suggest': _suggest,
+    'list': _list,
+    'get': _get,
+    'update': _update,
+    'alerts': _alerts,
+    'report': _report,
+    'expiry_calendar': _expiry_calendar,
+    'create': _create,
+}
+
+
+def parse_mix(text):
+    """'search=40,update=20' -> {'search': 40, 'update': 20}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ROUTES:
+            raise ValueError(f'Unknown route {name!r}, choose from: {", ".join(ROUTES)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# =============================================================================
+# VIRTUAL USERS
+# =============================================================================
+
+def _connect(base_url):
+    parts = urlsplit(base_url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    return connection_class(parts.hostname, parts.port, timeout=30)
+
+
+def _request(conn, base_url, method, path, body=None):
+    headers = {'Accept': 'application/json'}
+    payload = None
+    if body is not None:
+        payload = json.dumps(body)
+        headers['Content-Type'] = 'application/json'
+    conn.request(method, path, body=payload, headers=headers)
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+class VirtualUser(threading.Thread):
+    """Issues requests back to back until the deadline, recording (route, status, seconds)"""
+
+    def __init__(self, number, base_url, catalog, mix, warmup_until, deadline, think_time):
+        super().__init__(name=f'vu-{number}', daemon=True)
+        self.number = number
+        self.base_url = base_url
+        self.catalog = catalog
+        self.routes = list(mix)
+        self.weights = [mix[name] for name in self.routes]
+        self.warmup_until = warmup_until
+        self.deadline = deadline
+        self.think_time = think_time
+        self.created = 0
+        self.samples = []
+
+    def run(self):
+        conn = _connect(self.base_url)
+        while time.monotonic() < self.deadline:
+            route = random.choices(self.routes, self.weights)[0]
+            method, path, body = ROUTES[route](self.catalog, self)
+            started = time.monotonic()
+            try:
+                status, _ = _request(conn, self.base_url, method, path, body)
+            except (OSError, http.client.HTTPException):
+                status = 0
+                conn.close()
+                conn = _connect(self.base_url)
+            finished = time.monotonic()
+            if started >= self.warmup_until:
+                self.samples.append((route, status, finished - started))
+            if self.think_time:
+                time.sleep(random.expovariate(1 / self.think_time))
+        conn.close()
+
+
+# =============================================================================
+# REPORTING
+# =============================================================================
+
+def _percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(percentile / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def _summarise(samples, duration):
+    latencies = sorted(seconds for _, _, seconds in samples)
+    errors = sum(1 for _, status, _ in samples if status == 0 or status >= 500)
+    shed = sum(1 for _, status, _ in samples if status in (429, 503))
+    client_errors = sum(1 for _, status, _ in samples if 400 <= status < 500 and status != 429)
+    summary = {
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / duration, 2) if duration else 0,
+        'error_rate': round(errors / len(samples), 4) if samples else 0,
+        'shed_rate': round(shed / len(samples), 4) if samples else 0,
+        'client_error_rate': round(client_errors / len(samples), 4) if samples else 0,
+        'mean_ms': round(1000 * sum(latencies) / len(latencies), 2) if latencies else None,
+        'max_ms': round(1000 * latencies[-1], 2) if latencies else None,
+    }
+    for percentile in PERCENTILES:
+        value = _percentile(latencies, percentile)
+        summary[f'p{percentile}_ms'] = round(1000 * value, 2) if value is not None else None
+    return summary
+
+
+def build_report(samples, duration, config):
+    by_route = {}
+    for sample in samples:
+        by_route.setdefault(sample[0], []).append(sample)
+    return {
+        'started_at': config['started_at'],
+        'config': config,
+        'overall': _summarise(samples, duration),
+        'routes': {route: _summarise(route_samples, duration) for route, route_samples in sorted(by_route.items())}
+    }
+
+
+def print_report(report):
+    overall = report['overall']
+    print(f"\n📊 {overall['requests']} requests, {overall['throughput_rps']} req/s, "
+          f"errors {overall['error_rate']:.2%}, shed {overall['shed_rate']:.2%}")
+    header = f"{'route':<16}{'reqs':>7}{'rps':>9}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}{'err%':>7}"
+    print(header)
+    print('-' * len(header))
+    for route, stats in list(report['routes'].items()) + [('ALL', overall)]:
+        print(f"{route:<16}{stats['requests']:>7}{stats['throughput_rps']:>9}"
+              f"{stats['p50_ms']:>9}{stats['p90_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}"
+              f"{stats['max_ms']:>9}{100 * stats['error_rate']:>7.2f}")
+
+
+def print_comparison(report, previous):
+    print(f"\n🔁 Compared with run of {previous['started_at']}:")
+    routes = sorted(set(report['routes']) | set(previous['routes'])) + ['ALL']
+    for route in routes:
+        now = report['overall'] if route == 'ALL' else report['routes'].get(route)
+        before = previous['overall'] if route == 'ALL' else previous['routes'].get(route)
+        if not now or not before:
+            continue
+
+        def change(field):
+            if not before[field] or now[field] is None:
+                return 'n/a'
+            return f"{100 * (now[field] - before[field]) / before[field]:+.1f}%"
+        print(f"   {route:<16} rps {change('throughput_rps'):>8}   p95 {change('p95_ms'):>8}   p99 {change('p99_ms'):>8}")
+
+
+def save_report(report, results_dir):
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"loadtest-{report['started_at'].replace(':', '')}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+# =============================================================================
+# SERVER AND SEEDING
+# =============================================================================
+
+def seed():
+    print("🌱 Seeding through seed.py...")
+    subprocess.run([sys.executable, os.path.join(SERVER_DIR, 'seed.py'), '--clear'], cwd=SERVER_DIR, check=True)
+
+
+def start_server(host, port):
+    """Run app.py's app on a threaded local server, returns the process"""
+    code = f"from app import app; app.run(host={host!r}, port={port}, threaded=True, use_reloader=False)"
+    env = dict(os.environ, SCHEDULER_ENABLED='0')
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=SERVER_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://{host}:{port}'
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError('Server exited during startup')
+        try:
+            conn = _connect(base_url)
+            if _request(conn, base_url, 'GET', '/api/categories')[0] == 200:
+                conn.close()
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('Server did not become ready')
+
+
+def run(base_url, users, duration, warmup, mix, think_time):
+    catalog = Catalog.load(base_url)
+    started_at = datetime.now().isoformat(timespec='seconds')
+    now = time.monotonic()
+    warmup_until = now + warmup
+    deadline = warmup_until + duration
+    virtual_users = [
+        VirtualUser(number, base_url, catalog, mix, warmup_until, deadline, think_time)
+        for number in range(users)
+    ]
+    print(f"🚀 {users} virtual users for {duration}s (+{warmup}s warm-up) against {base_url}")
+    for user in virtual_users:
+        user.start()
+    for user in virtual_users:
+        user.join()
+
+    samples = [sample for user in virtual_users for sample in user.samples]
+    config = {
+        'started_at': started_at,
+        'base_url': base_url,
+        'users': users,
+        'duration': duration,
+        'warmup': warmup,
+        'think_time': think_time,
+        'mix': mix,
+        'catalog_size': len(catalog.medicine_ids)
+    }
+    return build_report(samples, duration, config)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Closed-loop load test of the medicines API")
+    parser.add_argument("--url", help="Target an already running server (default: start one locally)")
+    parser.add_argument("--start-server", action="store_true", help="Start app.py on --host/--port for the run")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--seed", action="store_true", help="Clear and reseed the database with seed.py first")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="Unmeasured seconds before the run")
+    parser.add_argument("--think-time", type=float, default=0, help="Mean pause between a user's requests (s)")
+    parser.add_argument("--mix", help="Weighted routes, e.g. search=40,update=20,report=5 (default: built-in mix)")
+    parser.add_argument("--results-dir", default=RESULTS_DIR, help="Where JSON results are saved")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+
+    args = parser.parse_args()
+
+    server = None
+    try:
+        mix = parse_mix(args.mix) if args.mix else dict(DEFAULT_MIX)
+        if args.seed:
+            seed()
+        base_url = args.url
+        if not base_url or args.start_server:
+            server = start_server(args.host, args.port)
+            base_url = f'http://{args.host}:{args.port}'
+            print(f"✅ Server started on {base_url}")
+
+        report = run(base_url, args.users, args.duration, args.warmup, mix, args.think_time)
+        print_report(report)
+        print(f"\n💾 Results saved to {save_report(report, args.results_dir)}")
+        if args.compare:
+            with open(args.compare) as f:
+                print_comparison(report, json.load(f))
+    except Exception as e:
+        print(f"❌ Load test failed: {str(e)}")
+        sys.exit(1)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
@@ -0,0 +1,23 @@
+"""
+Process-local operational metrics.
+
+Subsystems register a callable returning a JSON-serialisable dict and
+``GET /api/metrics`` reports all of them. Counters are per worker process.
+"""
+
+import threading
+
+_sources = {}
+_lock = threading.Lock()
+
+
+def register_metrics_source(name, collect):
+    """Expose ``collect()`` under ``name`` in the metrics endpoint"""
+    with _lock:
+        _sources[name] = collect
+
+
+def collect_metrics():
+    with _lock:
+        sources = dict(_sources)
+    return {name: collect() for name, collect in sorted(sources.items())}
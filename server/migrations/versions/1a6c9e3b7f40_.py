@@ -0,0 +1,35 @@
+"""medicine usage history for reorder suggestions
+
+Revision ID: 1a6c9e3b7f40
+Revises: 8d3f5a2c6e17
+Create Date: 2026-10-19 15:40:19.734102
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a6c9e3b7f40'
+down_revision = '8d3f5a2c6e17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('medicine_usage',
+    sa.Column('branch_id', sa.Integer(), nullable=False),
+    sa.Column('product_key', sa.String(length=200), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('quantity_used', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('branch_id', 'product_key', 'day')
+    )
+    with op.batch_alter_table('medicine_usage', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_medicine_usage_day'), ['day'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('medicine_usage', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_medicine_usage_day'))
+
+    op.drop_table('medicine_usage')
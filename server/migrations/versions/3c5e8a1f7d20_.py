@@ -0,0 +1,42 @@
+"""expiry snapshot tables
+
+Revision ID: 3c5e8a1f7d20
+Revises: 881109db4243
+Create Date: 2026-10-19 09:12:44.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c5e8a1f7d20'
+down_revision = '881109db4243'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('snapshot_state',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('as_of', sa.Date(), nullable=False),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table('medicine_expiry_status',
+    sa.Column('medicine_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('as_of', sa.Date(), nullable=False),
+    sa.ForeignKeyConstraint(['medicine_id'], ['medicines.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('medicine_id')
+    )
+    with op.batch_alter_table('medicine_expiry_status', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_medicine_expiry_status_status'), ['status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('medicine_expiry_status', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_medicine_expiry_status_status'))
+
+    op.drop_table('medicine_expiry_status')
+    op.drop_table('snapshot_state')
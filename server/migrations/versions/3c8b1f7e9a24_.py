@@ -0,0 +1,41 @@
+"""audit log
+
+Revision ID: 3c8b1f7e9a24
+Revises: 6e9a4c2d8b15
+Create Date: 2026-10-19 18:05:13.441902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c8b1f7e9a24'
+down_revision = '6e9a4c2d8b15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('audit_log',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('medicine_id', sa.Integer(), nullable=False),
+    sa.Column('branch_id', sa.Integer(), nullable=False),
+    sa.Column('action', sa.String(length=10), nullable=False),
+    sa.Column('changes', sa.JSON(), nullable=False),
+    sa.Column('actor', sa.String(length=100), nullable=True),
+    sa.Column('request_path', sa.String(length=255), nullable=True),
+    sa.Column('changed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('audit_log', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_audit_log_changed_at'), ['changed_at'], unique=False)
+        batch_op.create_index('ix_audit_log_medicine', ['medicine_id', 'changed_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('audit_log', schema=None) as batch_op:
+        batch_op.drop_index('ix_audit_log_medicine')
+        batch_op.drop_index(batch_op.f('ix_audit_log_changed_at'))
+
+    op.drop_table('audit_log')
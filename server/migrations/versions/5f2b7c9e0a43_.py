@@ -0,0 +1,45 @@
+"""inventory valuation time-series
+
+Revision ID: 5f2b7c9e0a43
+Revises: a9d4b6e2c715
+Create Date: 2026-10-19 11:26:05.904118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2b7c9e0a43'
+down_revision = 'a9d4b6e2c715'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('inventory_valuations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('period', sa.String(length=10), nullable=False),
+    sa.Column('period_start', sa.Date(), nullable=False),
+    sa.Column('dimension', sa.String(length=20), nullable=False),
+    sa.Column('dimension_id', sa.Integer(), nullable=False),
+    sa.Column('days', sa.Integer(), nullable=False),
+    sa.Column('medicine_count', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.BigInteger(), nullable=False),
+    sa.Column('selling_value', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('cost_value', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('avg_quantity', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('avg_selling_value', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('avg_cost_value', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('period', 'dimension', 'dimension_id', 'period_start', name='uq_inventory_valuation_point')
+    )
+    with op.batch_alter_table('inventory_valuations', schema=None) as batch_op:
+        batch_op.create_index('ix_inventory_valuation_range', ['period', 'dimension', 'period_start'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('inventory_valuations', schema=None) as batch_op:
+        batch_op.drop_index('ix_inventory_valuation_range')
+
+    op.drop_table('inventory_valuations')
@@ -0,0 +1,57 @@
+"""medicines archive
+
+Revision ID: 6e9a4c2d8b15
+Revises: b5d2e8f1a936
+Create Date: 2026-10-19 16:38:27.905611
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e9a4c2d8b15'
+down_revision = 'b5d2e8f1a936'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('medicines_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('branch_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('batch_number', sa.String(length=50), nullable=False),
+    sa.Column('price', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('cost_price', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('selling_price', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('minimum_stock', sa.Integer(), nullable=True),
+    sa.Column('manufacturer', sa.String(length=100), nullable=True),
+    sa.Column('category', sa.String(length=50), nullable=True),
+    sa.Column('manufacturer_id', sa.Integer(), nullable=True),
+    sa.Column('category_id', sa.Integer(), nullable=True),
+    sa.Column('dosage', sa.String(length=50), nullable=True),
+    sa.Column('form', sa.String(length=30), nullable=True),
+    sa.Column('purchase_date', sa.Date(), nullable=True),
+    sa.Column('expiry_date', sa.Date(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('version', sa.Integer(), server_default='1', nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('medicines_archive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_medicines_archive_archived_at'), ['archived_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_medicines_archive_batch_number'), ['batch_number'], unique=False)
+        batch_op.create_index('ix_medicines_archive_branch_expiry', ['branch_id', 'expiry_date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('medicines_archive', schema=None) as batch_op:
+        batch_op.drop_index('ix_medicines_archive_branch_expiry')
+        batch_op.drop_index(batch_op.f('ix_medicines_archive_batch_number'))
+        batch_op.drop_index(batch_op.f('ix_medicines_archive_archived_at'))
+
+    op.drop_table('medicines_archive')
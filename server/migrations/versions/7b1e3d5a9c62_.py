@@ -0,0 +1,61 @@
+"""branches and branch-scoped medicine indexes
+
+Revision ID: 7b1e3d5a9c62
+Revises: 5f2b7c9e0a43
+Create Date: 2026-10-19 12:48:31.076215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b1e3d5a9c62'
+down_revision = '5f2b7c9e0a43'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    branches = op.create_table('branches',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('code', sa.String(length=20), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('address', sa.Text(), nullable=True),
+    sa.Column('phone', sa.String(length=20), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('code')
+    )
+    # Existing single-branch data belongs to the default branch
+    op.bulk_insert(branches, [{'id': 1, 'code': 'MAIN', 'name': 'Main Branch'}])
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("SELECT setval(pg_get_serial_sequence('branches', 'id'), (SELECT MAX(id) FROM branches))")
+
+    with op.batch_alter_table('medicines', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('branch_id', sa.Integer(), server_default='1', nullable=False))
+        batch_op.create_foreign_key('fk_medicines_branch_id', 'branches', ['branch_id'], ['id'])
+        batch_op.create_index('ix_medicines_branch_expiry', ['branch_id', 'expiry_date'], unique=False)
+        batch_op.create_index('ix_medicines_branch_category', ['branch_id', 'category_id'], unique=False)
+        batch_op.create_index('ix_medicines_branch_manufacturer', ['branch_id', 'manufacturer_id'], unique=False)
+        batch_op.create_index('ix_medicines_branch_batch', ['branch_id', 'batch_number'], unique=False)
+
+    with op.batch_alter_table('medicine_expiry_status', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('branch_id', sa.Integer(), server_default='1', nullable=False))
+        batch_op.create_index('ix_medicine_expiry_status_branch', ['branch_id', 'status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('medicine_expiry_status', schema=None) as batch_op:
+        batch_op.drop_index('ix_medicine_expiry_status_branch')
+        batch_op.drop_column('branch_id')
+
+    with op.batch_alter_table('medicines', schema=None) as batch_op:
+        batch_op.drop_index('ix_medicines_branch_batch')
+        batch_op.drop_index('ix_medicines_branch_manufacturer')
+        batch_op.drop_index('ix_medicines_branch_category')
+        batch_op.drop_index('ix_medicines_branch_expiry')
+        batch_op.drop_constraint('fk_medicines_branch_id', type_='foreignkey')
+        batch_op.drop_column('branch_id')
+
+    op.drop_table('branches')
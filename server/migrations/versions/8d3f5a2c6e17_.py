@@ -0,0 +1,43 @@
+"""medicine price history
+
+Revision ID: 8d3f5a2c6e17
+Revises: e4a7c1d9b258
+Create Date: 2026-10-19 15:12:44.208317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3f5a2c6e17'
+down_revision = 'e4a7c1d9b258'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('medicine_price_history',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('medicine_id', sa.Integer(), nullable=False),
+    sa.Column('branch_id', sa.Integer(), nullable=False),
+    sa.Column('change_id', sa.String(length=32), nullable=False),
+    sa.Column('old_selling_price', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('new_selling_price', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('old_cost_price', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('new_cost_price', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('reason', sa.String(length=200), nullable=True),
+    sa.Column('changed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('medicine_price_history', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_medicine_price_history_change_id'), ['change_id'], unique=False)
+        batch_op.create_index('ix_medicine_price_history_medicine', ['medicine_id', 'changed_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('medicine_price_history', schema=None) as batch_op:
+        batch_op.drop_index('ix_medicine_price_history_medicine')
+        batch_op.drop_index(batch_op.f('ix_medicine_price_history_change_id'))
+
+    op.drop_table('medicine_price_history')
@@ -0,0 +1,56 @@
+"""stock movement ledger and balance snapshots
+
+Revision ID: 9f4d2a6c1e83
+Revises: 3c8b1f7e9a24
+Create Date: 2026-10-19 19:22:47.610385
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9f4d2a6c1e83'
+down_revision = '3c8b1f7e9a24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stock_movements',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('medicine_id', sa.Integer(), nullable=False),
+    sa.Column('branch_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('reference', sa.String(length=100), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('compacted_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('stock_movements', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_stock_movements_created_at'), ['created_at'], unique=False)
+        batch_op.create_index('ix_stock_movements_medicine', ['medicine_id', 'created_at'], unique=False)
+        batch_op.create_index('ix_stock_movements_pending', ['id'], unique=False,
+                              postgresql_where=sa.text('compacted_at IS NULL'),
+                              sqlite_where=sa.text('compacted_at IS NULL'))
+
+    op.create_table('stock_balance_snapshots',
+    sa.Column('medicine_id', sa.Integer(), nullable=False),
+    sa.Column('snapshot_date', sa.Date(), nullable=False),
+    sa.Column('branch_id', sa.Integer(), nullable=False),
+    sa.Column('balance', sa.Integer(), nullable=False),
+    sa.Column('closing_at', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('medicine_id', 'snapshot_date')
+    )
+
+
+def downgrade():
+    op.drop_table('stock_balance_snapshots')
+    with op.batch_alter_table('stock_movements', schema=None) as batch_op:
+        batch_op.drop_index('ix_stock_movements_pending')
+        batch_op.drop_index('ix_stock_movements_medicine')
+        batch_op.drop_index(batch_op.f('ix_stock_movements_created_at'))
+
+    op.drop_table('stock_movements')
@@ -0,0 +1,28 @@
+"""index medicine foreign keys
+
+Revision ID: a9d4b6e2c715
+Revises: 3c5e8a1f7d20
+Create Date: 2026-10-19 10:03:17.552940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d4b6e2c715'
+down_revision = '3c5e8a1f7d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('medicines', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_medicines_category_id'), ['category_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_medicines_manufacturer_id'), ['manufacturer_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('medicines', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_medicines_manufacturer_id'))
+        batch_op.drop_index(batch_op.f('ix_medicines_category_id'))
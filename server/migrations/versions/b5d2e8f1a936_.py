@@ -0,0 +1,58 @@
+"""cached expiry-risk forecast
+
+Revision ID: b5d2e8f1a936
+Revises: 1a6c9e3b7f40
+Create Date: 2026-10-19 16:05:52.118430
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d2e8f1a936'
+down_revision = '1a6c9e3b7f40'
+branch_labels = None
+depends_on = None
+
+
+def _medicines_partitioned():
+    bind = op.get_bind()
+    return bind.dialect.name == 'postgresql' and bool(bind.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table pt "
+        "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = 'medicines'"
+    )).scalar())
+
+
+def upgrade():
+    # A partitioned medicines table is only unique on (id, branch_id)
+    if _medicines_partitioned():
+        medicine_fk = sa.ForeignKeyConstraint(['medicine_id', 'branch_id'], ['medicines.id', 'medicines.branch_id'],
+                                              ondelete='CASCADE', onupdate='CASCADE')
+    else:
+        medicine_fk = sa.ForeignKeyConstraint(['medicine_id'], ['medicines.id'], ondelete='CASCADE')
+    op.create_table('expiry_risk_forecast',
+    sa.Column('medicine_id', sa.Integer(), nullable=False),
+    sa.Column('branch_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('days_to_expiry', sa.Integer(), nullable=False),
+    sa.Column('daily_demand', sa.Numeric(precision=12, scale=3), nullable=False),
+    sa.Column('projected_sold', sa.Integer(), nullable=False),
+    sa.Column('projected_unsold', sa.Integer(), nullable=False),
+    sa.Column('value_at_risk', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('retail_at_risk', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('as_of', sa.Date(), nullable=False),
+    medicine_fk,
+    sa.PrimaryKeyConstraint('medicine_id')
+    )
+    with op.batch_alter_table('expiry_risk_forecast', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_expiry_risk_forecast_value_at_risk'), ['value_at_risk'], unique=False)
+        batch_op.create_index('ix_expiry_risk_branch_value', ['branch_id', 'value_at_risk'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('expiry_risk_forecast', schema=None) as batch_op:
+        batch_op.drop_index('ix_expiry_risk_branch_value')
+        batch_op.drop_index(batch_op.f('ix_expiry_risk_forecast_value_at_risk'))
+
+    op.drop_table('expiry_risk_forecast')
@@ -0,0 +1,26 @@
+"""idempotency key response headers
+
+Revision ID: d6a1f3c8e529
+Revises: 9f4d2a6c1e83
+Create Date: 2026-10-19 21:04:12.318274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6a1f3c8e529'
+down_revision = '9f4d2a6c1e83'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('idempotency_keys', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('response_headers', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('idempotency_keys', schema=None) as batch_op:
+        batch_op.drop_column('response_headers')
@@ -0,0 +1,26 @@
+"""medicine version counter for optimistic concurrency
+
+Revision ID: e4a7c1d9b258
+Revises: c2f8e4a6b391
+Create Date: 2026-10-19 14:31:07.512948
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a7c1d9b258'
+down_revision = 'c2f8e4a6b391'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('medicines', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('medicines', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,28 @@
+"""partial expiry index over stock on hand
+
+Revision ID: e8b3c5d7f142
+Revises: d6a1f3c8e529
+Create Date: 2026-10-19 23:12:05.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b3c5d7f142'
+down_revision = 'd6a1f3c8e529'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('medicines', schema=None) as batch_op:
+        batch_op.create_index('ix_medicines_expiry_in_stock', ['expiry_date'], unique=False,
+                              postgresql_where=sa.text('quantity > 0'),
+                              sqlite_where=sa.text('quantity > 0'))
+
+
+def downgrade():
+    with op.batch_alter_table('medicines', schema=None) as batch_op:
+        batch_op.drop_index('ix_medicines_expiry_in_stock')
@@ -0,0 +1,32 @@
+"""actor on price history and stock movements
+
+Revision ID: f2c7a9e4b316
+Revises: e8b3c5d7f142
+Create Date: 2026-10-19 23:48:31.271554
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c7a9e4b316'
+down_revision = 'e8b3c5d7f142'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('medicine_price_history', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('actor', sa.String(length=100), nullable=True))
+
+    with op.batch_alter_table('stock_movements', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('actor', sa.String(length=100), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('stock_movements', schema=None) as batch_op:
+        batch_op.drop_column('actor')
+
+    with op.batch_alter_table('medicine_price_history', schema=None) as batch_op:
+        batch_op.drop_column('actor')
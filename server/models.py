@@ -4,10 +4,27 @@ from datetime import datetime, date
 
 db = SQLAlchemy()
 
+# Branch that single-site installs and legacy rows belong to
+DEFAULT_BRANCH_ID = 1
+
 class Medicine(db.Model):
     __tablename__ = 'medicines'
+    # Branch-leading indexes keep per-branch filters and orderings as cheap
+    # as they were with one database per branch
+    __table_args__ = (
+        db.Index('ix_medicines_branch_expiry', 'branch_id', 'expiry_date'),
+        db.Index('ix_medicines_branch_category', 'branch_id', 'category_id'),
+        db.Index('ix_medicines_branch_manufacturer', 'branch_id', 'manufacturer_id'),
+        db.Index('ix_medicines_branch_batch', 'branch_id', 'batch_number'),
+        # Cross-branch expiry range scans (calendar, forecast) over stock on hand
+        db.Index('ix_medicines_expiry_in_stock', 'expiry_date',
+                 postgresql_where=db.text('quantity > 0'),
+                 sqlite_where=db.text('quantity > 0')),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=False,
+                          default=DEFAULT_BRANCH_ID, server_default=str(DEFAULT_BRANCH_ID))
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, default='')
     batch_number = db.Column(db.String(50), nullable=False)
@@ -27,10 +44,10 @@ class Medicine(db.Model):
     category = db.Column(db.String(50), nullable=True)
     
     # New relationship fields
-    manufacturer_id = db.Column(db.Integer, db.ForeignKey('manufacturers.id'), nullable=True)
+    manufacturer_id = db.Column(db.Integer, db.ForeignKey('manufacturers.id'), nullable=True, index=True)
     manufacturer_rel = db.relationship('Manufacturer', backref='medicines')
     
-    category_id = db.Column(db.Integer, db.ForeignKey('medicine_categories.id'), nullable=True)
+    category_id = db.Column(db.Integer, db.ForeignKey('medicine_categories.id'), nullable=True, index=True)
     category_rel = db.relationship('MedicineCategory', backref='medicines')
     
     # New fields
@@ -43,9 +60,19 @@ class Medicine(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Optimistic concurrency: the ORM bumps this on every flush and adds
+    # "AND version = <loaded>" to the UPDATE, raising StaleDataError on conflict
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
+    
     def __repr__(self):
         return f'<Medicine {self.name} - Batch: {self.batch_number}>'
     
+    @property
+    def etag(self):
+        """Strong ETag for the current version"""
+        return f'{self.id}-{self.version}'
+    
     @property
     def is_expired(self):
         """Check if medicine is expired"""
@@ -74,24 +101,39 @@ class Medicine(db.Model):
     
     @property
     def effective_manufacturer(self):
-        """Get manufacturer name from relationship or string field"""
-        if self.manufacturer_rel:
-            return self.manufacturer_rel.name
+        """Get manufacturer name from reference cache or string field"""
+        from reference_cache import reference_cache
+        if self.manufacturer_id:
+            name = reference_cache.manufacturer_name(self.manufacturer_id)
+            if name:
+                return name
         return self.manufacturer or "Unknown"
     
+    @property
+    def branch_name(self):
+        """Get branch name from reference cache"""
+        from reference_cache import reference_cache
+        return reference_cache.branch_name(self.branch_id) or "Unknown"
+    
     @property
     def effective_category(self):
-        """Get category name from relationship or string field"""
-        if self.category_rel:
-            return self.category_rel.name
+        """Get category name from reference cache or string field"""
+        from reference_cache import reference_cache
+        if self.category_id:
+            name = reference_cache.category_name(self.category_id)
+            if name:
+                return name
         return self.category or "Unknown"
     
     def to_dict(self):
         return {
             'id': self.id,
+            'branch_id': self.branch_id,
+            'branch': self.branch_name,
             'name': self.name,
             'description': self.description or '',
             'batch_number': self.batch_number,
+            'version': self.version,
             'quantity': self.quantity,
             'cost_price': float(self.cost_price) if self.cost_price else None,
             'selling_price': float(self.selling_price),
@@ -104,11 +146,11 @@ class Medicine(db.Model):
             'manufacturer': self.effective_manufacturer,
             'category': self.effective_category,
             'manufacturer_info': {
-                'id': self.manufacturer_rel.id if self.manufacturer_rel else None,
+                'id': self.manufacturer_id,
                 'name': self.effective_manufacturer
             },
             'category_info': {
-                'id': self.category_rel.id if self.category_rel else None,
+                'id': self.category_id,
                 'name': self.effective_category
             },
             
@@ -122,7 +164,8 @@ class Medicine(db.Model):
             'is_expired': self.is_expired,
             'days_to_expiry': self.days_to_expiry,
             'is_low_stock': self.is_low_stock,
-            'profit_margin': round(self.profit_margin, 2)
+            'profit_margin': round(self.profit_margin, 2),
+            'archived': False
         }
 
 class MedicineCategory(db.Model):
@@ -136,13 +179,31 @@ class MedicineCategory(db.Model):
     def __repr__(self):
         return f'<Category {self.name}>'
     
-    def to_dict(self):
+    @property
+    def medicine_count(self):
+        """Count medicines with an aggregate query instead of loading the backref"""
+        return db.session.query(db.func.count(Medicine.id)).filter(
+            Medicine.category_id == self.id
+        ).scalar()
+    
+    @staticmethod
+    def medicine_counts_subquery(branch_id=None):
+        """Grouped (category_id, medicine_count) subquery for list endpoints"""
+        query = db.session.query(
+            Medicine.category_id.label('category_id'),
+            db.func.count(Medicine.id).label('medicine_count')
+        )
+        if branch_id is not None:
+            query = query.filter(Medicine.branch_id == branch_id)
+        return query.group_by(Medicine.category_id).subquery()
+    
+    def to_dict(self, medicine_count=None):
         return {
             'id': self.id,
             'name': self.name,
             'description': self.description,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'medicine_count': len(self.medicines) if hasattr(self, 'medicines') else 0
+            'medicine_count': medicine_count if medicine_count is not None else self.medicine_count
         }
 
 class Manufacturer(db.Model):
@@ -159,7 +220,25 @@ class Manufacturer(db.Model):
     def __repr__(self):
         return f'<Manufacturer {self.name}>'
     
-    def to_dict(self):
+    @property
+    def medicine_count(self):
+        """Count medicines with an aggregate query instead of loading the backref"""
+        return db.session.query(db.func.count(Medicine.id)).filter(
+            Medicine.manufacturer_id == self.id
+        ).scalar()
+    
+    @staticmethod
+    def medicine_counts_subquery(branch_id=None):
+        """Grouped (manufacturer_id, medicine_count) subquery for list endpoints"""
+        query = db.session.query(
+            Medicine.manufacturer_id.label('manufacturer_id'),
+            db.func.count(Medicine.id).label('medicine_count')
+        )
+        if branch_id is not None:
+            query = query.filter(Medicine.branch_id == branch_id)
+        return query.group_by(Medicine.manufacturer_id).subquery()
+    
+    def to_dict(self, medicine_count=None):
         return {
             'id': self.id,
             'name': self.name,
@@ -168,5 +247,362 @@ class Manufacturer(db.Model):
             'email': self.email,
             'phone': self.phone,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'medicine_count': len(self.medicines) if hasattr(self, 'medicines') else 0
-        }
\ No newline at end of file
+            'medicine_count': medicine_count if medicine_count is not None else self.medicine_count
+        }
+
+class Branch(db.Model):
+    __tablename__ = 'branches'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(20), unique=True, nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    address = db.Column(db.Text)
+    phone = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Branch {self.code}>'
+    
+    @property
+    def medicine_count(self):
+        """Count medicines with an aggregate query"""
+        return db.session.query(db.func.count(Medicine.id)).filter(
+            Medicine.branch_id == self.id
+        ).scalar()
+    
+    @staticmethod
+    def medicine_counts_subquery():
+        """Grouped (branch_id, medicine_count) subquery for list endpoints"""
+        return db.session.query(
+            Medicine.branch_id.label('branch_id'),
+            db.func.count(Medicine.id).label('medicine_count')
+        ).group_by(Medicine.branch_id).subquery()
+    
+    def to_dict(self, medicine_count=None):
+        return {
+            'id': self.id,
+            'code': self.code,
+            'name': self.name,
+            'address': self.address,
+            'phone': self.phone,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'medicine_count': medicine_count if medicine_count is not None else self.medicine_count
+        }
+
+class MedicineExpiryStatus(db.Model):
+    """Materialised expiry classification, one row per expired or expiring-soon batch"""
+    __tablename__ = 'medicine_expiry_status'
+    __table_args__ = (
+        db.Index('ix_medicine_expiry_status_branch', 'branch_id', 'status'),
+    )
+    
+    medicine_id = db.Column(db.Integer, db.ForeignKey('medicines.id', ondelete='CASCADE'), primary_key=True)
+    branch_id = db.Column(db.Integer, nullable=False, default=DEFAULT_BRANCH_ID)
+    status = db.Column(db.String(20), nullable=False, index=True)  # 'expired' or 'expiring_soon'
+    as_of = db.Column(db.Date, nullable=False)
+    
+    def __repr__(self):
+        return f'<MedicineExpiryStatus {self.medicine_id} {self.status}>'
+
+class SnapshotState(db.Model):
+    """Tracks the date each materialised snapshot was last rebuilt for"""
+    __tablename__ = 'snapshot_state'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    as_of = db.Column(db.Date, nullable=False)
+    refreshed_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SnapshotState {self.name} {self.as_of}>'
+
+class InventoryValuation(db.Model):
+    """Time-series of stock value, per day with weekly and monthly rollups.
+    
+    dimension is 'total', 'branch', 'category' or 'manufacturer'; dimension_id is 0 for
+    totals. quantity/selling_value/cost_value are closing values for the
+    period, the avg_* columns average the daily samples in it.
+    """
+    __tablename__ = 'inventory_valuations'
+    __table_args__ = (
+        db.UniqueConstraint('period', 'dimension', 'dimension_id', 'period_start',
+                            name='uq_inventory_valuation_point'),
+        db.Index('ix_inventory_valuation_range', 'period', 'dimension', 'period_start'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(10), nullable=False)  # 'day', 'week' or 'month'
+    period_start = db.Column(db.Date, nullable=False)
+    dimension = db.Column(db.String(20), nullable=False)
+    dimension_id = db.Column(db.Integer, nullable=False, default=0)
+    
+    days = db.Column(db.Integer, nullable=False, default=1)
+    medicine_count = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.BigInteger, nullable=False, default=0)
+    selling_value = db.Column(Numeric(14, 2), nullable=False, default=0)
+    cost_value = db.Column(Numeric(14, 2), nullable=False, default=0)
+    avg_quantity = db.Column(Numeric(14, 2), nullable=False, default=0)
+    avg_selling_value = db.Column(Numeric(14, 2), nullable=False, default=0)
+    avg_cost_value = db.Column(Numeric(14, 2), nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<InventoryValuation {self.period} {self.period_start} {self.dimension}:{self.dimension_id}>'
+    
+    def to_dict(self):
+        return {
+            'period': self.period,
+            'period_start': self.period_start.isoformat(),
+            'dimension': self.dimension,
+            'dimension_id': self.dimension_id or None,
+            'days': self.days,
+            'medicine_count': self.medicine_count,
+            'quantity': int(self.quantity),
+            'selling_value': float(self.selling_value),
+            'cost_value': float(self.cost_value),
+            'avg_quantity': float(self.avg_quantity),
+            'avg_selling_value': float(self.avg_selling_value),
+            'avg_cost_value': float(self.avg_cost_value)
+        }
+
+class IdempotencyKey(db.Model):
+    """Stored first response for an Idempotency-Key; status_code is NULL while in flight"""
+    __tablename__ = 'idempotency_keys'
+    
+    key = db.Column(db.String(255), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer, nullable=True)
+    content_type = db.Column(db.String(100), nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+    # JSON object of the replayed headers (idempotency.REPLAY_HEADERS)
+    response_headers = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key} {self.status_code}>'
+
+class MedicinePriceHistory(db.Model):
+    """One row per medicine per repricing; no FK so history outlives the batch"""
+    __tablename__ = 'medicine_price_history'
+    __table_args__ = (
+        db.Index('ix_medicine_price_history_medicine', 'medicine_id', 'changed_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    medicine_id = db.Column(db.Integer, nullable=False)
+    branch_id = db.Column(db.Integer, nullable=False, default=DEFAULT_BRANCH_ID)
+    change_id = db.Column(db.String(32), nullable=False, index=True)
+    old_selling_price = db.Column(Numeric(10, 2))
+    new_selling_price = db.Column(Numeric(10, 2))
+    old_cost_price = db.Column(Numeric(10, 2))
+    new_cost_price = db.Column(Numeric(10, 2))
+    reason = db.Column(db.String(200), default='')
+    actor = db.Column(db.String(100), nullable=True)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<MedicinePriceHistory {self.medicine_id} {self.change_id}>'
+    
+    def to_dict(self):
+        def money(value):
+            return float(value) if value is not None else None
+        return {
+            'change_id': self.change_id,
+            'medicine_id': self.medicine_id,
+            'branch_id': self.branch_id,
+            'old_selling_price': money(self.old_selling_price),
+            'new_selling_price': money(self.new_selling_price),
+            'old_cost_price': money(self.old_cost_price),
+            'new_cost_price': money(self.new_cost_price),
+            'reason': self.reason or '',
+            'actor': self.actor,
+            'changed_at': self.changed_at.isoformat()
+        }
+
+class MedicineUsage(db.Model):
+    """Units dispensed per product per branch per day, feeds the reorder engine.
+    
+    Keyed by product (normalised name/dosage/form) rather than batch so demand
+    history carries over from one batch of a product to the next.
+    """
+    __tablename__ = 'medicine_usage'
+    
+    branch_id = db.Column(db.Integer, primary_key=True, default=DEFAULT_BRANCH_ID)
+    product_key = db.Column(db.String(200), primary_key=True)
+    day = db.Column(db.Date, primary_key=True, index=True)
+    quantity_used = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<MedicineUsage {self.branch_id}:{self.product_key} {self.day} {self.quantity_used}>'
+
+class ExpiryRiskForecast(db.Model):
+    """Cached FEFO forecast, one row per batch projected to expire with stock left"""
+    __tablename__ = 'expiry_risk_forecast'
+    __table_args__ = (
+        db.Index('ix_expiry_risk_branch_value', 'branch_id', 'value_at_risk'),
+    )
+    
+    medicine_id = db.Column(db.Integer, db.ForeignKey('medicines.id', ondelete='CASCADE'), primary_key=True)
+    branch_id = db.Column(db.Integer, nullable=False, default=DEFAULT_BRANCH_ID)
+    quantity = db.Column(db.Integer, nullable=False)
+    days_to_expiry = db.Column(db.Integer, nullable=False)
+    daily_demand = db.Column(Numeric(12, 3), nullable=False)
+    projected_sold = db.Column(db.Integer, nullable=False)
+    projected_unsold = db.Column(db.Integer, nullable=False)
+    value_at_risk = db.Column(Numeric(14, 2), nullable=False, index=True)
+    retail_at_risk = db.Column(Numeric(14, 2), nullable=False)
+    as_of = db.Column(db.Date, nullable=False)
+    
+    medicine = db.relationship('Medicine', lazy='joined')
+    
+    def __repr__(self):
+        return f'<ExpiryRiskForecast {self.medicine_id} {self.projected_unsold}>'
+    
+    def to_dict(self):
+        return {
+            'medicine_id': self.medicine_id,
+            'branch_id': self.branch_id,
+            'name': self.medicine.name if self.medicine else None,
+            'batch_number': self.medicine.batch_number if self.medicine else None,
+            'expiry_date': self.medicine.expiry_date.isoformat() if self.medicine and self.medicine.expiry_date else None,
+            'quantity': self.quantity,
+            'days_to_expiry': self.days_to_expiry,
+            'daily_demand': float(self.daily_demand),
+            'projected_sold': self.projected_sold,
+            'projected_unsold': self.projected_unsold,
+            'value_at_risk': float(self.value_at_risk),
+            'retail_at_risk': float(self.retail_at_risk),
+            'as_of': self.as_of.isoformat()
+        }
+
+class ArchivedMedicine(db.Model):
+    """Expired or depleted batches moved out of medicines by archival.py.
+    
+    Mirrors the medicines columns (ids are kept) without foreign keys, so
+    archived rows never hold up deletes of manufacturers, categories or branches.
+    """
+    __tablename__ = 'medicines_archive'
+    __table_args__ = (
+        db.Index('ix_medicines_archive_branch_expiry', 'branch_id', 'expiry_date'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    branch_id = db.Column(db.Integer, nullable=False, default=DEFAULT_BRANCH_ID)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text, default='')
+    batch_number = db.Column(db.String(50), nullable=False, index=True)
+    price = db.Column(Numeric(10, 2), nullable=True)
+    cost_price = db.Column(Numeric(10, 2))
+    selling_price = db.Column(Numeric(10, 2), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    minimum_stock = db.Column(db.Integer, default=10)
+    manufacturer = db.Column(db.String(100), nullable=True)
+    category = db.Column(db.String(50), nullable=True)
+    manufacturer_id = db.Column(db.Integer, nullable=True)
+    category_id = db.Column(db.Integer, nullable=True)
+    dosage = db.Column(db.String(50), default='')
+    form = db.Column(db.String(30), default='')
+    purchase_date = db.Column(db.Date, nullable=True)
+    expiry_date = db.Column(db.Date, nullable=True)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<ArchivedMedicine {self.name} - Batch: {self.batch_number}>'
+    
+    def to_dict(self):
+        """Same shape as Medicine.to_dict, flagged as archived"""
+        columns = {column.name: getattr(self, column.name) for column in Medicine.__table__.columns}
+        data = Medicine(**columns).to_dict()
+        data['archived'] = True
+        data['archived_at'] = self.archived_at.isoformat() if self.archived_at else None
+        return data
+
+class AuditLog(db.Model):
+    """Before/after values of one medicine change; no FK so entries outlive the batch"""
+    __tablename__ = 'audit_log'
+    __table_args__ = (
+        db.Index('ix_audit_log_medicine', 'medicine_id', 'changed_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    medicine_id = db.Column(db.Integer, nullable=False)
+    branch_id = db.Column(db.Integer, nullable=False, default=DEFAULT_BRANCH_ID)
+    action = db.Column(db.String(10), nullable=False)  # create, update or delete
+    changes = db.Column(db.JSON, nullable=False)  # {field: [old, new]}
+    actor = db.Column(db.String(100), nullable=True)
+    request_path = db.Column(db.String(255), nullable=True)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<AuditLog {self.action} {self.medicine_id}>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'medicine_id': self.medicine_id,
+            'branch_id': self.branch_id,
+            'action': self.action,
+            'changes': self.changes,
+            'actor': self.actor,
+            'request_path': self.request_path,
+            'changed_at': self.changed_at.isoformat()
+        }
+
+class StockMovement(db.Model):
+    """Append-only stock ledger entry; quantity is signed (negative for stock going out).
+    
+    compacted_at is NULL until the movement has been added to medicines.quantity.
+    """
+    __tablename__ = 'stock_movements'
+    __table_args__ = (
+        db.Index('ix_stock_movements_medicine', 'medicine_id', 'created_at'),
+        db.Index('ix_stock_movements_pending', 'id',
+                 postgresql_where=db.text('compacted_at IS NULL'),
+                 sqlite_where=db.text('compacted_at IS NULL')),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    medicine_id = db.Column(db.Integer, nullable=False)
+    branch_id = db.Column(db.Integer, nullable=False, default=DEFAULT_BRANCH_ID)
+    kind = db.Column(db.String(20), nullable=False)  # receipt, sale, adjustment or write_off
+    quantity = db.Column(db.Integer, nullable=False)
+    reference = db.Column(db.String(100), default='')
+    actor = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    compacted_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<StockMovement {self.kind} {self.medicine_id} {self.quantity}>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'medicine_id': self.medicine_id,
+            'branch_id': self.branch_id,
+            'kind': self.kind,
+            'quantity': self.quantity,
+            'reference': self.reference or '',
+            'actor': self.actor,
+            'created_at': self.created_at.isoformat(),
+            'compacted': self.compacted_at is not None
+        }
+
+class StockBalanceSnapshot(db.Model):
+    """A medicine's balance at closing_at (midnight after snapshot_date, UTC).
+    
+    Only written for days a medicine had movements, so the latest snapshot on
+    or before a date is its balance then.
+    """
+    __tablename__ = 'stock_balance_snapshots'
+    
+    medicine_id = db.Column(db.Integer, primary_key=True)
+    snapshot_date = db.Column(db.Date, primary_key=True)
+    branch_id = db.Column(db.Integer, nullable=False, default=DEFAULT_BRANCH_ID)
+    balance = db.Column(db.Integer, nullable=False)
+    closing_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<StockBalanceSnapshot {self.medicine_id} {self.snapshot_date} {self.balance}>'
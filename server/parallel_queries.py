@@ -0,0 +1,92 @@
+"""
+Run a request's independent queries concurrently.
+
+Reports and alerts issue several independent SELECTs; run one after another
+on the request's connection their latencies add up. ``run_queries`` hands
+each one to a bounded thread pool where it runs in its own Session, and so
+on its own pooled connection, so a request costs roughly its slowest query.
+
+Each task is a callable taking a Session. Tasks fall back to running
+serially on ``db.session`` when parallel mode is off, when no pool slot is
+free (the pool never queues), when a parallel attempt fails, or when a task
+had not started by the deadline. A task still running at the deadline
+raises ``QueryTimeout``.
+
+Size SQLALCHEMY_ENGINE_OPTIONS' pool so it covers request threads plus
+PARALLEL_QUERY_WORKERS.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import current_app
+from sqlalchemy.orm import Session
+from models import db
+
+DEFAULT_WORKERS = 4
+DEFAULT_TIMEOUT = 10.0
+
+
+class QueryTimeout(Exception):
+    """A parallel query was still running when the request deadline passed"""
+
+
+_executor = None
+_slots = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(app):
+    """Lazily create the pool, once per process (after any fork)"""
+    global _executor, _slots
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = app.config.get('PARALLEL_QUERY_WORKERS', DEFAULT_WORKERS)
+                _slots = threading.BoundedSemaphore(workers)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='query')
+    return _executor
+
+
+def _run_in_own_session(app, task):
+    with app.app_context():
+        with Session(db.engine) as session:
+            return task(session)
+
+
+def run_queries(tasks, timeout=None):
+    """Run ``{name: task(session)}`` and return ``{name: result}``"""
+    app = current_app._get_current_object()
+    if not app.config.get('PARALLEL_QUERIES_ENABLED', True) or len(tasks) < 2:
+        return {name: task(db.session) for name, task in tasks.items()}
+
+    executor = _get_executor(app)
+    timeout = timeout if timeout is not None else app.config.get('PARALLEL_QUERY_TIMEOUT', DEFAULT_TIMEOUT)
+    deadline = time.monotonic() + timeout
+
+    futures, serial = {}, []
+    for name, task in tasks.items():
+        if _slots.acquire(blocking=False):
+            future = executor.submit(_run_in_own_session, app, task)
+            future.add_done_callback(lambda _: _slots.release())
+            futures[name] = future
+        else:
+            serial.append(name)
+
+    results = {}
+    # Use the request thread for overflow work while the pool runs
+    for name in serial:
+        results[name] = tasks[name](db.session)
+
+    wait(futures.values(), timeout=max(0, deadline - time.monotonic()))
+    for name, future in futures.items():
+        if future.done():
+            if future.exception() is None:
+                results[name] = future.result()
+            else:
+                results[name] = tasks[name](db.session)
+        elif future.cancel():
+            results[name] = tasks[name](db.session)
+        else:
+            raise QueryTimeout(f'Query {name} exceeded {timeout:.1f}s')
+    return results
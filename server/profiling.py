@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+On-demand profiling of individual API requests.
+
+A request is profiled when it carries ``X-Profile: <PROFILING_TOKEN>`` or is
+picked by PROFILING_SAMPLE_RATE (0 disables sampling). Header profiling is
+off while no token is configured. For a profiled request the following are
+captured:
+
+    <id>.prof   cProfile stats of the request thread (open with pstats/snakeviz)
+    <id>.txt    top functions by cumulative time and top allocation sites
+    <id>.json   path, status, wall time, SQL statement count/time, memory peak
+
+SQL time is measured separately so it can be told apart from ORM hydration,
+to_dict() and serialisation in the profile. Only the request thread is
+measured, so queries that parallel_queries runs on its workers show up as
+time spent waiting. Only one request is profiled at
+a time, because tracemalloc is process-wide. Other profiled requests run
+normally. PROFILING_DIR keeps at most PROFILING_MAX_PROFILES profiles, and
+the oldest are pruned first.
+
+List or download them with GET /api/profiles[/<id>] (same X-Profile token)
+or ``python profiling.py --list | --show <id>``.
+"""
+
+import os
+import re
+import io
+import sys
+import json
+import time
+import hmac
+import random
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+from flask import request, g, current_app, jsonify
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+HEADER = 'X-Profile'
+DEFAULT_MAX_PROFILES = 50
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+TRACEMALLOC_FRAMES = 10
+
+_profiling_lock = threading.Lock()
+_active_thread = None
+
+
+def profiles_dir(app=None):
+    app = app or current_app
+    return app.config.get('PROFILING_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+
+
+def is_admin_request():
+    """True when the request carries the configured profiling token"""
+    token = current_app.config.get('PROFILING_TOKEN')
+    supplied = request.headers.get(HEADER)
+    return bool(token and supplied and hmac.compare_digest(token, supplied))
+
+
+def _should_profile():
+    if is_admin_request():
+        return True
+    rate = current_app.config.get('PROFILING_SAMPLE_RATE', 0.0)
+    return rate > 0 and random.random() < rate
+
+
+# =============================================================================
+# SQL TIMING
+# =============================================================================
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if threading.get_ident() == _active_thread:
+        conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if threading.get_ident() == _active_thread and conn.info.get('profile_query_start'):
+        elapsed = time.perf_counter() - conn.info['profile_query_start'].pop()
+        g.profile_sql_count = g.get('profile_sql_count', 0) + 1
+        g.profile_sql_seconds = g.get('profile_sql_seconds', 0.0) + elapsed
+
+
+# =============================================================================
+# REQUEST HOOKS
+# =============================================================================
+
+def start_profiling():
+    """before_request hook: start cProfile and tracemalloc for a chosen request"""
+    global _active_thread
+    if not _should_profile() or not _profiling_lock.acquire(blocking=False):
+        return None
+    _active_thread = threading.get_ident()
+    g.profile_started = time.perf_counter()
+    g.profile_tracemalloc = not tracemalloc.is_tracing()
+    if g.profile_tracemalloc:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    tracemalloc.reset_peak()
+    g.profile_snapshot_before = tracemalloc.take_snapshot()
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+    return None
+
+
+def _stop():
+    global _active_thread
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return None
+    profiler.disable()
+    wall = time.perf_counter() - g.profile_started
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    if g.get('profile_tracemalloc'):
+        tracemalloc.stop()
+    _active_thread = None
+    _profiling_lock.release()
+    return profiler, wall, snapshot, peak
+
+
+def finish_profiling(response):
+    """after_request hook: write the profile and tag the response with its id"""
+    stopped = _stop()
+    if stopped is None:
+        return response
+    try:
+        profile_id = _write_profile(*stopped, status=response.status_code)
+        response.headers['X-Profile-Id'] = profile_id
+    except Exception as e:
+        current_app.logger.warning(f"Could not write profile: {e}")
+    return response
+
+
+def abort_profiling(exc=None):
+    """teardown_request hook: never leave the profiler running after an error"""
+    _stop()
+
+
+def _write_profile(profiler, wall, snapshot, peak, status):
+    directory = profiles_dir()
+    os.makedirs(directory, exist_ok=True)
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', request.path).strip('-')[:60] or 'root'
+    profile_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{request.method.lower()}-{slug}"
+    base = os.path.join(directory, profile_id)
+
+    profiler.dump_stats(base + '.prof')
+
+    summary = io.StringIO()
+    summary.write(f"{request.method} {request.full_path.rstrip('?')} -> {status} in {wall * 1000:.1f} ms\n")
+    summary.write(f"SQL: {g.get('profile_sql_count', 0)} statements, "
+                  f"{g.get('profile_sql_seconds', 0.0) * 1000:.1f} ms\n")
+    summary.write(f'Peak traced memory: {peak / 1024:.1f} KiB\n\n')
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    summary.write('\nTop allocation sites (growth during the request):\n')
+    for stat in snapshot.compare_to(g.profile_snapshot_before, 'lineno')[:TOP_ALLOCATIONS]:
+        summary.write(f'{stat}\n')
+    with open(base + '.txt', 'w') as f:
+        f.write(summary.getvalue())
+
+    with open(base + '.json', 'w') as f:
+        json.dump({
+            'id': profile_id,
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': status,
+            'sampled': not is_admin_request(),
+            'wall_ms': round(wall * 1000, 2),
+            'sql_statements': g.get('profile_sql_count', 0),
+            'sql_ms': round(g.get('profile_sql_seconds', 0.0) * 1000, 2),
+            'peak_memory_kib': round(peak / 1024, 1),
+            'created_at': datetime.utcnow().isoformat()
+        }, f, indent=2)
+
+    _prune(directory, current_app.config.get('PROFILING_MAX_PROFILES', DEFAULT_MAX_PROFILES))
+    return profile_id
+
+
+def _prune(directory, keep):
+    ids = sorted(name[:-5] for name in os.listdir(directory) if name.endswith('.json'))
+    for profile_id in ids[:-keep] if keep else ids:
+        for extension in ('.prof', '.txt', '.json'):
+            path = os.path.join(directory, profile_id + extension)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# =============================================================================
+# LISTING AND DOWNLOAD
+# =============================================================================
+
+def list_profiles(directory):
+    """Profile metadata, newest first"""
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if name.endswith('.json'):
+            with open(os.path.join(directory, name)) as f:
+                profiles.append(json.load(f))
+    return profiles
+
+
+def profile_path(directory, profile_id, fmt='txt'):
+    """Path of one profile file, None when it doesn't exist"""
+    if fmt not in ('prof', 'txt', 'json') or not re.fullmatch(r'[A-Za-z0-9-]+', profile_id or ''):
+        return None
+    path = os.path.join(directory, f'{profile_id}.{fmt}')
+    return path if os.path.exists(path) else None
+
+
+def require_admin():
+    """403 unless the request carries the profiling token"""
+    if not is_admin_request():
+        return jsonify({'error': f'{HEADER} token required'}), 403
+    return None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Add the current directory to Python path
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+    from app import app
+
+    parser = argparse.ArgumentParser(description="List and show captured request profiles")
+    parser.add_argument("--list", action="store_true", help="List captured profiles")
+    parser.add_argument("--show", metavar="ID", help="Print a profile's summary")
+
+    args = parser.parse_args()
+    directory = profiles_dir(app)
+
+    if args.list:
+        profiles = list_profiles(directory)
+        if not profiles:
+            print("📭 No profiles captured")
+        for profile in profiles:
+            print(f"🔬 {profile['id']}: {profile['method']} {profile['path']} -> {profile['status']} "
+                  f"{profile['wall_ms']} ms, SQL {profile['sql_statements']}x {profile['sql_ms']} ms")
+    elif args.show:
+        path = profile_path(directory, args.show, 'txt')
+        if path is None:
+            print(f"❌ Profile {args.show} not found")
+        else:
+            with open(path) as f:
+                print(f.read())
+    else:
+        parser.print_help()
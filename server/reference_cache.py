@@ -0,0 +1,130 @@
+"""
+In-process cache of the manufacturers, medicine_categories and branches
+tables.
+
+These tables are tiny and rarely change, yet every create/update validates
+ids against them and every serialised medicine needs their names. The cache
+holds id -> name maps, is loaded at startup and invalidated when a session
+that wrote to any of them commits. Entries also expire after ``ttl``
+seconds so writes made by other worker processes are picked up, and an
+unknown id triggers (at most once per second) a reload before being
+reported missing.
+"""
+
+import time
+import threading
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from models import db, Manufacturer, MedicineCategory, Branch
+
+DEFAULT_TTL = 300
+MISS_RELOAD_INTERVAL = 1.0
+
+
+class ReferenceCache:
+    """id -> name maps for manufacturers, categories and branches"""
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._manufacturers = {}
+        self._categories = {}
+        self._branches = {}
+        self._loaded_at = None
+        self._last_miss_reload = 0.0
+
+    def load(self):
+        """(Re)load all tables, requires an application context"""
+        with self._lock:
+            manufacturers = dict(db.session.query(Manufacturer.id, Manufacturer.name).all())
+            categories = dict(db.session.query(MedicineCategory.id, MedicineCategory.name).all())
+            branches = dict(db.session.query(Branch.id, Branch.name).all())
+            self._manufacturers = manufacturers
+            self._categories = categories
+            self._branches = branches
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    @property
+    def is_loaded(self):
+        return self._loaded_at is not None
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self.load()
+
+    def _lookup(self, attr, key):
+        try:
+            key = int(key)
+        except (TypeError, ValueError):
+            return None
+
+        self._ensure_loaded()
+        value = getattr(self, attr).get(key)
+        if value is None and time.monotonic() - self._last_miss_reload > MISS_RELOAD_INTERVAL:
+            # Row may have been created by another process since the last load
+            self._last_miss_reload = time.monotonic()
+            self.load()
+            value = getattr(self, attr).get(key)
+        return value
+
+    def manufacturer_name(self, manufacturer_id):
+        return self._lookup('_manufacturers', manufacturer_id)
+
+    def category_name(self, category_id):
+        return self._lookup('_categories', category_id)
+
+    def branch_name(self, branch_id):
+        return self._lookup('_branches', branch_id)
+
+    def manufacturer_exists(self, manufacturer_id):
+        return self.manufacturer_name(manufacturer_id) is not None
+
+    def category_exists(self, category_id):
+        return self.category_name(category_id) is not None
+
+    def branch_exists(self, branch_id):
+        return self.branch_name(branch_id) is not None
+
+    def manufacturers(self):
+        self._ensure_loaded()
+        return dict(self._manufacturers)
+
+    def categories(self):
+        self._ensure_loaded()
+        return dict(self._categories)
+
+    def branches(self):
+        self._ensure_loaded()
+        return dict(self._branches)
+
+
+reference_cache = ReferenceCache()
+
+
+# =============================================================================
+# INVALIDATION ON WRITES
+# =============================================================================
+
+def _mark_dirty(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['reference_data_dirty'] = True
+
+
+for _model in (Manufacturer, MedicineCategory, Branch):
+    for _event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event_name, _mark_dirty)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('reference_data_dirty', False):
+        reference_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('reference_data_dirty', None)
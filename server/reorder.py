@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Reorder-quantity suggestions from recent demand.
+
+Every quantity decrease on a medicine is added to medicine_usage for its
+product (normalised name, dosage and form) and branch on that day. The
+engine loads the last ``window`` days of usage and current unexpired stock
+in two grouped queries, and puts them into NumPy arrays. It then computes
+the following for the whole catalogue in one vectorised pass:
+
+    avg_daily_demand   moving average of units used per day over the window
+    safety_stock       z * stddev(daily usage) * sqrt(lead_time)
+    reorder_point      avg_daily_demand * lead_time + safety_stock
+    days_of_cover      stock / avg_daily_demand
+    suggested_quantity enough to cover lead_time + review days of demand plus
+                       safety stock, and at least back up to minimum_stock,
+                       for products at or below their reorder point
+
+Usage: python reorder.py [--window 28] [--lead-time 7] [--review 14] [--csv out.csv]
+Needs the optional ``numpy`` package.
+"""
+
+import os
+import sys
+import csv
+from datetime import date, timedelta
+from sqlalchemy import event, inspect, or_
+from sqlalchemy.dialects import postgresql, sqlite
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+from models import db, Medicine, MedicineUsage
+
+DEFAULT_WINDOW = 28
+DEFAULT_LEAD_TIME = 7
+DEFAULT_REVIEW = 14
+# ~95% service level
+DEFAULT_SERVICE_Z = 1.65
+
+
+def product_key(name, dosage, form):
+    """Batches of the same product share a key"""
+    return '|'.join(' '.join((part or '').lower().split()) for part in (name, dosage, form))[:200]
+
+
+# =============================================================================
+# USAGE CAPTURE ON WRITES
+# =============================================================================
+
+def record_usage(connection, branch_id, key, used, day):
+    """Add ``used`` units to a product's usage on ``day``"""
+    table = MedicineUsage.__table__
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(table).values(
+            branch_id=branch_id, product_key=key, day=day, quantity_used=used
+        )
+        connection.execute(insert.on_conflict_do_update(
+            index_elements=['branch_id', 'product_key', 'day'],
+            set_={'quantity_used': table.c.quantity_used + insert.excluded.quantity_used}
+        ))
+        return
+    updated = connection.execute(table.update().where(
+        table.c.branch_id == branch_id, table.c.product_key == key, table.c.day == day
+    ).values(quantity_used=table.c.quantity_used + used))
+    if not updated.rowcount:
+        connection.execute(table.insert().values(
+            branch_id=branch_id, product_key=key, day=day, quantity_used=used
+        ))
+
+
+@event.listens_for(Medicine, 'after_update')
+def _capture_usage(mapper, connection, target):
+    history = inspect(target).attrs.quantity.history
+    if not history.deleted or not history.added:
+        return
+    old, new = history.deleted[0], history.added[0]
+    # Decreases are stock going out; restocks and corrections upwards are not demand
+    if old is None or new is None or new >= old:
+        return
+    # A transfer moves stock between branches rather than consuming it
+    if inspect(target).attrs.branch_id.history.has_changes():
+        return
+    record_usage(
+        connection, target.branch_id, product_key(target.name, target.dosage, target.form),
+        old - new, date.today()
+    )
+
+
+# =============================================================================
+# ENGINE
+# =============================================================================
+
+def average_daily_demand(window=DEFAULT_WINDOW, today=None, branch_id=None):
+    """``{(branch_id, product_key): units per day}`` over the last ``window`` days"""
+    today = today or date.today()
+    query = db.session.query(
+        MedicineUsage.branch_id, MedicineUsage.product_key, db.func.sum(MedicineUsage.quantity_used)
+    ).filter(
+        MedicineUsage.day > today - timedelta(days=window), MedicineUsage.day <= today
+    ).group_by(MedicineUsage.branch_id, MedicineUsage.product_key)
+    if branch_id is not None:
+        query = query.filter(MedicineUsage.branch_id == branch_id)
+    return {(branch, key): float(used) / window for branch, key, used in query.all()}
+
+
+def _load(window, today, branch_id=None):
+    """Stock and usage for every product, as arrays aligned on one product index"""
+    stock_query = db.session.query(
+        Medicine.branch_id, Medicine.name, Medicine.dosage, Medicine.form,
+        db.func.sum(Medicine.quantity), db.func.max(Medicine.minimum_stock)
+    ).filter(
+        or_(Medicine.expiry_date.is_(None), Medicine.expiry_date >= today)
+    ).group_by(Medicine.branch_id, Medicine.name, Medicine.dosage, Medicine.form)
+    usage_query = db.session.query(
+        MedicineUsage.branch_id, MedicineUsage.product_key, MedicineUsage.day, MedicineUsage.quantity_used
+    ).filter(
+        # Future-dated rows (clock skew, bad imports) would fall outside the window columns
+        MedicineUsage.day > today - timedelta(days=window), MedicineUsage.day <= today
+    )
+    if branch_id is not None:
+        stock_query = stock_query.filter(Medicine.branch_id == branch_id)
+        usage_query = usage_query.filter(MedicineUsage.branch_id == branch_id)
+    stock_rows = stock_query.all()
+    usage_rows = usage_query.all()
+
+    index, products = {}, []
+    stock_idx, stock_qty, stock_min = [], [], []
+    for branch, name, dosage, form, quantity, minimum_stock in stock_rows:
+        key = (branch, product_key(name, dosage, form))
+        if key not in index:
+            index[key] = len(products)
+            products.append({'branch_id': branch, 'name': name, 'dosage': dosage or '', 'form': form or ''})
+        stock_idx.append(index[key])
+        stock_qty.append(quantity or 0)
+        stock_min.append(minimum_stock or 0)
+
+    usage_idx, usage_day, usage_qty = [], [], []
+    for branch, key, day, used in usage_rows:
+        if (branch, key) not in index:
+            # Sold out or archived: still demanded, nothing on hand
+            index[(branch, key)] = len(products)
+            name, dosage, form = (key.split('|') + ['', ''])[:3]
+            products.append({'branch_id': branch, 'name': name, 'dosage': dosage, 'form': form})
+        usage_idx.append(index[(branch, key)])
+        usage_day.append(window - 1 - (today - day).days)
+        usage_qty.append(used)
+
+    count = len(products)
+    stock = np.zeros(count)
+    minimum = np.zeros(count)
+    usage = np.zeros((count, window))
+    np.add.at(stock, np.asarray(stock_idx, dtype=np.intp), np.asarray(stock_qty, dtype=float))
+    np.maximum.at(minimum, np.asarray(stock_idx, dtype=np.intp), np.asarray(stock_min, dtype=float))
+    np.add.at(
+        usage,
+        (np.asarray(usage_idx, dtype=np.intp), np.asarray(usage_day, dtype=np.intp)),
+        np.asarray(usage_qty, dtype=float)
+    )
+    return products, stock, minimum, usage
+
+
+def reorder_suggestions(window=DEFAULT_WINDOW, lead_time=DEFAULT_LEAD_TIME, review=DEFAULT_REVIEW,
+                        service_z=DEFAULT_SERVICE_Z, branch_id=None, include_all=False, limit=None):
+    """Reorder suggestions for every product, most urgent (least cover) first"""
+    if np is None:
+        raise RuntimeError('numpy is required for reorder suggestions')
+    if window < 1 or lead_time < 0 or review < 0:
+        raise ValueError('window must be positive, lead_time and review non-negative')
+
+    today = date.today()
+    products, stock, minimum, usage = _load(window, today, branch_id)
+
+    demand = usage.mean(axis=1)
+    safety = service_z * usage.std(axis=1) * np.sqrt(lead_time)
+    reorder_point = demand * lead_time + safety
+    cover = np.divide(stock, demand, out=np.full(len(products), np.inf), where=demand > 0)
+    target = demand * (lead_time + review) + safety
+    needed = np.maximum(np.maximum(target, minimum) - stock, 0)
+    due = (stock <= reorder_point) | (stock < minimum)
+    suggested = np.where(due, np.ceil(needed), 0).astype(np.int64)
+
+    order = np.lexsort((-demand, cover))
+    if not include_all:
+        order = order[suggested[order] > 0]
+    if limit:
+        order = order[:limit]
+
+    suggestions = []
+    for i in order.tolist():
+        suggestions.append(dict(
+            products[i],
+            stock=int(stock[i]),
+            minimum_stock=int(minimum[i]),
+            avg_daily_demand=round(float(demand[i]), 2),
+            safety_stock=round(float(safety[i]), 2),
+            reorder_point=round(float(reorder_point[i]), 2),
+            days_of_cover=round(float(cover[i]), 1) if np.isfinite(cover[i]) else None,
+            suggested_quantity=int(suggested[i])
+        ))
+    return {
+        'as_of': today.isoformat(),
+        'parameters': {
+            'window': window,
+            'lead_time': lead_time,
+            'review': review,
+            'service_z': service_z,
+            'branch_id': branch_id
+        },
+        'products_analysed': len(products),
+        'products_to_reorder': int((suggested > 0).sum()),
+        'suggestions': suggestions
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Add the current directory to Python path
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+    from app import app
+
+    parser = argparse.ArgumentParser(description="Suggest reorder quantities from recent demand")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="Days of usage history")
+    parser.add_argument("--lead-time", type=int, default=DEFAULT_LEAD_TIME, help="Supplier lead time in days")
+    parser.add_argument("--review", type=int, default=DEFAULT_REVIEW, help="Days until the next order")
+    parser.add_argument("--branch-id", type=int, help="Only one branch")
+    parser.add_argument("--all", action="store_true", help="Include products that need no reorder")
+    parser.add_argument("--csv", help="Write the suggestions to a CSV file")
+
+    args = parser.parse_args()
+
+    with app.app_context():
+        try:
+            result = reorder_suggestions(
+                window=args.window, lead_time=args.lead_time, review=args.review,
+                branch_id=args.branch_id, include_all=args.all
+            )
+            print(f"✅ {result['products_to_reorder']} of {result['products_analysed']} products need reordering")
+            if args.csv:
+                with open(args.csv, 'w', newline='') as f:
+                    fields = list(result['suggestions'][0].keys()) if result['suggestions'] else ['name']
+                    writer = csv.DictWriter(f, fieldnames=fields)
+                    writer.writeheader()
+                    writer.writerows(result['suggestions'])
+                print(f"📄 Written to {args.csv}")
+            else:
+                for row in result['suggestions'][:20]:
+                    cover = f"{row['days_of_cover']}d" if row['days_of_cover'] is not None else "∞"
+                    print(f"   📦 {row['name']} {row['dosage']} (branch {row['branch_id']}): "
+                          f"stock {row['stock']}, cover {cover}, order {row['suggested_quantity']}")
+        except Exception as e:
+            print(f"❌ Error computing reorder suggestions: {str(e)}")
@@ -0,0 +1,183 @@
+"""
+Set-based bulk repricing with price history.
+
+A repricing applies a percentage or absolute change to selling_price,
+cost_price or both for every medicine matched by a category, a
+manufacturer and/or an id list (within the request's branch). It runs as
+two statements in one transaction:
+
+    INSERT INTO medicine_price_history (...) SELECT ... FROM medicines WHERE <scope> FOR UPDATE
+    UPDATE medicines SET <price> = <expr>, version = version + 1 WHERE <scope>
+
+The SELECT locks the matched rows (on PostgreSQL) and the UPDATE is limited
+to the ids it recorded, so the history rows hold exactly the prices the
+UPDATE replaces. The returned count and value delta are computed from those
+history rows, after the lock, not from an earlier unlocked read. New prices
+are rounded to cents and never drop below zero. A dry run returns the same
+counts and value delta, plus a sample of the affected rows, without writing
+anything.
+"""
+
+import uuid
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import case, literal
+from models import db, Medicine, MedicinePriceHistory
+from audit import current_actor
+
+FIELDS = ('selling_price', 'cost_price', 'both')
+MODES = ('percent', 'absolute')
+MAX_IDS = 5000
+PREVIEW_ROWS = 50
+
+
+def _parse_request(data):
+    """Validate a repricing request, returns (columns, mode, amount)"""
+    field = data.get('field', 'selling_price')
+    if field not in FIELDS:
+        raise ValueError(f'field must be one of: {", ".join(FIELDS)}')
+    modes = [mode for mode in MODES if data.get(mode) is not None]
+    if len(modes) != 1:
+        raise ValueError('Give exactly one of percent or absolute')
+    mode = modes[0]
+    try:
+        amount = Decimal(str(data[mode]))
+    except InvalidOperation:
+        raise ValueError(f'{mode} must be a number')
+    if mode == 'percent' and amount <= -100:
+        raise ValueError('percent must be greater than -100')
+    columns = ('selling_price', 'cost_price') if field == 'both' else (field,)
+    return columns, mode, amount
+
+
+def _scope(data, branch_id=None):
+    """WHERE clauses for the medicines a repricing touches"""
+    clauses = []
+    if data.get('category_id') is not None:
+        clauses.append(Medicine.category_id == int(data['category_id']))
+    if data.get('manufacturer_id') is not None:
+        clauses.append(Medicine.manufacturer_id == int(data['manufacturer_id']))
+    if data.get('ids') is not None:
+        if not isinstance(data['ids'], list):
+            raise ValueError('ids must be a list of medicine ids')
+        try:
+            ids = [int(medicine_id) for medicine_id in data['ids']]
+        except (TypeError, ValueError):
+            raise ValueError('ids must be a list of medicine ids')
+        if not ids or len(ids) > MAX_IDS:
+            raise ValueError(f'ids must contain between 1 and {MAX_IDS} medicine ids')
+        clauses.append(Medicine.id.in_(ids))
+    if not clauses:
+        raise ValueError('Scope the repricing with category_id, manufacturer_id or ids')
+    if branch_id is not None:
+        clauses.append(Medicine.branch_id == branch_id)
+    return clauses
+
+
+def _new_price(column, mode, amount):
+    """SQL expression for the repriced value of ``column``"""
+    if mode == 'percent':
+        expr = db.func.round(column * (1 + amount / 100), 2)
+    else:
+        expr = db.func.round(column + amount, 2)
+    return case((column.is_(None), None), (expr < 0, literal(Decimal('0.00'))), else_=expr)
+
+
+def _money(value):
+    return float(value or 0)
+
+
+def _summarise(summary, new_prices, row):
+    """Fill ``affected`` and ``value_delta`` from a (count, delta...) row"""
+    summary['affected'] = row[0]
+    summary['value_delta'] = {name: _money(delta) for name, delta in zip(new_prices, row[1:])}
+
+
+def reprice(data, branch_id=None, dry_run=False):
+    """Apply (or preview) a repricing, returns a summary"""
+    columns, mode, amount = _parse_request(data)
+    clauses = _scope(data, branch_id)
+    new_prices = {name: _new_price(getattr(Medicine, name), mode, amount) for name in columns}
+
+    summary = {
+        'field': data.get('field', 'selling_price'),
+        'mode': mode,
+        'amount': float(amount),
+        'dry_run': dry_run
+    }
+
+    if dry_run:
+        # Stock value change per repriced column
+        deltas = [
+            db.func.coalesce(db.func.sum((expr - getattr(Medicine, name)) * Medicine.quantity), 0)
+            for name, expr in new_prices.items()
+        ]
+        _summarise(summary, new_prices, db.session.query(db.func.count(Medicine.id), *deltas).filter(*clauses).one())
+        preview = db.session.query(
+            Medicine.id, Medicine.name, Medicine.batch_number, Medicine.quantity,
+            *[getattr(Medicine, name) for name in new_prices],
+            *new_prices.values()
+        ).filter(*clauses).order_by(Medicine.id).limit(PREVIEW_ROWS).all()
+        summary['preview'] = [
+            dict(
+                id=row[0], name=row[1], batch_number=row[2], quantity=row[3],
+                **{f'old_{name}': _money(row[4 + i]) for i, name in enumerate(new_prices)},
+                **{f'new_{name}': _money(row[4 + len(new_prices) + i]) for i, name in enumerate(new_prices)}
+            )
+            for row in preview
+        ]
+        return summary
+
+    change_id = uuid.uuid4().hex
+    now = datetime.utcnow()
+    selling = new_prices.get('selling_price', Medicine.selling_price)
+    cost = new_prices.get('cost_price', Medicine.cost_price)
+
+    history = db.select(
+        Medicine.id,
+        Medicine.branch_id,
+        literal(change_id),
+        Medicine.selling_price,
+        selling,
+        Medicine.cost_price,
+        cost,
+        literal((data.get('reason') or '')[:200]),
+        literal(current_actor()),
+        literal(now)
+    ).where(*clauses).with_for_update()
+    db.session.execute(
+        MedicinePriceHistory.__table__.insert().from_select(
+            ['medicine_id', 'branch_id', 'change_id', 'old_selling_price', 'new_selling_price',
+             'old_cost_price', 'new_cost_price', 'reason', 'actor', 'changed_at'],
+            history
+        )
+    )
+    recorded = db.select(MedicinePriceHistory.medicine_id).where(MedicinePriceHistory.change_id == change_id)
+    db.session.execute(
+        db.update(Medicine).where(Medicine.id.in_(recorded)).values(
+            version=Medicine.version + 1, updated_at=now, **new_prices
+        ).execution_options(synchronize_session=False)
+    )
+
+    # Summarise what was written: locked old prices, new prices, current quantities
+    deltas = [
+        db.func.coalesce(db.func.sum(
+            (getattr(MedicinePriceHistory, f'new_{name}') - getattr(MedicinePriceHistory, f'old_{name}'))
+            * Medicine.quantity
+        ), 0)
+        for name in new_prices
+    ]
+    _summarise(summary, new_prices, db.session.query(db.func.count(MedicinePriceHistory.id), *deltas).join(
+        Medicine, Medicine.id == MedicinePriceHistory.medicine_id
+    ).filter(MedicinePriceHistory.change_id == change_id).one())
+    db.session.commit()
+
+    summary['change_id'] = change_id
+    return summary
+
+
+def price_history(medicine_id, limit=100):
+    """A medicine's price changes, newest first"""
+    return MedicinePriceHistory.query.filter_by(medicine_id=medicine_id).order_by(
+        MedicinePriceHistory.changed_at.desc(), MedicinePriceHistory.id.desc()
+    ).limit(limit).all()
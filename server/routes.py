@@ -1,22 +1,111 @@
-from flask import request, jsonify, Blueprint
-from models import db, Medicine, MedicineCategory, Manufacturer
+import io
+from flask import request, jsonify, Blueprint, g, current_app, send_file
+from models import db, Medicine, MedicineCategory, Manufacturer, Branch, ArchivedMedicine, DEFAULT_BRANCH_ID
 from sqlalchemy.exc import IntegrityError
-from datetime import datetime, date
-from sqlalchemy import and_, or_
+from sqlalchemy.orm.exc import StaleDataError
+from datetime import datetime, date, timedelta
+from sqlalchemy import or_
+from expiry_snapshot import filter_by_expiry, EXPIRED, EXPIRING_SOON, EXPIRING_SOON_DAYS
+from reference_cache import reference_cache
+from valuation import valuation_series, pick_granularity, PERIODS, DIMENSIONS
+from branches import load_branch_scope, scope_to_branch, is_partitioned, ensure_branch_partitions
+from serializers import medicines_payload, respond, compress_response
+from analytics_export import export_medicines, list_exports
+from parallel_queries import run_queries, QueryTimeout
+from single_flight import coalesce_requests
+from admission import admit
+from idempotency import idempotent
+from metrics import collect_metrics
+from expiry_calendar import expiry_histogram, DEFAULT_HORIZON_DAYS
+from archival import find_archived
+from audit import audit_history
+from batch_fetch import parse_ids, fetch_medicines, DEFAULT_MAX_IDS as DEFAULT_MAX_BATCH_IDS
+from expiry_forecast import refresh_expiry_forecast, cached_forecast
+from reorder import reorder_suggestions, DEFAULT_WINDOW as DEFAULT_REORDER_WINDOW, DEFAULT_LEAD_TIME, DEFAULT_REVIEW
+from stock_take import reconcile, upload_stream
+from stock_ledger import (record_movements, compact_movements, background_compactor, movement_history,
+                          live_balances, balances_as_of, parse_as_of)
+from repricing import reprice, price_history
+from profiling import (start_profiling, finish_profiling, abort_profiling, require_admin,
+                       list_profiles, profile_path, profiles_dir)
+from warmup import readiness
+from suggest_index import suggest_index, DEFAULT_LIMIT as DEFAULT_SUGGEST_LIMIT, MAX_LIMIT as MAX_SUGGEST_LIMIT
 
 # Create blueprint
 api_bp = Blueprint('api', __name__)
 
+# Admin-triggered or sampled request profiling (see profiling.py); registered
+# first so it wraps the other hooks, after_request runs in reverse order
+api_bp.before_request(start_profiling)
+api_bp.after_request(finish_profiling)
+api_bp.teardown_request(abort_profiling)
+# Every route honours ?branch_id= / X-Branch-Id (see branches.py)
+api_bp.before_request(load_branch_scope)
+# gzip larger responses for clients that accept it (see serializers.py)
+api_bp.after_request(compress_response)
+
+def get_medicine_in_scope_or_404(medicine_id):
+    """get_or_404 that also hides medicines outside the request's branch"""
+    query = Medicine.query.filter(Medicine.id == medicine_id)
+    return scope_to_branch(query, Medicine.branch_id).first_or_404()
+
+def paginate_with_archive(apply_filters, page, per_page):
+    """One page of live and archived medicines ordered by expiry, returns (items, total)"""
+    combined = db.union_all(
+        apply_filters(db.session.query(
+            Medicine.id, Medicine.expiry_date, db.literal(False).label('archived')
+        ), Medicine).statement,
+        apply_filters(db.session.query(
+            ArchivedMedicine.id, ArchivedMedicine.expiry_date, db.literal(True).label('archived')
+        ), ArchivedMedicine).statement
+    ).subquery()
+    total = db.session.execute(db.select(db.func.count()).select_from(combined)).scalar()
+    rows = db.session.execute(
+        db.select(combined.c.id, combined.c.archived)
+        .order_by(combined.c.expiry_date.asc(), combined.c.id)
+        .limit(per_page).offset((max(page, 1) - 1) * per_page)
+    ).all()
+    
+    live_ids = [row.id for row in rows if not row.archived]
+    archived_ids = [row.id for row in rows if row.archived]
+    found = {}
+    if live_ids:
+        found.update({(m.id, False): m for m in Medicine.query.filter(Medicine.id.in_(live_ids))})
+    if archived_ids:
+        found.update({(m.id, True): m for m in ArchivedMedicine.query.filter(ArchivedMedicine.id.in_(archived_ids))})
+    return [found[(row.id, bool(row.archived))] for row in rows if (row.id, bool(row.archived)) in found], total
+
+def check_if_match(medicine):
+    """412 when If-Match names another version, 428 when it is required but missing"""
+    if not request.if_match:
+        if current_app.config.get('REQUIRE_IF_MATCH', False):
+            return jsonify({'error': 'If-Match header is required'}), 428
+        return None
+    if not request.if_match.contains(medicine.etag):
+        return medicine_conflict(medicine)
+    return None
+
+def medicine_conflict(medicine):
+    """412 carrying the current representation so the client can re-apply its edit"""
+    response = jsonify({
+        'error': 'Medicine was modified by another request',
+        'medicine': medicine.to_dict()
+    })
+    response.status_code = 412
+    response.set_etag(medicine.etag)
+    return response
+
 # =============================================================================
 # ENHANCED MEDICINE ROUTES
 # =============================================================================
 
 @api_bp.route('/medicines', methods=['GET'])
+@admit('list')
 def get_all_medicines():
     """Get all medicines with enhanced filtering"""
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = max(1, min(request.args.get('per_page', 10, type=int), current_app.config.get('MAX_PER_PAGE', 200)))
         
         # Filter parameters
         category_id = request.args.get('category_id', type=int)
@@ -32,65 +121,80 @@ def get_all_medicines():
         purchase_date_from = request.args.get('purchase_date_from')
         purchase_date_to = request.args.get('purchase_date_to')
         
-        query = Medicine.query
-        
-        # Apply filters
-        if category_id:
-            query = query.filter(Medicine.category_id == category_id)
-        if manufacturer_id:
-            query = query.filter(Medicine.manufacturer_id == manufacturer_id)
-        if search:
-            query = query.filter(
-                or_(
-                    Medicine.name.ilike(f'%{search}%'),
-                    Medicine.description.ilike(f'%{search}%'),
-                    Medicine.batch_number.ilike(f'%{search}%')
-                )
-            )
+        include_archived = request.args.get('include_archived', 'false').lower() == 'true'
         
-        # Status filters
-        if expired:
-            query = query.filter(Medicine.expiry_date < date.today())
-        if expiring_soon:
-            from datetime import timedelta
-            soon_date = date.today() + timedelta(days=30)
-            query = query.filter(
-                and_(
-                    Medicine.expiry_date >= date.today(),
-                    Medicine.expiry_date <= soon_date
+        def apply_filters(query, model):
+            """Apply the request's filters to a Medicine or ArchivedMedicine query"""
+            query = scope_to_branch(query, model.branch_id)
+            if category_id:
+                query = query.filter(model.category_id == category_id)
+            if manufacturer_id:
+                query = query.filter(model.manufacturer_id == manufacturer_id)
+            if search:
+                query = query.filter(
+                    or_(
+                        model.name.ilike(f'%{search}%'),
+                        model.description.ilike(f'%{search}%'),
+                        model.batch_number.ilike(f'%{search}%')
+                    )
                 )
-            )
-        if low_stock:
-            query = query.filter(Medicine.quantity <= Medicine.minimum_stock)
-        
-        # Date range filters
-        if purchase_date_from:
-            from_date = datetime.strptime(purchase_date_from, '%Y-%m-%d').date()
-            query = query.filter(Medicine.purchase_date >= from_date)
-        if purchase_date_to:
-            to_date = datetime.strptime(purchase_date_to, '%Y-%m-%d').date()
-            query = query.filter(Medicine.purchase_date <= to_date)
+            
+            # Status filters (archived rows are not in the expiry snapshot)
+            if expired:
+                if model is Medicine:
+                    query = filter_by_expiry(query, EXPIRED, g.branch_id)
+                else:
+                    query = query.filter(model.expiry_date < date.today())
+            if expiring_soon:
+                if model is Medicine:
+                    query = filter_by_expiry(query, EXPIRING_SOON, g.branch_id)
+                else:
+                    query = query.filter(model.expiry_date.between(
+                        date.today(), date.today() + timedelta(days=EXPIRING_SOON_DAYS)
+                    ))
+            if low_stock:
+                query = query.filter(model.quantity <= model.minimum_stock)
+            
+            # Date range filters
+            if purchase_date_from:
+                from_date = datetime.strptime(purchase_date_from, '%Y-%m-%d').date()
+                query = query.filter(model.purchase_date >= from_date)
+            if purchase_date_to:
+                to_date = datetime.strptime(purchase_date_to, '%Y-%m-%d').date()
+                query = query.filter(model.purchase_date <= to_date)
+            return query
+        
+        if include_archived:
+            items, total = paginate_with_archive(apply_filters, page, per_page)
+            return respond({
+                'medicines': medicines_payload(items),
+                'total': total,
+                'pages': (total + per_page - 1) // per_page,
+                'current_page': page,
+                'per_page': per_page
+            }, 200)
         
         # Order by expiry date (closest first)
-        query = query.order_by(Medicine.expiry_date.asc())
+        query = apply_filters(Medicine.query, Medicine).order_by(Medicine.expiry_date.asc())
         
         # Paginate results
         medicines = query.paginate(
             page=page, per_page=per_page, error_out=False
         )
         
-        return jsonify({
-            'medicines': [medicine.to_dict() for medicine in medicines.items],
+        return respond({
+            'medicines': medicines_payload(medicines.items),
             'total': medicines.total,
             'pages': medicines.pages,
             'current_page': page,
             'per_page': per_page
-        }), 200
+        }, 200)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/medicines', methods=['POST'])
+@idempotent
 def create_medicine():
     """Create a new medicine with all required fields"""
     try:
@@ -106,15 +210,18 @@ def create_medicine():
                 return jsonify({'error': f'{field} is required'}), 400
         
         # Validate manufacturer exists
-        manufacturer = Manufacturer.query.get(data['manufacturer_id'])
-        if not manufacturer:
+        if not reference_cache.manufacturer_exists(data['manufacturer_id']):
             return jsonify({'error': 'Manufacturer not found'}), 400
         
         # Validate category exists
-        category = MedicineCategory.query.get(data['category_id'])
-        if not category:
+        if not reference_cache.category_exists(data['category_id']):
             return jsonify({'error': 'Category not found'}), 400
         
+        # Branch from the body, then the request scope, then the default branch
+        branch_id = data.get('branch_id') or g.branch_id or DEFAULT_BRANCH_ID
+        if not reference_cache.branch_exists(branch_id):
+            return jsonify({'error': 'Branch not found'}), 400
+        
         # Parse dates
         try:
             expiry_date = datetime.strptime(data['expiry_date'], '%Y-%m-%d').date()
@@ -130,6 +237,7 @@ def create_medicine():
         
         # Create new medicine
         medicine = Medicine(
+            branch_id=int(branch_id),
             name=data['name'],
             description=data.get('description', ''),
             batch_number=data['batch_number'],
@@ -148,10 +256,12 @@ def create_medicine():
         db.session.add(medicine)
         db.session.commit()
         
-        return jsonify({
+        response = jsonify({
             'message': 'Medicine created successfully',
             'medicine': medicine.to_dict()
-        }), 201
+        })
+        response.set_etag(medicine.etag)
+        return response, 201
         
     except IntegrityError:
         db.session.rollback()
@@ -161,10 +271,14 @@ def create_medicine():
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/medicines/<int:medicine_id>', methods=['PUT'])
+@idempotent
 def update_medicine(medicine_id):
     """Update an existing medicine"""
     try:
-        medicine = Medicine.query.get_or_404(medicine_id)
+        medicine = get_medicine_in_scope_or_404(medicine_id)
+        precondition_failed = check_if_match(medicine)
+        if precondition_failed:
+            return precondition_failed
         data = request.get_json()
         
         # Update basic fields
@@ -188,15 +302,18 @@ def update_medicine(medicine_id):
             medicine.form = data['form']
         
         # Update relationships
+        if 'branch_id' in data:
+            if not reference_cache.branch_exists(data['branch_id']):
+                return jsonify({'error': 'Branch not found'}), 400
+            medicine.branch_id = int(data['branch_id'])
+        
         if 'manufacturer_id' in data:
-            manufacturer = Manufacturer.query.get(data['manufacturer_id'])
-            if not manufacturer:
+            if not reference_cache.manufacturer_exists(data['manufacturer_id']):
                 return jsonify({'error': 'Manufacturer not found'}), 400
             medicine.manufacturer_id = data['manufacturer_id']
         
         if 'category_id' in data:
-            category = MedicineCategory.query.get(data['category_id'])
-            if not category:
+            if not reference_cache.category_exists(data['category_id']):
                 return jsonify({'error': 'Category not found'}), 400
             medicine.category_id = data['category_id']
         
@@ -220,88 +337,364 @@ def update_medicine(medicine_id):
         medicine.updated_at = datetime.utcnow()
         db.session.commit()
         
-        return jsonify({
+        response = jsonify({
             'message': 'Medicine updated successfully',
             'medicine': medicine.to_dict()
-        }), 200
+        })
+        response.set_etag(medicine.etag)
+        return response, 200
+        
+    except StaleDataError:
+        # A concurrent update won between our read and our UPDATE
+        db.session.rollback()
+        return medicine_conflict(get_medicine_in_scope_or_404(medicine_id))
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/medicines/batch', methods=['GET', 'POST'])
+@admit('list')
+def get_medicines_batch():
+    """Get many medicines by id in one query, missing ids map to null"""
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            values = data.get('ids')
+            include_archived = bool(data.get('include_archived', False))
+        else:
+            values = request.args.get('ids', '')
+            include_archived = request.args.get('include_archived', 'false').lower() == 'true'
+        try:
+            ids = parse_ids(values, current_app.config.get('MAX_BATCH_IDS', DEFAULT_MAX_BATCH_IDS))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
+        medicines = fetch_medicines(ids, g.branch_id, include_archived)
+        missing = [medicine_id for medicine_id, medicine in medicines.items() if medicine is None]
+        return respond({
+            'medicines': {
+                str(medicine_id): medicine.to_dict() if medicine is not None else None
+                for medicine_id, medicine in medicines.items()
+            },
+            'found': len(ids) - len(missing),
+            'missing': missing
+        }, 200)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/medicines/suggest', methods=['GET'])
+def suggest_medicines():
+    """Typeahead suggestions from the in-memory prefix index"""
+    try:
+        query = request.args.get('q', '')
+        limit = max(1, min(request.args.get('limit', DEFAULT_SUGGEST_LIMIT, type=int), MAX_SUGGEST_LIMIT))
+        return jsonify({
+            'query': query,
+            'suggestions': suggest_index.search(query, limit, g.branch_id)
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/medicines/reprice', methods=['POST'])
+@idempotent
+def reprice_medicines():
+    """Bulk percentage/absolute price change by category, manufacturer or ids"""
+    try:
+        data = request.get_json() or {}
+        summary = reprice(data, g.branch_id, dry_run=bool(data.get('dry_run')))
+        return jsonify(summary), 200
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/medicines/<int:medicine_id>/price-history', methods=['GET'])
+def get_price_history(medicine_id):
+    """Price changes of one medicine, newest first"""
+    try:
+        get_medicine_in_scope_or_404(medicine_id)
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        return jsonify({
+            'medicine_id': medicine_id,
+            'history': [entry.to_dict() for entry in price_history(medicine_id, limit)]
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/medicines/<int:medicine_id>/audit', methods=['GET'])
+def get_medicine_audit(medicine_id):
+    """Get who changed a medicine's stock, prices and dates, newest first"""
+    try:
+        limit = max(1, min(request.args.get('limit', 100, type=int), current_app.config.get('MAX_PER_PAGE', 200)))
+        entries = audit_history(medicine_id, g.branch_id, limit)
+        return jsonify({
+            'medicine_id': medicine_id,
+            'entries': [entry.to_dict() for entry in entries]
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/medicines/reorder', methods=['GET'])
+@coalesce_requests
+@admit('report')
+def get_reorder_suggestions():
+    """Suggested order quantities from recent demand, least cover first"""
+    try:
+        result = reorder_suggestions(
+            window=request.args.get('window', DEFAULT_REORDER_WINDOW, type=int),
+            lead_time=request.args.get('lead_time', DEFAULT_LEAD_TIME, type=int),
+            review=request.args.get('review', DEFAULT_REVIEW, type=int),
+            branch_id=g.branch_id,
+            include_all=request.args.get('all', 'false').lower() == 'true',
+            limit=min(request.args.get('limit', 100, type=int), 5000)
+        )
+        return jsonify(result), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 501
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/medicines/expiry-risk', methods=['GET'])
+@coalesce_requests
+@admit('report')
+def get_expiry_risk():
+    """Batches projected to expire unsold, from the cached FEFO forecast"""
+    try:
+        limit = min(request.args.get('limit', 100, type=int), 5000)
+        return jsonify(cached_forecast(g.branch_id, limit)), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/medicines/expiry-risk/refresh', methods=['POST'])
+@admit('report')
+def refresh_expiry_risk():
+    """Recompute the cached FEFO forecast now instead of waiting for the nightly job"""
+    try:
+        message = refresh_expiry_forecast()
+        limit = min(request.args.get('limit', 100, type=int), 5000)
+        return jsonify(dict(cached_forecast(g.branch_id, limit), message=message)), 200
+    except RuntimeError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 501
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@api_bp.route('/stock-take', methods=['POST'])
+@admit('report')
+@idempotent
+def upload_stock_take():
+    """Variance report for a batch_number,counted_quantity CSV, optionally applied"""
+    try:
+        upload = request.files.get('file')
+        stream = upload_stream(upload) if upload else io.StringIO(request.get_data(as_text=True))
+        apply = request.args.get('apply', 'false').lower() == 'true'
+        report = reconcile(stream, g.branch_id, apply)
+        return jsonify(report), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/stock-movements', methods=['POST'])
+@idempotent
+def create_stock_movements():
+    """Append receipts, sales, adjustments or write-offs to the stock ledger"""
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get('movements') if 'movements' in data else [data]
+        try:
+            ids = record_movements(items, g.branch_id)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        db.session.commit()
+        compacted = None
+        if current_app.config.get('STOCK_COMPACT_IN_BACKGROUND', False):
+            background_compactor.wake()
+        if current_app.config.get('STOCK_COMPACT_ON_WRITE', False):
+            try:
+                compacted = compact_movements()
+            except Exception as e:
+                # The movements are committed, a failure here must not invite a retry
+                db.session.rollback()
+                compacted = f'Compaction failed, movements stay pending: {e}'
+        return jsonify({'ids': ids, 'count': len(ids), 'compacted': compacted}), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/medicines/<int:medicine_id>/movements', methods=['GET'])
+def get_medicine_movements(medicine_id):
+    """Get a medicine's stock ledger, newest first"""
+    try:
+        limit = max(1, min(request.args.get('limit', 100, type=int), current_app.config.get('MAX_PER_PAGE', 200)))
+        movements = movement_history(medicine_id, g.branch_id, limit)
+        return jsonify({
+            'medicine_id': medicine_id,
+            'movements': [movement.to_dict() for movement in movements]
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/medicines/<int:medicine_id>/stock', methods=['GET'])
+def get_medicine_stock(medicine_id):
+    """Get a medicine's stock balance now or at ?as_of=YYYY-MM-DD[THH:MM:SS] (UTC)"""
+    try:
+        medicine = get_medicine_in_scope_or_404(medicine_id)
+        try:
+            at = parse_as_of(request.args.get('as_of'))
+        except ValueError:
+            return jsonify({'error': 'as_of must be an ISO date or datetime'}), 400
+        quantity, pending = live_balances([medicine.id])[medicine.id]
+        return jsonify({
+            'medicine_id': medicine.id,
+            'as_of': at.isoformat(),
+            'balance': balances_as_of([medicine.id], at)[medicine.id],
+            'quantity': quantity,
+            'pending': pending
+        }), 200
+    except Exception as e:
+        return jsonify({'error': 'Medicine not found'}), 404
+
 @api_bp.route('/medicines/alerts', methods=['GET'])
+@coalesce_requests
+@admit('report')
 def get_medicine_alerts():
     """Get medicines that need attention (expired, expiring soon, low stock)"""
     try:
-        from datetime import timedelta
+        branch_id = g.branch_id
         
-        today = date.today()
-        soon_date = today + timedelta(days=30)
+        def medicines(session):
+            return scope_to_branch(session.query(Medicine), Medicine.branch_id, branch_id)
         
-        # Get expired medicines
-        expired = Medicine.query.filter(Medicine.expiry_date < today).all()
+        # The three selects are independent, run them concurrently
+        results = run_queries({
+            # Expired medicines (read from the expiry snapshot)
+            'expired': lambda session: filter_by_expiry(
+                medicines(session), EXPIRED, branch_id
+            ).all(),
+            # Medicines expiring soon (within 30 days)
+            'expiring_soon': lambda session: filter_by_expiry(
+                medicines(session), EXPIRING_SOON, branch_id
+            ).all(),
+            # Low stock medicines
+            'low_stock': lambda session: medicines(session).filter(
+                Medicine.quantity <= Medicine.minimum_stock
+            ).all()
+        })
+        expired = results['expired']
+        expiring_soon = results['expiring_soon']
+        low_stock = results['low_stock']
         
-        # Get medicines expiring soon (within 30 days)
-        expiring_soon = Medicine.query.filter(
-            and_(
-                Medicine.expiry_date >= today,
-                Medicine.expiry_date <= soon_date
-            )
-        ).all()
-        
-        # Get low stock medicines
-        low_stock = Medicine.query.filter(
-            Medicine.quantity <= Medicine.minimum_stock
-        ).all()
-        
-        return jsonify({
+        return respond({
             'alerts': {
                 'expired': {
                     'count': len(expired),
-                    'medicines': [med.to_dict() for med in expired]
+                    'medicines': medicines_payload(expired)
                 },
                 'expiring_soon': {
                     'count': len(expiring_soon),
-                    'medicines': [med.to_dict() for med in expiring_soon]
+                    'medicines': medicines_payload(expiring_soon)
                 },
                 'low_stock': {
                     'count': len(low_stock),
-                    'medicines': [med.to_dict() for med in low_stock]
+                    'medicines': medicines_payload(low_stock)
                 }
             }
+        }, 200)
+        
+    except QueryTimeout as e:
+        return jsonify({'error': str(e)}), 504
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/medicines/alerts/branches', methods=['GET'])
+@coalesce_requests
+@admit('report')
+def get_branch_alerts():
+    """Get alert counts for every branch, one grouped query per alert type"""
+    try:
+        def counts(query):
+            return dict(query.group_by(Medicine.branch_id).all())
+        
+        def per_branch(session):
+            return session.query(Medicine.branch_id, db.func.count(Medicine.id))
+        
+        # Expiry counts read the same snapshot as /medicines/alerts
+        results = run_queries({
+            'expired': lambda session: counts(filter_by_expiry(per_branch(session), EXPIRED)),
+            'expiring_soon': lambda session: counts(filter_by_expiry(per_branch(session), EXPIRING_SOON)),
+            'low_stock': lambda session: counts(per_branch(session).filter(
+                Medicine.quantity <= Medicine.minimum_stock
+            )),
+            'medicines': lambda session: counts(per_branch(session))
+        })
+        branch_ids = sorted(results['medicines'])
+        
+        return jsonify({
+            'branches': [
+                {
+                    'branch_id': branch_id,
+                    'branch': reference_cache.branch_name(branch_id),
+                    'expired': int(results['expired'].get(branch_id, 0)),
+                    'expiring_soon': int(results['expiring_soon'].get(branch_id, 0)),
+                    'low_stock': int(results['low_stock'].get(branch_id, 0))
+                }
+                for branch_id in branch_ids
+            ]
         }), 200
         
+    except QueryTimeout as e:
+        return jsonify({'error': str(e)}), 504
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/medicines/reports/inventory', methods=['GET'])
+@coalesce_requests
+@admit('report')
 def get_inventory_report():
     """Get comprehensive inventory report"""
     try:
-        # Total medicines and value
-        total_medicines = Medicine.query.count()
-        total_value = db.session.query(
-            db.func.sum(Medicine.selling_price * Medicine.quantity)
-        ).scalar() or 0
-        
-        total_cost = db.session.query(
-            db.func.sum(Medicine.cost_price * Medicine.quantity)
-        ).filter(Medicine.cost_price.isnot(None)).scalar() or 0
-        
-        # Category breakdown
-        category_stats = db.session.query(
-            MedicineCategory.name,
-            db.func.count(Medicine.id).label('count'),
-            db.func.sum(Medicine.quantity).label('total_quantity'),
-            db.func.sum(Medicine.selling_price * Medicine.quantity).label('value')
-        ).join(Medicine).group_by(MedicineCategory.name).all()
+        branch_id = g.branch_id
         
-        # Manufacturer breakdown
-        manufacturer_stats = db.session.query(
-            Manufacturer.name,
-            db.func.count(Medicine.id).label('count'),
-            db.func.sum(Medicine.quantity).label('total_quantity')
-        ).join(Medicine).group_by(Manufacturer.name).all()
+        def scoped(query):
+            return scope_to_branch(query, Medicine.branch_id, branch_id)
+        
+        # The five aggregates are independent, run them concurrently
+        results = run_queries({
+            # Total medicines and value
+            'total_medicines': lambda session: scoped(session.query(
+                db.func.count(Medicine.id)
+            )).scalar(),
+            'total_value': lambda session: scoped(session.query(
+                db.func.sum(Medicine.selling_price * Medicine.quantity)
+            )).scalar(),
+            'total_cost': lambda session: scoped(session.query(
+                db.func.sum(Medicine.cost_price * Medicine.quantity)
+            ).filter(Medicine.cost_price.isnot(None))).scalar(),
+            # Category breakdown (names resolved from the reference cache, no join)
+            'category_stats': lambda session: scoped(session.query(
+                Medicine.category_id,
+                db.func.count(Medicine.id).label('count'),
+                db.func.sum(Medicine.quantity).label('total_quantity'),
+                db.func.sum(Medicine.selling_price * Medicine.quantity).label('value')
+            ).filter(Medicine.category_id.isnot(None))).group_by(Medicine.category_id).all(),
+            # Manufacturer breakdown
+            'manufacturer_stats': lambda session: scoped(session.query(
+                Medicine.manufacturer_id,
+                db.func.count(Medicine.id).label('count'),
+                db.func.sum(Medicine.quantity).label('total_quantity')
+            ).filter(Medicine.manufacturer_id.isnot(None))).group_by(Medicine.manufacturer_id).all()
+        })
+        total_medicines = results['total_medicines']
+        total_value = results['total_value'] or 0
+        total_cost = results['total_cost'] or 0
+        category_stats = results['category_stats']
+        manufacturer_stats = results['manufacturer_stats']
         
         return jsonify({
             'summary': {
@@ -312,7 +705,7 @@ def get_inventory_report():
             },
             'by_category': [
                 {
-                    'category': stat.name,
+                    'category': reference_cache.category_name(stat.category_id),
                     'medicine_count': stat.count,
                     'total_quantity': stat.total_quantity,
                     'total_value': float(stat.value or 0)
@@ -321,7 +714,7 @@ def get_inventory_report():
             ],
             'by_manufacturer': [
                 {
-                    'manufacturer': stat.name,
+                    'manufacturer': reference_cache.manufacturer_name(stat.manufacturer_id),
                     'medicine_count': stat.count,
                     'total_quantity': stat.total_quantity
                 }
@@ -329,6 +722,313 @@ def get_inventory_report():
             ]
         }), 200
         
+    except QueryTimeout as e:
+        return jsonify({'error': str(e)}), 504
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/medicines/reports/inventory/branches', methods=['GET'])
+@coalesce_requests
+@admit('report')
+def get_branch_inventory_report():
+    """Get inventory totals for every branch from one grouped query"""
+    try:
+        rows = db.session.query(
+            Medicine.branch_id,
+            db.func.count(Medicine.id).label('count'),
+            db.func.sum(Medicine.quantity).label('total_quantity'),
+            db.func.sum(Medicine.selling_price * Medicine.quantity).label('value'),
+            db.func.sum(Medicine.cost_price * Medicine.quantity).label('cost')
+        ).group_by(Medicine.branch_id).order_by(Medicine.branch_id).all()
+        
+        branches = [
+            {
+                'branch_id': row.branch_id,
+                'branch': reference_cache.branch_name(row.branch_id),
+                'medicine_count': row.count,
+                'total_quantity': int(row.total_quantity or 0),
+                'total_inventory_value': float(row.value or 0),
+                'total_cost_value': float(row.cost or 0),
+                'potential_profit': float((row.value or 0) - (row.cost or 0))
+            }
+            for row in rows
+        ]
+        
+        return jsonify({
+            'summary': {
+                'branch_count': len(branches),
+                'total_medicines': sum(b['medicine_count'] for b in branches),
+                'total_inventory_value': sum(b['total_inventory_value'] for b in branches),
+                'total_cost_value': sum(b['total_cost_value'] for b in branches),
+                'potential_profit': sum(b['potential_profit'] for b in branches)
+            },
+            'branches': branches
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/medicines/reports/expiry-calendar', methods=['GET'])
+@coalesce_requests
+@admit('report')
+def get_expiry_calendar():
+    """Units and value expiring per day/week/month over the horizon"""
+    try:
+        result = expiry_histogram(
+            bucket=request.args.get('bucket', 'month'),
+            horizon_days=request.args.get('horizon_days', DEFAULT_HORIZON_DAYS, type=int),
+            split_by=request.args.get('split_by') or None,
+            branch_id=g.branch_id
+        )
+        return jsonify(result), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/medicines/reports/valuation', methods=['GET'])
+@admit('report')
+def get_valuation_report():
+    """Get stock value over time from the valuation snapshots"""
+    try:
+        try:
+            date_to = date.today()
+            if request.args.get('to'):
+                date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date()
+            date_from = date_to - timedelta(days=365)
+            if request.args.get('from'):
+                date_from = datetime.strptime(request.args['from'], '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+        
+        if date_from > date_to:
+            return jsonify({'error': 'from must not be after to'}), 400
+        
+        granularity = request.args.get('granularity', 'auto')
+        if granularity == 'auto':
+            granularity = pick_granularity(date_from, date_to)
+        if granularity not in PERIODS:
+            return jsonify({'error': f'granularity must be one of: auto, {", ".join(PERIODS)}'}), 400
+        
+        dimension = request.args.get('dimension', 'total')
+        if dimension not in DIMENSIONS:
+            return jsonify({'error': f'dimension must be one of: {", ".join(DIMENSIONS)}'}), 400
+        dimension_id = request.args.get('id', type=int)
+        
+        rows = valuation_series(date_from, date_to, granularity, dimension, dimension_id)
+        
+        names = {}
+        if dimension == 'branch':
+            names = reference_cache.branches()
+        elif dimension == 'category':
+            names = reference_cache.categories()
+        elif dimension == 'manufacturer':
+            names = reference_cache.manufacturers()
+        
+        points = []
+        for row in rows:
+            point = row.to_dict()
+            if dimension != 'total':
+                point['name'] = names.get(row.dimension_id, 'Unknown')
+            points.append(point)
+        
+        return jsonify({
+            'from': date_from.isoformat(),
+            'to': date_to.isoformat(),
+            'granularity': granularity,
+            'dimension': dimension,
+            'points': points
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# =============================================================================
+# CATEGORY & MANUFACTURER ROUTES
+# =============================================================================
+
+@api_bp.route('/categories', methods=['GET'])
+def get_categories():
+    """Get all categories with medicine counts from one grouped subquery"""
+    try:
+        counts = MedicineCategory.medicine_counts_subquery(g.branch_id)
+        rows = db.session.query(
+            MedicineCategory,
+            db.func.coalesce(counts.c.medicine_count, 0)
+        ).outerjoin(
+            counts, counts.c.category_id == MedicineCategory.id
+        ).order_by(MedicineCategory.name).all()
+        
+        return jsonify({
+            'categories': [
+                category.to_dict(medicine_count=count) for category, count in rows
+            ]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/manufacturers', methods=['GET'])
+def get_manufacturers():
+    """Get all manufacturers with medicine counts from one grouped subquery"""
+    try:
+        counts = Manufacturer.medicine_counts_subquery(g.branch_id)
+        rows = db.session.query(
+            Manufacturer,
+            db.func.coalesce(counts.c.medicine_count, 0)
+        ).outerjoin(
+            counts, counts.c.manufacturer_id == Manufacturer.id
+        ).order_by(Manufacturer.name).all()
+        
+        return jsonify({
+            'manufacturers': [
+                manufacturer.to_dict(medicine_count=count) for manufacturer, count in rows
+            ]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# =============================================================================
+# BRANCH ROUTES
+# =============================================================================
+
+@api_bp.route('/branches', methods=['GET'])
+def get_branches():
+    """Get all branches with medicine counts from one grouped subquery"""
+    try:
+        counts = Branch.medicine_counts_subquery()
+        rows = db.session.query(
+            Branch,
+            db.func.coalesce(counts.c.medicine_count, 0)
+        ).outerjoin(
+            counts, counts.c.branch_id == Branch.id
+        ).order_by(Branch.code).all()
+        
+        return jsonify({
+            'branches': [branch.to_dict(medicine_count=count) for branch, count in rows]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/branches', methods=['POST'])
+@idempotent
+def create_branch():
+    """Create a branch (and its medicines partition when partitioned)"""
+    try:
+        data = request.get_json()
+        
+        for field in ('code', 'name'):
+            if field not in data or not data[field]:
+                return jsonify({'error': f'{field} is required'}), 400
+        
+        branch = Branch(
+            code=data['code'],
+            name=data['name'],
+            address=data.get('address'),
+            phone=data.get('phone')
+        )
+        db.session.add(branch)
+        db.session.commit()
+        
+        if is_partitioned():
+            ensure_branch_partitions()
+        
+        return jsonify({
+            'message': 'Branch created successfully',
+            'branch': branch.to_dict(medicine_count=0)
+        }), 201
+        
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'Branch with this code already exists'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+# =============================================================================
+# EXPORT ROUTES
+# =============================================================================
+
+@api_bp.route('/exports/analytics', methods=['POST'])
+@admit('export')
+def create_analytics_export():
+    """Export medicines to Parquet/Arrow files in ANALYTICS_EXPORT_DIR"""
+    try:
+        data = request.get_json(silent=True) or {}
+        manifest = export_medicines(
+            current_app.config['ANALYTICS_EXPORT_DIR'],
+            partition_by=data.get('partition_by', 'category'),
+            fmt=data.get('format', 'parquet'),
+            incremental=bool(data.get('incremental', False)),
+            branch_id=g.branch_id
+        )
+        return jsonify({
+            'message': 'Export completed successfully',
+            'export': manifest
+        }), 201
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 501
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/exports/analytics', methods=['GET'])
+def get_analytics_exports():
+    """List previous analytics exports"""
+    try:
+        return jsonify({
+            'exports': list_exports(current_app.config['ANALYTICS_EXPORT_DIR'])
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# =============================================================================
+# METRICS ROUTES
+# =============================================================================
+
+@api_bp.route('/profiles', methods=['GET'])
+def get_profiles():
+    """Captured request profiles, newest first (admin only)"""
+    forbidden = require_admin()
+    if forbidden:
+        return forbidden
+    try:
+        return jsonify({'profiles': list_profiles(profiles_dir())}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """One profile as its text summary, metadata or raw cProfile dump (?format=prof)"""
+    forbidden = require_admin()
+    if forbidden:
+        return forbidden
+    fmt = request.args.get('format', 'txt')
+    path = profile_path(profiles_dir(), profile_id, fmt)
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_file(path, as_attachment=fmt == 'prof')
+
+@api_bp.route('/ready', methods=['GET'])
+def get_readiness():
+    """Readiness probe: 200 once this worker is warmed up and the database answers"""
+    ready, details = readiness()
+    return jsonify(dict(details, status='ready' if ready else 'warming')), 200 if ready else 503
+
+@api_bp.route('/live', methods=['GET'])
+def get_liveness():
+    """Liveness probe: the worker is serving requests"""
+    return jsonify({'status': 'alive'}), 200
+
+@api_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Get this worker process's operational counters"""
+    try:
+        return jsonify(collect_metrics()), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -337,16 +1037,23 @@ def get_inventory_report():
 def get_medicine(medicine_id):
     """Get a specific medicine by ID"""
     try:
-        medicine = Medicine.query.get_or_404(medicine_id)
-        return jsonify(medicine.to_dict()), 200
+        if request.args.get('include_archived', 'false').lower() == 'true':
+            archived = find_archived(medicine_id, g.branch_id)
+            if archived is not None:
+                return jsonify(archived.to_dict()), 200
+        medicine = get_medicine_in_scope_or_404(medicine_id)
+        response = jsonify(medicine.to_dict())
+        response.set_etag(medicine.etag)
+        return response, 200
     except Exception as e:
         return jsonify({'error': 'Medicine not found'}), 404
 
 @api_bp.route('/medicines/<int:medicine_id>', methods=['DELETE'])
+@idempotent
 def delete_medicine(medicine_id):
     """Delete a medicine"""
     try:
-        medicine = Medicine.query.get_or_404(medicine_id)
+        medicine = get_medicine_in_scope_or_404(medicine_id)
         db.session.delete(medicine)
         db.session.commit()
         
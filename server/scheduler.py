@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Lightweight in-process scheduler for periodic maintenance jobs.
+
+Jobs register themselves with ``register_job`` and can either run on a
+background thread inside the web process (``start_scheduler``) or be
+triggered from the command line:
+
+    python scheduler.py --list
+    python scheduler.py --run expiry_snapshot
+    python scheduler.py --loop
+
+Only enable the background thread in ONE process per database, jobs are
+idempotent but running them from several workers at once is wasted work.
+"""
+
+import os
+import sys
+import threading
+import logging
+from datetime import datetime, timedelta, time as dtime
+
+logger = logging.getLogger(__name__)
+
+# name -> {'func': callable, 'at': 'HH:MM' or None, 'every': seconds or None}
+_jobs = {}
+
+
+def register_job(name, func, at=None, every=None):
+    """Register a job to run daily at ``at`` ('HH:MM') or every ``every`` seconds"""
+    if (at is None) == (every is None):
+        raise ValueError('Specify exactly one of at or every')
+    _jobs[name] = {'func': func, 'at': at, 'every': every}
+
+
+def registered_jobs():
+    return dict(_jobs)
+
+
+def run_job(app, name):
+    """Run a single registered job inside an application context"""
+    job = _jobs.get(name)
+    if job is None:
+        raise KeyError(f'Unknown job: {name}')
+    with app.app_context():
+        return job['func']()
+
+
+def _next_run(job, now, last_run):
+    """When a job is next due, given the time it last ran (or None)"""
+    if job['every']:
+        if last_run is None:
+            return now
+        return last_run + timedelta(seconds=job['every'])
+
+    hour, minute = (int(part) for part in job['at'].split(':'))
+    due = datetime.combine(now.date(), dtime(hour, minute))
+    if last_run is None:
+        # Catch up once at startup, jobs are idempotent
+        return now
+    if due <= last_run:
+        due += timedelta(days=1)
+    return due
+
+
+class Scheduler(threading.Thread):
+    """Daemon thread that runs registered jobs when they fall due"""
+
+    def __init__(self, app):
+        super().__init__(name='scheduler', daemon=True)
+        self.app = app
+        self.last_run = {}
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            now = datetime.now()
+            next_due = None
+            for name, job in list(_jobs.items()):
+                due = _next_run(job, now, self.last_run.get(name))
+                if due <= now:
+                    try:
+                        run_job(self.app, name)
+                    except Exception:
+                        logger.exception('Scheduled job %s failed', name)
+                    self.last_run[name] = datetime.now()
+                    due = _next_run(job, datetime.now(), self.last_run[name])
+                if next_due is None or due < next_due:
+                    next_due = due
+
+            wait = (next_due - datetime.now()).total_seconds() if next_due else 60
+            self._stop_event.wait(max(1, min(wait, 300)))
+
+
+_scheduler = None
+
+
+def start_scheduler(app):
+    """Start the background scheduler thread once per process"""
+    global _scheduler
+    if _scheduler is None or not _scheduler.is_alive():
+        _scheduler = Scheduler(app)
+        _scheduler.start()
+    return _scheduler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Add the current directory to Python path
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+    from app import app
+    # Jobs register on the imported module, not on __main__
+    from scheduler import registered_jobs, run_job, Scheduler
+
+    parser = argparse.ArgumentParser(description="Run scheduled maintenance jobs")
+    parser.add_argument("--list", action="store_true", help="List registered jobs")
+    parser.add_argument("--run", metavar="JOB", help="Run a single job now")
+    parser.add_argument("--loop", action="store_true", help="Run the scheduler in the foreground")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.list:
+        for name, job in sorted(registered_jobs().items()):
+            schedule = f"daily at {job['at']}" if job['at'] else f"every {job['every']}s"
+            print(f"{name}: {schedule}")
+    elif args.run:
+        result = run_job(app, args.run)
+        print(f"✅ {args.run} finished: {result}")
+    elif args.loop:
+        print("⏰ Scheduler running, press Ctrl+C to stop")
+        worker = Scheduler(app)
+        worker.start()
+        try:
+            while worker.is_alive():
+                worker.join(1)
+        except KeyboardInterrupt:
+            worker.stop()
+    else:
+        parser.print_help()
@@ -9,7 +9,28 @@ import random
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from app import app
-from models import db, Medicine, MedicineCategory, Manufacturer
+from models import db, Medicine, MedicineCategory, Manufacturer, Branch, DEFAULT_BRANCH_ID
+from sqlalchemy import text
+
+def create_branches():
+    """Create the default branch every medicine belongs to unless told otherwise"""
+    branch = db.session.get(Branch, DEFAULT_BRANCH_ID)
+    if not branch:
+        branch = Branch(
+            id=DEFAULT_BRANCH_ID,
+            code="MAIN",
+            name="Main Branch"
+        )
+        db.session.add(branch)
+        db.session.flush()
+        # Explicit id doesn't advance the serial sequence on PostgreSQL
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(text(
+                "SELECT setval(pg_get_serial_sequence('branches', 'id'), (SELECT MAX(id) FROM branches))"
+            ))
+    
+    db.session.commit()
+    return [branch]
 
 def create_categories():
     """Create medicine categories"""
@@ -415,6 +436,10 @@ def seed_database():
             # Create tables if they don't exist
             db.create_all()
             
+            print("\n🏪 Creating branches...")
+            branches = create_branches()
+            print(f"✅ Created {len(branches)} branches")
+            
             print("\n📦 Creating categories...")
             categories = create_categories()
             print(f"✅ Created {len(categories)} categories")
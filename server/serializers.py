@@ -0,0 +1,136 @@
+"""
+Content negotiation and compact wire formats for medicine lists.
+
+Row layout (default) is the usual list of ``Medicine.to_dict()`` objects.
+Columnar layout sends one array per field and dictionary-encodes the
+manufacturer and category names:
+
+    {"layout": "columnar", "count": 2,
+     "columns": {"id": [1, 2], "manufacturer": [0, 0], ...},
+     "dictionaries": {"manufacturer": ["Cipla"], "category": ["Tablets"]}}
+
+Ask for it with ``?layout=columnar`` or ``Accept: application/vnd.medicines.columnar+json``.
+Either layout can be sent as MessagePack with ``Accept: application/msgpack``
+(needs the optional ``msgpack`` package, JSON is sent otherwise). Larger
+responses are gzip-compressed when the client accepts it.
+"""
+
+import gzip
+from datetime import date, datetime
+from decimal import Decimal
+from flask import request, jsonify, current_app
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+COLUMNAR_MIMETYPE = 'application/vnd.medicines.columnar+json'
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+# Fields dictionary-encoded in the columnar layout
+DICTIONARY_FIELDS = ('branch', 'manufacturer', 'category')
+# Nested objects that only repeat the *_id columns and dictionary names
+REDUNDANT_FIELDS = ('manufacturer_info', 'category_info')
+
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+
+
+def _best_mimetype():
+    offered = [JSON_MIMETYPE, COLUMNAR_MIMETYPE]
+    if msgpack is not None:
+        offered.extend(MSGPACK_MIMETYPES)
+    return request.accept_mimetypes.best_match(offered, default=JSON_MIMETYPE)
+
+
+def wants_columnar():
+    return request.args.get('layout') == 'columnar' or _best_mimetype() == COLUMNAR_MIMETYPE
+
+
+def wants_msgpack():
+    return _best_mimetype() in MSGPACK_MIMETYPES
+
+
+def medicines_columnar(medicines):
+    """Columnar, dictionary-encoded form of a list of medicines"""
+    columns = {}
+    dictionaries = {field: [] for field in DICTIONARY_FIELDS}
+    codes = {field: {} for field in DICTIONARY_FIELDS}
+
+    for medicine in medicines:
+        row = medicine.to_dict()
+        for field in REDUNDANT_FIELDS:
+            row.pop(field, None)
+        for field in DICTIONARY_FIELDS:
+            value = row[field]
+            code = codes[field].get(value)
+            if code is None:
+                code = codes[field][value] = len(dictionaries[field])
+                dictionaries[field].append(value)
+            row[field] = code
+        row['manufacturer_id'] = medicine.manufacturer_id
+        row['category_id'] = medicine.category_id
+        for field, value in row.items():
+            columns.setdefault(field, []).append(value)
+
+    return {
+        'layout': 'columnar',
+        'count': len(medicines),
+        'columns': columns,
+        'dictionaries': dictionaries
+    }
+
+
+def medicines_payload(medicines):
+    """Medicines in the layout the client asked for"""
+    if wants_columnar():
+        return medicines_columnar(medicines)
+    return [medicine.to_dict() for medicine in medicines]
+
+
+def _msgpack_default(value):
+    """Encode the non-native types jsonify also handles"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'Cannot serialise {type(value).__name__}')
+
+
+def respond(payload, status=200):
+    """Encode ``payload`` as MessagePack or JSON depending on Accept"""
+    if wants_msgpack():
+        response = current_app.response_class(
+            msgpack.packb(payload, use_bin_type=True, default=_msgpack_default),
+            status=status,
+            mimetype=MSGPACK_MIMETYPES[0]
+        )
+    else:
+        response = jsonify(payload)
+        response.status_code = status
+        if wants_columnar():
+            response.mimetype = COLUMNAR_MIMETYPE
+    response.vary.add('Accept')
+    return response
+
+
+def compress_response(response):
+    """after_request hook: gzip larger bodies for clients that accept it"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers):
+        return response
+    # Caches must key every compressible response on Accept-Encoding, compressed or not
+    response.vary.add('Accept-Encoding')
+    if request.accept_encodings.quality('gzip') <= 0:
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
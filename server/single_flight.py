@@ -0,0 +1,101 @@
+"""
+Single-flight coalescing of identical concurrent requests.
+
+When many terminals ask for the same expensive report at once, only the
+first request (the leader) runs the view; identical requests arriving while
+it is in flight wait for its response and get a copy of it. Requests are
+identical when endpoint, normalised query args, branch scope and Accept
+header match. Coalescing is per worker process.
+
+    @api_bp.route('/medicines/reports/inventory')
+    @coalesce_requests
+    def get_inventory_report(): ...
+"""
+
+import threading
+from functools import wraps
+from flask import request, make_response, current_app
+from metrics import register_metrics_source
+
+# How long a follower waits for the leader before computing itself
+FOLLOWER_TIMEOUT = 30.0
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    """Share one in-flight computation between callers with the same key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {}
+
+    def _count(self, name, field):
+        stats = self.stats.setdefault(name, {'executed': 0, 'coalesced': 0, 'timed_out': 0})
+        stats[field] += 1
+
+    def do(self, name, key, fn, timeout=FOLLOWER_TIMEOUT):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._count(name, 'executed')
+
+        if not leader:
+            if call.done.wait(timeout) and call.result is not None:
+                with self._lock:
+                    self._count(name, 'coalesced')
+                return call.result
+            with self._lock:
+                self._count(name, 'timed_out')
+            return fn()
+
+        try:
+            call.result = fn()
+            return call.result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'endpoints': {name: dict(stats) for name, stats in self.stats.items()}
+            }
+
+
+single_flight = SingleFlight()
+register_metrics_source('single_flight', single_flight.snapshot)
+
+
+def request_key():
+    """Endpoint plus everything that can change the response body"""
+    args = tuple(sorted(request.args.items(multi=True)))
+    return (
+        request.endpoint,
+        args,
+        request.headers.get('X-Branch-Id', ''),
+        request.headers.get('Accept', '')
+    )
+
+
+def coalesce_requests(view):
+    """Decorator: concurrent identical requests share one view execution"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        def run():
+            response = make_response(view(*args, **kwargs))
+            # Followers rebuild their own Response, after_request hooks mutate it
+            return response.get_data(), response.status_code, list(response.headers.items())
+
+        data, status, headers = single_flight.do(request.endpoint, request_key(), run)
+        return current_app.response_class(data, status=status, headers=headers)
+    return wrapper
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+Append-only stock movement ledger.
+
+Receipts, sales, adjustments and write-offs are appended to stock_movements
+instead of updating ``Medicine.quantity``, so busy batches no longer
+serialise on their medicines row. Quantities are signed in the ledger:
+receipts add, sales and write-offs take away, adjustments carry their own
+sign. Balances are not checked at append time, so a batch can be oversold
+and go negative until a correction is recorded.
+
+``compact_movements`` adds pending movements to ``medicines.quantity`` in
+chunks. Each chunk runs one batched UPDATE that also bumps ``version``.
+Sales compacted this way are recorded as demand in medicine_usage for the
+reorder engine. It runs as the 'stock_ledger_compaction' job and, while
+STOCK_COMPACT_IN_BACKGROUND is set (the default when this process runs no
+scheduler), in one ``background_compactor`` thread per process: POST
+/stock-movements wakes it, it waits STOCK_COMPACT_DELAY so a burst of sales
+becomes one UPDATE per medicine, and it also runs every
+STOCK_COMPACT_INTERVAL for movements appended by other processes. Requests
+never compact inline unless STOCK_COMPACT_ON_WRITE is set. ``quantity``
+therefore lags the ledger by a moment (or up to one job interval), and
+``live_balances`` adds the pending movements for an exact figure.
+Movements whose medicine no longer exists (deleted, or archived in between)
+cannot be applied; they are stamped compacted so they never block the
+queue, logged, and counted as orphaned in the summary.
+
+The ledger is the audit record for these quantity changes; compaction's
+Core UPDATE writes no audit_log entries (see audit.py).
+
+Quantity changes made through the ORM (creating a medicine, a PUT) and
+stock-take corrections are recorded in the ledger as already compacted, so
+the ledger stays complete. The nightly 'stock_balance_snapshots' job stores
+each medicine's closing balance for days it had movements. ``balances_as_of``
+starts from the latest snapshot and adds the movements after it.
+
+    python stock_ledger.py --compact
+    python stock_ledger.py --snapshot [--date 2026-10-18]
+    python stock_ledger.py --as-of 2026-10-01 --medicine-id 42
+"""
+
+import os
+import sys
+import logging
+import time
+import threading
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, inspect, bindparam
+from models import db, Medicine, StockMovement, StockBalanceSnapshot
+from audit import current_actor
+from reorder import record_usage, product_key
+from scheduler import register_job
+
+logger = logging.getLogger(__name__)
+
+RECEIPT, SALE, ADJUSTMENT, WRITE_OFF = 'receipt', 'sale', 'adjustment', 'write_off'
+# Sign applied to the (positive) quantity a client sends for each kind
+KIND_SIGNS = {RECEIPT: 1, SALE: -1, WRITE_OFF: -1, ADJUSTMENT: None}
+
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_COMPACT_DELAY = 1.0
+DEFAULT_COMPACT_INTERVAL = 30
+MAX_MOVEMENTS_PER_REQUEST = 1000
+
+
+# =============================================================================
+# APPENDING
+# =============================================================================
+
+def _parse_movement(data):
+    kind = data.get('kind')
+    if kind not in KIND_SIGNS:
+        raise ValueError(f'kind must be one of: {", ".join(KIND_SIGNS)}')
+    try:
+        medicine_id = int(data['medicine_id'])
+        quantity = int(data['quantity'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('medicine_id and quantity must be integers')
+    if KIND_SIGNS[kind] is None:
+        if quantity == 0:
+            raise ValueError('Adjustment quantity must not be zero')
+    else:
+        if quantity <= 0:
+            raise ValueError(f'{kind} quantity must be positive')
+        quantity *= KIND_SIGNS[kind]
+    return {
+        'medicine_id': medicine_id,
+        'kind': kind,
+        'quantity': quantity,
+        'reference': str(data.get('reference') or '')[:100]
+    }
+
+
+def record_movements(items, branch_id=None):
+    """Append movements without touching medicines; returns the new ids.
+
+    The caller commits. Raises ValueError for invalid input or medicines
+    outside the branch scope.
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError('movements must be a non-empty list')
+    if len(items) > MAX_MOVEMENTS_PER_REQUEST:
+        raise ValueError(f'At most {MAX_MOVEMENTS_PER_REQUEST} movements per request')
+    movements = [_parse_movement(item if isinstance(item, dict) else {}) for item in items]
+
+    query = db.session.query(Medicine.id, Medicine.branch_id).filter(
+        Medicine.id.in_({movement['medicine_id'] for movement in movements})
+    )
+    if branch_id is not None:
+        query = query.filter(Medicine.branch_id == branch_id)
+    branches = dict(query.all())
+    missing = sorted({m['medicine_id'] for m in movements if m['medicine_id'] not in branches})
+    if missing:
+        raise ValueError(f'Medicines not found: {", ".join(str(medicine_id) for medicine_id in missing)}')
+
+    now, actor = datetime.utcnow(), current_actor()
+    for movement in movements:
+        movement.update(branch_id=branches[movement['medicine_id']], actor=actor, created_at=now)
+    return db.session.execute(
+        db.insert(StockMovement).returning(StockMovement.id), movements
+    ).scalars().all()
+
+
+def movement_history(medicine_id, branch_id=None, limit=100):
+    """Newest movements of one medicine"""
+    query = StockMovement.query.filter(StockMovement.medicine_id == medicine_id)
+    if branch_id is not None:
+        query = query.filter(StockMovement.branch_id == branch_id)
+    return query.order_by(StockMovement.id.desc()).limit(limit).all()
+
+
+# =============================================================================
+# COMPACTION
+# =============================================================================
+
+def _claim_chunk_postgresql(chunk_size, now):
+    candidates = db.select(StockMovement.id).where(
+        StockMovement.compacted_at.is_(None)
+    ).order_by(StockMovement.id).limit(chunk_size).with_for_update(skip_locked=True)
+    return db.session.execute(
+        StockMovement.__table__.update().where(
+            StockMovement.id.in_(candidates)
+        ).values(compacted_at=now).returning(
+            StockMovement.medicine_id, StockMovement.kind, StockMovement.quantity, StockMovement.created_at
+        )
+    ).all()
+
+
+def _claim_chunk_generic(chunk_size, now):
+    rows = db.session.execute(
+        db.select(StockMovement.id, StockMovement.medicine_id, StockMovement.kind,
+                  StockMovement.quantity, StockMovement.created_at).where(
+            StockMovement.compacted_at.is_(None)
+        ).order_by(StockMovement.id).limit(chunk_size)
+    ).all()
+    if rows:
+        claimed = db.session.execute(StockMovement.__table__.update().where(
+            StockMovement.id.in_([row.id for row in rows]), StockMovement.compacted_at.is_(None)
+        ).values(compacted_at=now)).rowcount
+        if claimed != len(rows):
+            # Another compaction claimed some of them first, retry with a fresh read
+            db.session.rollback()
+            return _claim_chunk_generic(chunk_size, now)
+    return rows
+
+
+def _record_sales(sales):
+    """Add compacted sales to medicine_usage, ``sales`` is {(medicine_id, day): units}"""
+    products = {
+        row.id: (row.branch_id, product_key(row.name, row.dosage, row.form))
+        for row in db.session.query(Medicine.id, Medicine.branch_id, Medicine.name,
+                                    Medicine.dosage, Medicine.form).filter(
+            Medicine.id.in_({medicine_id for medicine_id, _ in sales})
+        )
+    }
+    usage = {}
+    for (medicine_id, day), units in sales.items():
+        if medicine_id in products:
+            branch_id, key = products[medicine_id]
+            usage[(branch_id, key, day)] = usage.get((branch_id, key, day), 0) + units
+    connection = db.session.connection()
+    for (branch_id, key, day), units in sorted(usage.items()):
+        record_usage(connection, branch_id, key, units, day)
+
+
+def compact_movements(chunk_size=None, max_chunks=None):
+    """Add pending movements to medicines.quantity, returns a summary"""
+    chunk_size = chunk_size or current_app.config.get('STOCK_COMPACTION_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    claim_chunk = _claim_chunk_postgresql if db.engine.dialect.name == 'postgresql' else _claim_chunk_generic
+    apply_deltas = Medicine.__table__.update().where(
+        Medicine.id == bindparam('medicine')
+    ).values(
+        quantity=Medicine.quantity + bindparam('delta'),
+        version=Medicine.version + 1,
+        updated_at=bindparam('now')
+    )
+
+    movements = medicines = chunks = orphaned = 0
+    while max_chunks is None or chunks < max_chunks:
+        now = datetime.utcnow()
+        rows = claim_chunk(chunk_size, now)
+        if not rows:
+            break
+        deltas, sales = {}, {}
+        for row in rows:
+            deltas[row.medicine_id] = deltas.get(row.medicine_id, 0) + row.quantity
+            if row.kind == SALE:
+                key = (row.medicine_id, row.created_at.date())
+                sales[key] = sales.get(key, 0) - row.quantity
+        existing = set(db.session.scalars(db.select(Medicine.id).where(Medicine.id.in_(deltas))))
+        missing = [row for row in rows if row.medicine_id not in existing]
+        if missing:
+            logger.warning('Stock movements for missing medicines %s left unapplied',
+                           sorted({row.medicine_id for row in missing}))
+            orphaned += len(missing)
+        params = [{'medicine': medicine_id, 'delta': delta, 'now': now}
+                  for medicine_id, delta in sorted(deltas.items()) if delta and medicine_id in existing]
+        if params:
+            # Ascending id order so concurrent compactions can't deadlock
+            db.session.execute(apply_deltas, params)
+        if sales:
+            _record_sales(sales)
+        db.session.commit()
+        if params:
+            # Core UPDATEs bypass the session events that keep typeahead quantities current
+            from suggest_index import suggest_index
+            suggest_index.stale = True
+        movements += len(rows) - len(missing)
+        medicines += len(params)
+        chunks += 1
+        if len(rows) < chunk_size:
+            break
+    summary = f'{movements} movements compacted in {chunks} chunks ({medicines} medicine updates)'
+    if orphaned:
+        summary += f', {orphaned} orphaned movements for missing medicines'
+    return summary
+
+
+register_job('stock_ledger_compaction', compact_movements, every=30)
+
+
+class BackgroundCompactor:
+    """Runs ``compact_movements`` off the request path, one thread per process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._app = None
+        self._pid = None
+        self._wake = threading.Event()
+        self.runs = 0
+
+    def wake(self):
+        """Ask for a compaction soon; starts the thread once per process (after any fork) and app"""
+        app = current_app._get_current_object()
+        if self._pid != os.getpid() or self._app is not app:
+            with self._lock:
+                if self._pid != os.getpid() or self._app is not app:
+                    self._app, self._pid = app, os.getpid()
+                    self._wake = threading.Event()
+                    self._thread = threading.Thread(
+                        target=self._run, args=(app, self._wake), name='stock-compactor', daemon=True
+                    )
+                    self._thread.start()
+        self._wake.set()
+
+    def _run(self, app, wake):
+        # A newer app (or a fork) starts its own thread, this one then exits
+        while self._app is app and self._pid == os.getpid():
+            if wake.wait(app.config.get('STOCK_COMPACT_INTERVAL', DEFAULT_COMPACT_INTERVAL)):
+                # Let the rest of a burst arrive so it is applied in one pass
+                time.sleep(app.config.get('STOCK_COMPACT_DELAY', DEFAULT_COMPACT_DELAY))
+            wake.clear()
+            if self._app is not app:
+                return
+            try:
+                with app.app_context():
+                    compact_movements()
+            except Exception:
+                logger.exception('Background stock compaction failed')
+            self.runs += 1
+
+
+background_compactor = BackgroundCompactor()
+
+
+# =============================================================================
+# BALANCES
+# =============================================================================
+
+def _pending_subquery():
+    return db.select(
+        StockMovement.medicine_id,
+        db.func.sum(StockMovement.quantity).label('pending')
+    ).where(StockMovement.compacted_at.is_(None)).group_by(StockMovement.medicine_id).subquery('pending')
+
+
+def live_balances(medicine_ids):
+    """``{id: (quantity, pending)}``; quantity plus pending is the balance now"""
+    pending = _pending_subquery()
+    rows = db.session.query(
+        Medicine.id, Medicine.quantity, db.func.coalesce(pending.c.pending, 0)
+    ).outerjoin(pending, pending.c.medicine_id == Medicine.id).filter(Medicine.id.in_(medicine_ids))
+    return {medicine_id: (quantity, int(pending)) for medicine_id, quantity, pending in rows}
+
+
+def balances_as_of(medicine_ids, at):
+    """``{id: balance}`` at the datetime ``at`` (UTC), None for unknown medicines"""
+    medicine_ids = list(medicine_ids)
+    live = live_balances(medicine_ids)
+    if at >= datetime.utcnow():
+        return {medicine_id: sum(live[medicine_id]) if medicine_id in live else None
+                for medicine_id in medicine_ids}
+
+    latest = db.select(
+        StockBalanceSnapshot.medicine_id,
+        db.func.max(StockBalanceSnapshot.snapshot_date).label('snapshot_date')
+    ).where(
+        StockBalanceSnapshot.medicine_id.in_(medicine_ids),
+        StockBalanceSnapshot.closing_at <= at
+    ).group_by(StockBalanceSnapshot.medicine_id).subquery('latest')
+    snapshot = db.select(
+        StockBalanceSnapshot.medicine_id, StockBalanceSnapshot.balance, StockBalanceSnapshot.closing_at
+    ).join(latest, (latest.c.medicine_id == StockBalanceSnapshot.medicine_id) &
+                   (latest.c.snapshot_date == StockBalanceSnapshot.snapshot_date)).subquery('snapshot')
+
+    # Forwards from the snapshot: balance + movements in [closing_at, at)
+    balances = {}
+    forward = db.session.query(
+        snapshot.c.medicine_id, snapshot.c.balance, db.func.coalesce(db.func.sum(StockMovement.quantity), 0)
+    ).outerjoin(StockMovement, (StockMovement.medicine_id == snapshot.c.medicine_id) &
+                               (StockMovement.created_at >= snapshot.c.closing_at) &
+                               (StockMovement.created_at < at)
+    ).group_by(snapshot.c.medicine_id, snapshot.c.balance)
+    for medicine_id, balance, moved in forward:
+        balances[medicine_id] = balance + int(moved)
+
+    # Backwards from now for the rest: live balance - movements since at
+    unsnapshotted = [medicine_id for medicine_id in live if medicine_id not in balances]
+    if unsnapshotted:
+        since = dict(db.session.query(
+            StockMovement.medicine_id, db.func.sum(StockMovement.quantity)
+        ).filter(
+            StockMovement.medicine_id.in_(unsnapshotted), StockMovement.created_at >= at
+        ).group_by(StockMovement.medicine_id).all())
+        for medicine_id in unsnapshotted:
+            balances[medicine_id] = sum(live[medicine_id]) - int(since.get(medicine_id) or 0)
+    return {medicine_id: balances.get(medicine_id) for medicine_id in medicine_ids}
+
+
+def snapshot_balances(day=None):
+    """Store closing balances for ``day`` (default yesterday, UTC), returns a summary"""
+    day = day or (datetime.utcnow().date() - timedelta(days=1))
+    opening = datetime.combine(day, datetime.min.time())
+    closing = opening + timedelta(days=1)
+
+    # Pending movements count towards today's balance, later ones are taken back out
+    corrections = db.select(
+        StockMovement.medicine_id,
+        db.func.sum(db.case((StockMovement.compacted_at.is_(None), StockMovement.quantity), else_=0)).label('pending'),
+        db.func.sum(db.case((StockMovement.created_at >= closing, StockMovement.quantity), else_=0)).label('after'),
+    ).group_by(StockMovement.medicine_id).subquery('corrections')
+    moved_that_day = db.select(StockMovement.medicine_id).where(
+        StockMovement.created_at >= opening, StockMovement.created_at < closing
+    )
+    has_snapshot = db.select(StockBalanceSnapshot.medicine_id).where(
+        StockBalanceSnapshot.snapshot_date < day
+    )
+
+    db.session.execute(StockBalanceSnapshot.__table__.delete().where(
+        StockBalanceSnapshot.snapshot_date == day
+    ))
+    source = db.select(
+        Medicine.id,
+        db.literal(day),
+        Medicine.branch_id,
+        Medicine.quantity + db.func.coalesce(corrections.c.pending, 0) - db.func.coalesce(corrections.c.after, 0),
+        db.literal(closing),
+        db.literal(datetime.utcnow())
+    ).outerjoin(corrections, corrections.c.medicine_id == Medicine.id).where(
+        Medicine.created_at < closing,
+        db.or_(Medicine.id.in_(moved_that_day), Medicine.id.notin_(has_snapshot))
+    )
+    result = db.session.execute(StockBalanceSnapshot.__table__.insert().from_select(
+        ['medicine_id', 'snapshot_date', 'branch_id', 'balance', 'closing_at', 'created_at'], source
+    ))
+    db.session.commit()
+    return f'{result.rowcount} balances snapshotted for {day.isoformat()}'
+
+
+def nightly_snapshot():
+    compact_movements()
+    return snapshot_balances()
+
+
+register_job('stock_balance_snapshots', nightly_snapshot, at='00:10')
+
+
+def parse_as_of(value):
+    """A date means its closing balance (midnight after it), a datetime is used as is"""
+    if not value:
+        return datetime.utcnow()
+    if len(value) == 10:
+        return datetime.combine(date.fromisoformat(value), datetime.min.time()) + timedelta(days=1)
+    return datetime.fromisoformat(value)
+
+
+# =============================================================================
+# LEDGER ENTRIES FOR DIRECT QUANTITY CHANGES
+# =============================================================================
+
+def _record_applied(connection, target, kind, quantity, reference):
+    now = datetime.utcnow()
+    connection.execute(StockMovement.__table__.insert().values(
+        medicine_id=target.id, branch_id=target.branch_id, kind=kind, quantity=quantity,
+        reference=reference, actor=current_actor(), created_at=now, compacted_at=now
+    ))
+
+
+@event.listens_for(Medicine, 'after_insert')
+def _ledger_on_insert(mapper, connection, target):
+    if target.quantity:
+        _record_applied(connection, target, RECEIPT, target.quantity, 'medicine created')
+
+
+@event.listens_for(Medicine, 'after_update')
+def _ledger_on_update(mapper, connection, target):
+    history = inspect(target).attrs.quantity.history
+    if not history.deleted or not history.added:
+        return
+    old, new = history.deleted[0], history.added[0]
+    if old is not None and new is not None and new != old:
+        _record_applied(connection, target, ADJUSTMENT, new - old, 'medicine updated')
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Add the current directory to Python path
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+    from app import app
+
+    parser = argparse.ArgumentParser(description="Stock movement ledger maintenance")
+    parser.add_argument("--compact", action="store_true", help="Apply pending movements to medicines")
+    parser.add_argument("--chunk-size", type=int, help="Movements compacted per transaction")
+    parser.add_argument("--snapshot", action="store_true", help="Store closing balances for a day")
+    parser.add_argument("--date", help="Day to snapshot (YYYY-MM-DD, default yesterday)")
+    parser.add_argument("--as-of", help="Print a medicine's balance at a date or datetime")
+    parser.add_argument("--medicine-id", type=int, help="Medicine for --as-of")
+
+    args = parser.parse_args()
+
+    with app.app_context():
+        try:
+            if args.compact:
+                print(f"✅ {compact_movements(args.chunk_size)}")
+            elif args.snapshot:
+                print(f"✅ {snapshot_balances(date.fromisoformat(args.date) if args.date else None)}")
+            elif args.as_of and args.medicine_id:
+                at = parse_as_of(args.as_of)
+                balance = balances_as_of([args.medicine_id], at)[args.medicine_id]
+                if balance is None:
+                    print(f"❌ Medicine {args.medicine_id} not found")
+                else:
+                    print(f"📦 Medicine {args.medicine_id}: {balance} units at {at.isoformat()}")
+            else:
+                parser.print_help()
+        except Exception as e:
+            print(f"❌ Error: {str(e)}")
+            db.session.rollback()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Stock-take reconciliation from a counted-quantity CSV.
+
+The upload (``batch_number,counted_quantity`` with an optional header row) is
+streamed into a temporary staging table in batches. Lines for the same
+batch are summed, so one batch can be counted on several shelves. A single
+join against the branch's medicines then gives each batch's variance in
+units and its value at cost and selling price. Batch numbers that match no
+medicine are reported as unknown. Numbers that match several medicines are
+reported as ambiguous and are never applied.
+
+Pending stock ledger movements are compacted first so variances are
+measured against the live balance. With ``apply`` every non-ambiguous
+variance is recorded in the ledger as an adjustment and corrected by one
+UPDATE ... FROM the staged counts, bumping each row's version.
+
+Usage: python stock_take.py counts.csv [--branch-id 1] [--apply]
+"""
+
+import io
+import os
+import sys
+import csv
+from datetime import datetime
+from sqlalchemy import Table, Column, MetaData, String, Integer, case
+from models import db, Medicine, StockMovement, DEFAULT_BRANCH_ID
+from stock_ledger import compact_movements, ADJUSTMENT
+from audit import current_actor
+
+INSERT_BATCH_SIZE = 5000
+MAX_ERRORS = 100
+MAX_REPORT_LINES = 1000
+
+_staging_metadata = MetaData()
+staging = Table(
+    'stock_take_staging', _staging_metadata,
+    Column('batch_number', String(50), nullable=False),
+    Column('counted_quantity', Integer, nullable=False),
+    prefixes=['TEMPORARY'],
+    postgresql_on_commit='DROP'
+)
+
+
+def _stage(stream):
+    """Load CSV lines into the staging table, returns (lines staged, errors)"""
+    connection = db.session.connection()
+    staging.drop(connection, checkfirst=True)
+    staging.create(connection)
+
+    staged, errors, batch = 0, [], []
+    for line_number, row in enumerate(csv.reader(stream), start=1):
+        if not row or not ''.join(row).strip():
+            continue
+        batch_number = row[0].strip()
+        try:
+            counted = int((row[1] if len(row) > 1 else '').strip())
+            if counted < 0 or not batch_number:
+                raise ValueError
+        except ValueError:
+            if line_number > 1 and len(errors) < MAX_ERRORS:
+                errors.append({'line': line_number, 'row': row[:2]})
+            # The first line may be a header
+            continue
+        batch.append({'batch_number': batch_number[:50], 'counted_quantity': counted})
+        if len(batch) >= INSERT_BATCH_SIZE:
+            db.session.execute(staging.insert(), batch)
+            staged += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(staging.insert(), batch)
+        staged += len(batch)
+    return staged, errors
+
+
+def _counted():
+    """Staged counts summed per batch number"""
+    return db.select(
+        staging.c.batch_number,
+        db.func.sum(staging.c.counted_quantity).label('counted')
+    ).group_by(staging.c.batch_number).subquery('counted')
+
+
+def _ambiguous_batches(branch_id):
+    return db.select(Medicine.batch_number).where(
+        Medicine.branch_id == branch_id
+    ).group_by(Medicine.batch_number).having(db.func.count(Medicine.id) > 1)
+
+
+def reconcile(stream, branch_id=None, apply=False):
+    """Stage an uploaded count, report variances and optionally apply them"""
+    branch_id = branch_id or DEFAULT_BRANCH_ID
+    compact_movements()
+    try:
+        staged, errors = _stage(stream)
+        counted = _counted()
+
+        variance = counted.c.counted - Medicine.quantity
+        rows = db.session.execute(
+            db.select(
+                counted.c.batch_number,
+                counted.c.counted,
+                Medicine.id,
+                Medicine.name,
+                Medicine.quantity,
+                variance.label('variance'),
+                (variance * db.func.coalesce(Medicine.cost_price, 0)).label('cost_value'),
+                (variance * Medicine.selling_price).label('selling_value'),
+                db.func.count(Medicine.id).over(partition_by=counted.c.batch_number).label('matches')
+            ).select_from(counted).outerjoin(
+                Medicine,
+                (Medicine.batch_number == counted.c.batch_number) & (Medicine.branch_id == branch_id)
+            ).order_by(db.func.abs(db.func.coalesce(variance, 0)).desc(), counted.c.batch_number)
+        ).all()
+
+        report = {
+            'branch_id': branch_id,
+            'lines_staged': staged,
+            'batches_counted': 0,
+            'batches_matched': 0,
+            'batches_with_variance': 0,
+            'variance_units': 0,
+            'variance_cost_value': 0.0,
+            'variance_selling_value': 0.0,
+            'unknown_batches': [],
+            'ambiguous_batches': [],
+            'variances': [],
+            'errors': errors,
+            'applied': 0
+        }
+        seen = set()
+        for row in rows:
+            if row.batch_number not in seen:
+                seen.add(row.batch_number)
+                report['batches_counted'] += 1
+            if row.id is None:
+                report['unknown_batches'].append(row.batch_number)
+                continue
+            if row.matches > 1:
+                if row.batch_number not in report['ambiguous_batches']:
+                    report['ambiguous_batches'].append(row.batch_number)
+                continue
+            report['batches_matched'] += 1
+            if row.variance == 0:
+                continue
+            report['batches_with_variance'] += 1
+            report['variance_units'] += int(row.variance)
+            report['variance_cost_value'] += float(row.cost_value or 0)
+            report['variance_selling_value'] += float(row.selling_value or 0)
+            if len(report['variances']) < MAX_REPORT_LINES:
+                report['variances'].append({
+                    'medicine_id': row.id,
+                    'batch_number': row.batch_number,
+                    'name': row.name,
+                    'system_quantity': row.quantity,
+                    'counted_quantity': int(row.counted),
+                    'variance': int(row.variance),
+                    'cost_value': round(float(row.cost_value or 0), 2),
+                    'selling_value': round(float(row.selling_value or 0), 2)
+                })
+        report['variance_cost_value'] = round(report['variance_cost_value'], 2)
+        report['variance_selling_value'] = round(report['variance_selling_value'], 2)
+        report['not_counted'] = db.session.query(db.func.count(Medicine.id)).filter(
+            Medicine.branch_id == branch_id,
+            Medicine.quantity > 0,
+            Medicine.batch_number.notin_(db.select(staging.c.batch_number))
+        ).scalar()
+
+        if apply:
+            now = datetime.utcnow()
+            corrected = (
+                (Medicine.batch_number == counted.c.batch_number) &
+                (Medicine.branch_id == branch_id) &
+                (Medicine.quantity != counted.c.counted) &
+                Medicine.batch_number.notin_(_ambiguous_batches(branch_id))
+            )
+            # Record the corrections in the stock ledger as already applied
+            db.session.execute(StockMovement.__table__.insert().from_select(
+                ['medicine_id', 'branch_id', 'kind', 'quantity', 'reference', 'actor',
+                 'created_at', 'compacted_at'],
+                db.select(
+                    Medicine.id, Medicine.branch_id, db.literal(ADJUSTMENT),
+                    counted.c.counted - Medicine.quantity, db.literal('stock take'),
+                    db.literal(current_actor()), db.literal(now), db.literal(now)
+                ).select_from(Medicine).join(counted, corrected)
+            ))
+            result = db.session.execute(
+                db.update(Medicine).where(corrected).values(
+                    quantity=counted.c.counted,
+                    version=Medicine.version + 1,
+                    updated_at=now
+                ).execution_options(synchronize_session=False)
+            )
+            report['applied'] = result.rowcount
+            db.session.commit()
+            # The bulk UPDATE bypasses the session events that maintain the typeahead index
+            from suggest_index import suggest_index
+            suggest_index.stale = True
+        else:
+            db.session.rollback()
+        return report
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        # PostgreSQL drops the table at commit/rollback (ON COMMIT DROP)
+        if db.engine.dialect.name != 'postgresql':
+            staging.drop(db.session.connection(), checkfirst=True)
+            db.session.commit()
+
+
+def upload_stream(file_storage):
+    """Text stream over an uploaded file without reading it into memory"""
+    return io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline='')
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Add the current directory to Python path
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+    from app import app
+
+    parser = argparse.ArgumentParser(description="Reconcile a stock-take CSV against medicines")
+    parser.add_argument("csv_file", help="CSV of batch_number,counted_quantity")
+    parser.add_argument("--branch-id", type=int, help="Branch that was counted (default: main branch)")
+    parser.add_argument("--apply", action="store_true", help="Correct quantities to the counted values")
+
+    args = parser.parse_args()
+
+    with app.app_context():
+        try:
+            with open(args.csv_file, newline='', encoding='utf-8-sig') as f:
+                report = reconcile(f, args.branch_id, args.apply)
+            print(f"📋 {report['batches_counted']} batches counted, {report['batches_matched']} matched, "
+                  f"{report['batches_with_variance']} with variance")
+            print(f"   Variance: {report['variance_units']} units, "
+                  f"{report['variance_cost_value']:.2f} at cost, {report['variance_selling_value']:.2f} at selling price")
+            if report['unknown_batches']:
+                print(f"⚠️  {len(report['unknown_batches'])} unknown batch numbers")
+            if report['ambiguous_batches']:
+                print(f"⚠️  {len(report['ambiguous_batches'])} ambiguous batch numbers not applied")
+            if args.apply:
+                print(f"✅ {report['applied']} quantities corrected")
+        except Exception as e:
+            print(f"❌ Error reconciling stock take: {str(e)}")
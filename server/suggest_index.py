@@ -0,0 +1,315 @@
+"""
+In-memory prefix index for point-of-sale typeahead.
+
+``/medicines?search=`` runs unindexed ILIKE patterns plus a COUNT and
+returns full medicine objects, which is far too heavy per keystroke. This
+index keeps sorted (term, medicine_id) arrays per branch and term kind and
+answers a prefix with a bisect followed by a short forward scan, so a lookup
+never touches the database and a branch-scoped lookup never walks other
+branches' matches.
+
+Matches are ranked by kind: the full name first, then individual words of
+the name, then batch numbers, then manufacturer names. Within a kind, terms
+are returned alphabetically.
+
+The index is built at startup. Committed sessions patch the medicines they
+inserted, updated or deleted. A manufacturer write marks the whole index
+stale. Each process that searches starts one background refresher thread.
+Every SUGGEST_REFRESH_TTL seconds it compares a cheap signature of the
+medicines and manufacturers tables, which catches writes made by other
+worker processes. It rebuilds when the signature changed or the index was
+marked stale, and a search that finds the index stale wakes it at once.
+Searches never query the database and keep using the previous arrays until
+the rebuild swaps them.
+"""
+
+import heapq
+import logging
+import os
+import re
+import threading
+from bisect import bisect_left, insort
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, Medicine, Manufacturer
+from reference_cache import reference_cache
+
+logger = logging.getLogger(__name__)
+
+NAME, NAME_WORD, BATCH, MANUFACTURER = range(4)
+KINDS = (NAME, NAME_WORD, BATCH, MANUFACTURER)
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+DEFAULT_REFRESH_TTL = 30
+
+_WORD = re.compile(r'[^\W_]+')
+
+
+def normalise(text):
+    return ' '.join((text or '').lower().split())
+
+
+def _terms(name, batch_number, manufacturer):
+    """(kind, term) pairs a medicine is reachable by"""
+    terms = set()
+    full_name = normalise(name)
+    if full_name:
+        terms.add((NAME, full_name))
+        for word in _WORD.findall(full_name)[1:]:
+            terms.add((NAME_WORD, word))
+    if batch_number:
+        terms.add((BATCH, normalise(batch_number)))
+    if manufacturer:
+        terms.add((MANUFACTURER, normalise(manufacturer)))
+    return terms
+
+
+def _matches(kind_keys, prefix):
+    """(term, id) pairs of one sorted array that start with ``prefix``"""
+    position = bisect_left(kind_keys, (prefix,))
+    while position < len(kind_keys) and kind_keys[position][0].startswith(prefix):
+        yield kind_keys[position]
+        position += 1
+
+
+def _read_signature():
+    """Changes whenever another process inserts, updates or deletes medicines or manufacturers"""
+    with db.engine.connect() as connection:
+        medicines = connection.execute(db.select(
+            db.func.count(Medicine.id), db.func.max(Medicine.id), db.func.max(Medicine.updated_at)
+        )).one()
+        manufacturers = connection.execute(
+            db.select(Manufacturer.id, Manufacturer.name).order_by(Manufacturer.id)
+        ).all()
+    return tuple(medicines), hash(tuple(map(tuple, manufacturers)))
+
+
+class PrefixIndex:
+    """Sorted (term, id) arrays per branch and kind plus the fields a suggestion returns"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._keys = {}
+        self._records = {}
+        self._terms = {}
+        # Changes committed while a build runs, replayed onto its result
+        self._pending = None
+        self._signature = None
+        # Refresher thread of this process and the app it serves
+        self._refresher = None
+        self._refresher_app = None
+        self._refresher_pid = None
+        self._wake = threading.Event()
+        self.builds = 0
+        self.built = False
+        self.stale = True
+
+    @staticmethod
+    def entry(medicine, manufacturer):
+        """(record, terms) for one medicine, as passed to ``apply``"""
+        return {
+            'id': medicine.id,
+            'name': medicine.name,
+            'dosage': medicine.dosage or '',
+            'form': medicine.form or '',
+            'quantity': medicine.quantity,
+            'branch_id': medicine.branch_id
+        }, _terms(medicine.name, medicine.batch_number, manufacturer)
+
+    def _branch_keys(self, branch_id):
+        return self._keys.setdefault(branch_id, {kind: [] for kind in KINDS})
+
+    def build(self):
+        """Rebuild from the database, requires an application context"""
+        with self._build_lock:
+            with self._lock:
+                # A write marking the index stale from here on forces another build
+                self.stale = False
+                self._pending = {}
+            try:
+                signature = _read_signature()
+                rows = db.session.query(
+                    Medicine.id, Medicine.name, Medicine.dosage, Medicine.form,
+                    Medicine.quantity, Medicine.branch_id, Medicine.batch_number,
+                    db.func.coalesce(Manufacturer.name, Medicine.manufacturer)
+                ).outerjoin(Manufacturer, Manufacturer.id == Medicine.manufacturer_id).all()
+            except Exception:
+                with self._lock:
+                    self.stale = True
+                    self._pending = None
+                raise
+
+            keys = {}
+            records, terms = {}, {}
+            for medicine_id, name, dosage, form, quantity, branch_id, batch_number, manufacturer in rows:
+                records[medicine_id] = {
+                    'id': medicine_id,
+                    'name': name,
+                    'dosage': dosage or '',
+                    'form': form or '',
+                    'quantity': quantity,
+                    'branch_id': branch_id
+                }
+                terms[medicine_id] = _terms(name, batch_number, manufacturer)
+                branch_keys = keys.setdefault(branch_id, {kind: [] for kind in KINDS})
+                for kind, term in terms[medicine_id]:
+                    branch_keys[kind].append((term, medicine_id))
+            for branch_keys in keys.values():
+                for kind_keys in branch_keys.values():
+                    kind_keys.sort()
+
+            with self._lock:
+                self._keys, self._records, self._terms = keys, records, terms
+                pending, self._pending = self._pending, None
+                self._apply(pending)
+                self._signature = signature
+                self.builds += 1
+                self.built = True
+            return len(records)
+
+    def refresh(self):
+        """Rebuild if marked stale or another process changed the tables; returns True if rebuilt"""
+        if self.stale or _read_signature() != self._signature:
+            self.build()
+            return True
+        return False
+
+    def _ensure_refresher(self):
+        """Start the refresher thread once per process (after any fork) and app"""
+        app = current_app._get_current_object()
+        if self._refresher_pid == os.getpid() and self._refresher_app is app:
+            return
+        with self._lock:
+            if self._refresher_pid == os.getpid() and self._refresher_app is app:
+                return
+            self._refresher_app, self._refresher_pid = app, os.getpid()
+            self._wake = threading.Event()
+            self._refresher = threading.Thread(
+                target=self._refresh_loop, args=(app, self._wake), name='suggest-index-refresh', daemon=True
+            )
+            self._refresher.start()
+
+    def _refresh_loop(self, app, wake):
+        # A newer app (or a fork) starts its own thread, this one then exits
+        while self._refresher_app is app and self._refresher_pid == os.getpid():
+            wake.wait(app.config.get('SUGGEST_REFRESH_TTL', DEFAULT_REFRESH_TTL))
+            wake.clear()
+            if self._refresher_app is not app:
+                return
+            try:
+                with app.app_context():
+                    self.refresh()
+            except Exception:
+                logger.exception('Suggest index refresh failed')
+
+    def _remove(self, medicine_id):
+        record = self._records.pop(medicine_id, None)
+        if record is None:
+            return
+        branch_keys = self._keys.get(record['branch_id'], {})
+        for kind, term in self._terms.pop(medicine_id, ()):
+            kind_keys = branch_keys.get(kind, [])
+            position = bisect_left(kind_keys, (term, medicine_id))
+            if position < len(kind_keys) and kind_keys[position] == (term, medicine_id):
+                del kind_keys[position]
+
+    def _apply(self, changes):
+        for medicine_id, change in changes.items():
+            if change is None:
+                self._remove(medicine_id)
+                continue
+            record, terms = change
+            current = self._records.get(medicine_id)
+            if (self._terms.get(medicine_id) == terms and current is not None
+                    and current['branch_id'] == record['branch_id']):
+                self._records[medicine_id] = record
+                continue
+            self._remove(medicine_id)
+            self._records[medicine_id] = record
+            self._terms[medicine_id] = terms
+            branch_keys = self._branch_keys(record['branch_id'])
+            for kind, term in terms:
+                insort(branch_keys[kind], (term, medicine_id))
+
+    def apply(self, changes):
+        """Apply ``{id: (record, terms) or None}`` captured from a committed session"""
+        with self._lock:
+            self._apply(changes)
+            if self._pending is not None:
+                self._pending.update(changes)
+
+    def search(self, prefix, limit=DEFAULT_LIMIT, branch_id=None):
+        """Top ``limit`` suggestions for ``prefix``, best kind first"""
+        prefix = normalise(prefix)
+        if not prefix:
+            return []
+        if not self.built:
+            self.build()
+        self._ensure_refresher()
+        if self.stale:
+            # Keep answering from the current arrays until the refresher swaps them
+            self._wake.set()
+
+        results, seen = [], set()
+        with self._lock:
+            if branch_id is None:
+                branches = list(self._keys.values())
+            else:
+                branches = [self._keys[branch_id]] if branch_id in self._keys else []
+            for kind in KINDS:
+                for _, medicine_id in heapq.merge(*(_matches(keys[kind], prefix) for keys in branches)):
+                    if len(results) >= limit:
+                        break
+                    if medicine_id in seen:
+                        continue
+                    seen.add(medicine_id)
+                    record = self._records[medicine_id]
+                    results.append({field: value for field, value in record.items() if field != 'branch_id'})
+                if len(results) >= limit:
+                    break
+        return results
+
+    def __len__(self):
+        return len(self._records)
+
+
+suggest_index = PrefixIndex()
+
+
+# =============================================================================
+# INCREMENTAL MAINTENANCE ON WRITES
+# =============================================================================
+
+@event.listens_for(Session, 'after_flush')
+def _capture_changes(session, flush_context):
+    for obj in session.deleted:
+        if isinstance(obj, Medicine):
+            session.info.setdefault('suggest_changes', {})[obj.id] = None
+        elif isinstance(obj, Manufacturer):
+            session.info['suggest_rebuild'] = True
+    for obj in session.dirty:
+        if isinstance(obj, Manufacturer):
+            # A rename changes the terms of every medicine it makes
+            session.info['suggest_rebuild'] = True
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Medicine):
+            manufacturer = reference_cache.manufacturer_name(obj.manufacturer_id) or obj.manufacturer
+            session.info.setdefault('suggest_changes', {})[obj.id] = PrefixIndex.entry(obj, manufacturer)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_after_commit(session):
+    changes = session.info.pop('suggest_changes', None)
+    if session.info.pop('suggest_rebuild', False):
+        suggest_index.stale = True
+    elif changes and not suggest_index.stale:
+        suggest_index.apply(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('suggest_changes', None)
+    session.info.pop('suggest_rebuild', None)
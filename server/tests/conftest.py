@@ -0,0 +1,67 @@
+"""
+Shared fixtures: a fresh app and SQLite database per test.
+
+app.py is a process-wide singleton bound to PostgreSQL, so tests build their
+own app around the same blueprint and models.
+"""
+
+import os
+import sys
+from datetime import date, timedelta
+
+import pytest
+from flask import Flask
+
+# Make the server modules importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import expiry_snapshot  # noqa: E402
+from models import db, Branch, Medicine, MedicineCategory, Manufacturer  # noqa: E402
+from routes import api_bp  # noqa: E402
+from reference_cache import reference_cache  # noqa: E402
+from suggest_index import suggest_index  # noqa: E402
+from stock_ledger import background_compactor  # noqa: E402
+
+# Expiry offsets (days from today) of the seeded batches Med0..Med3
+SEED_EXPIRY_OFFSETS = (-5, 10, 200, 400)
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(
+        TESTING=True,
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'test.db'}",
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # The audit writer is process-wide and would outlive this database
+        AUDIT_ENABLED=False,
+        PARALLEL_QUERIES_ENABLED=False,
+    )
+    db.init_app(app)
+    app.register_blueprint(api_bp, url_prefix='/api')
+
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([Branch(id=1, code='MAIN', name='Main'), Branch(id=2, code='B2', name='Second')])
+        category, manufacturer = MedicineCategory(name='Tablets'), Manufacturer(name='Cipla')
+        db.session.add_all([category, manufacturer])
+        db.session.commit()
+        for i, offset in enumerate(SEED_EXPIRY_OFFSETS):
+            db.session.add(Medicine(
+                name=f'Med{i}', batch_number=f'B{i}', selling_price=10 + i, cost_price=5,
+                quantity=5 if i % 2 else 50, minimum_stock=10,
+                manufacturer_id=manufacturer.id, category_id=category.id,
+                expiry_date=date.today() + timedelta(days=offset), branch_id=1 if i < 3 else 2
+            ))
+        db.session.commit()
+
+        # Process-wide caches from a previous test point at another database
+        expiry_snapshot._current_for = None
+        # Retire the previous test's background threads before they touch its database
+        suggest_index._refresher_app = None
+        background_compactor._app = None
+        reference_cache.load()
+        suggest_index.build()
+
+        yield app
+        db.session.remove()
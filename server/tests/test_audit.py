@@ -0,0 +1,99 @@
+import json
+import time
+import threading
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+
+from audit import AuditWriter, replay_spill
+from models import db, AuditLog
+
+
+def _entries(count, start=0):
+    return [{'medicine_id': start + i, 'branch_id': 1, 'action': 'update', 'changes': {'quantity': [i + 1, i]},
+             'actor': 'tester', 'request_path': '/api/medicines', 'changed_at': datetime.utcnow()}
+            for i in range(count)]
+
+
+@pytest.fixture
+def writer(app, tmp_path):
+    app.config.update(AUDIT_SPILL_PATH=str(tmp_path / 'spill.jsonl'), AUDIT_FLUSH_INTERVAL=0.01)
+    writer = AuditWriter()
+    yield writer
+    writer.stop()
+
+
+def _blocked(writer, monkeypatch):
+    """Make the writer hold its next batch until the returned event is set"""
+    release, write = threading.Event(), writer.write
+
+    def held(batch):
+        release.wait(5)
+        write(batch)
+    monkeypatch.setattr(writer, 'write', held)
+    return release
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def _spilled(writer):
+    with open(writer.spill_path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_queued_entries_are_written_in_batches(app, writer):
+    app.config['AUDIT_BATCH_SIZE'] = 10
+    writer.enqueue(_entries(25), db.engine)
+    assert writer.drain(5)
+
+    assert AuditLog.query.count() == 25
+    assert writer.counts['written'] == 25 and writer.counts['batches'] >= 3
+    assert writer.stats()['queued'] == 0
+
+
+def test_full_queue_spills_the_overflow(app, writer, monkeypatch):
+    app.config.update(AUDIT_QUEUE_SIZE=1, AUDIT_BATCH_SIZE=1)
+    release = _blocked(writer, monkeypatch)
+    writer.enqueue(_entries(1), db.engine)
+    # Wait for the thread to take the first entry and hold it
+    _wait_for(lambda: writer._queue.qsize() == 0)
+
+    writer.enqueue(_entries(3, start=1), db.engine)
+    assert writer.counts['spilled'] == 2
+    assert [entry['medicine_id'] for entry in _spilled(writer)] == [2, 3]
+
+    release.set()
+    assert writer.drain(5)
+    assert sorted(row.medicine_id for row in AuditLog.query) == [0, 1]
+
+
+def test_failed_batch_is_spilled_and_replayed(app, writer, tmp_path):
+    # A database without the audit_log table refuses the insert
+    writer.enqueue(_entries(4), create_engine(f"sqlite:///{tmp_path / 'empty.db'}"))
+    assert writer.drain(5)
+    assert writer.counts['failed_batches'] == 1 and writer.counts['spilled'] == 4
+    assert AuditLog.query.count() == 0
+
+    assert replay_spill() == '4 spilled audit entries replayed'
+    entries = AuditLog.query.order_by(AuditLog.medicine_id).all()
+    assert [entry.medicine_id for entry in entries] == [0, 1, 2, 3]
+    assert entries[0].actor == 'tester' and isinstance(entries[0].changed_at, datetime)
+    # The claimed file is gone, a second replay finds nothing
+    assert replay_spill() == '0 spilled audit entries replayed'
+
+
+def test_stop_spills_what_the_thread_cannot_write(app, writer, monkeypatch):
+    app.config['AUDIT_BATCH_SIZE'] = 1
+    release = _blocked(writer, monkeypatch)
+    writer.enqueue(_entries(3), db.engine)
+    _wait_for(lambda: writer._queue.qsize() == 2)
+
+    writer.stop(timeout=0.05)
+    assert [entry['medicine_id'] for entry in _spilled(writer)] == [1, 2]
+    release.set()
@@ -0,0 +1,38 @@
+from models import db, Medicine
+
+
+def _med0(client):
+    medicine_id = Medicine.query.filter_by(name='Med0').one().id
+    return medicine_id, client.get(f'/api/medicines/{medicine_id}')
+
+
+def test_get_carries_etag_and_put_bumps_it(client):
+    medicine_id, response = _med0(client)
+    etag = response.headers['ETag']
+
+    updated = client.put(f'/api/medicines/{medicine_id}', json={'quantity': 7},
+                         headers={'If-Match': etag})
+    assert updated.status_code == 200
+    assert updated.headers['ETag'] != etag
+    assert _med0(client)[1].headers['ETag'] == updated.headers['ETag']
+
+
+def test_stale_if_match_gets_412_with_current_representation(client):
+    medicine_id, response = _med0(client)
+    stale = response.headers['ETag']
+    client.put(f'/api/medicines/{medicine_id}', json={'quantity': 7}, headers={'If-Match': stale})
+
+    conflict = client.put(f'/api/medicines/{medicine_id}', json={'quantity': 9},
+                          headers={'If-Match': stale})
+    assert conflict.status_code == 412
+    assert conflict.json['medicine']['quantity'] == 7
+    assert conflict.headers['ETag'] != stale
+    assert db.session.get(Medicine, medicine_id).quantity == 7
+
+
+def test_if_match_is_optional_unless_required(app, client):
+    medicine_id, _ = _med0(client)
+    assert client.put(f'/api/medicines/{medicine_id}', json={'quantity': 8}).status_code == 200
+
+    app.config['REQUIRE_IF_MATCH'] = True
+    assert client.put(f'/api/medicines/{medicine_id}', json={'quantity': 9}).status_code == 428
@@ -0,0 +1,108 @@
+from datetime import date, timedelta
+
+import pytest
+
+from expiry_calendar import expiry_histogram, MAX_HORIZON_DAYS
+from models import db, Medicine, Manufacturer
+from reference_cache import reference_cache
+from valuation import period_start, DAY, WEEK, MONTH
+
+
+def _nonzero(result):
+    return {b['bucket_start']: b for b in result['buckets'] if b['batches']}
+
+
+@pytest.mark.parametrize('bucket', [DAY, WEEK, MONTH])
+def test_batches_land_in_their_bucket(app, bucket):
+    today = date.today()
+    result = expiry_histogram(bucket=bucket)
+    # Med0 has expired and Med3 is past the default horizon
+    assert {start: b['batches'] for start, b in _nonzero(result).items()} == {
+        period_start(today + timedelta(days=10), bucket).isoformat(): 1,
+        period_start(today + timedelta(days=200), bucket).isoformat(): 1,
+    }
+    med2 = _nonzero(result)[period_start(today + timedelta(days=200), bucket).isoformat()]
+    assert med2['quantity'] == 50
+    assert med2['selling_value'] == 600.0 and med2['cost_value'] == 250.0
+
+
+@pytest.mark.parametrize('bucket, step', [(DAY, 1), (WEEK, 7)])
+def test_buckets_are_contiguous_and_zero_filled(app, bucket, step):
+    result = expiry_histogram(bucket=bucket, horizon_days=60)
+    starts = [date.fromisoformat(b['bucket_start']) for b in result['buckets']]
+    assert starts[0] == period_start(date.today(), bucket)
+    assert all((later - earlier).days == step for earlier, later in zip(starts, starts[1:]))
+    assert starts[-1] <= date.fromisoformat(result['to']) < starts[-1] + timedelta(days=step)
+    assert sum(b['batches'] for b in result['buckets']) == 1
+
+
+def test_month_buckets_start_on_the_first(app):
+    result = expiry_histogram(bucket=MONTH, horizon_days=MAX_HORIZON_DAYS)
+    assert all(b['bucket_start'].endswith('-01') for b in result['buckets'])
+    assert sum(b['batches'] for b in result['buckets']) == 3
+
+
+def test_horizon_bounds_the_range(app):
+    assert sum(b['batches'] for b in expiry_histogram(horizon_days=10)['buckets']) == 1
+    assert sum(b['batches'] for b in expiry_histogram(horizon_days=9)['buckets']) == 0
+    assert sum(b['batches'] for b in expiry_histogram(horizon_days=400)['buckets']) == 3
+
+
+def test_empty_stock_is_left_out(app):
+    Medicine.query.filter_by(name='Med2').one().quantity = 0
+    db.session.commit()
+    assert sum(b['batches'] for b in expiry_histogram()['buckets']) == 1
+
+
+def test_branch_scope(app):
+    result = expiry_histogram(horizon_days=400, branch_id=2)
+    assert [b['quantity'] for b in result['buckets'] if b['batches']] == [5]
+
+
+def test_split_by_manufacturer(app):
+    db.session.add(Manufacturer(id=2, name='Sun'))
+    Medicine.query.filter_by(name='Med2').one().manufacturer_id = 2
+    db.session.add(Medicine(name='Med2', batch_number='B2b', selling_price=12, cost_price=5, quantity=10,
+                            minimum_stock=10, manufacturer_id=1, category_id=1, branch_id=1,
+                            expiry_date=date.today() + timedelta(days=200)))
+    db.session.commit()
+    reference_cache.load()
+
+    result = expiry_histogram(split_by='manufacturer')
+    bucket = _nonzero(result)[period_start(date.today() + timedelta(days=200), MONTH).isoformat()]
+    assert bucket['batches'] == 2 and bucket['quantity'] == 60
+    assert [(s['manufacturer'], s['manufacturer_id'], s['quantity']) for s in bucket['by_manufacturer']] == [
+        ('Sun', 2, 50), ('Cipla', 1, 10)]
+
+
+def test_split_by_category(app):
+    result = expiry_histogram(split_by='category')
+    for bucket in result['buckets']:
+        assert sum(s['batches'] for s in bucket['by_category']) == bucket['batches']
+        assert all(s['category'] == 'Tablets' for s in bucket['by_category'])
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'bucket': 'year'},
+    {'split_by': 'branch'},
+    {'horizon_days': 0},
+    {'horizon_days': MAX_HORIZON_DAYS + 1},
+])
+def test_invalid_arguments(app, kwargs):
+    with pytest.raises(ValueError):
+        expiry_histogram(**kwargs)
+
+
+def test_route(client):
+    response = client.get('/api/medicines/reports/expiry-calendar?bucket=week&horizon_days=30')
+    assert response.status_code == 200
+    assert response.json['bucket'] == 'week'
+    assert sum(b['batches'] for b in response.json['buckets']) == 1
+
+    response = client.get('/api/medicines/reports/expiry-calendar?bucket=year')
+    assert response.status_code == 400 and 'bucket' in response.json['error']
+
+
+def test_in_stock_expiry_index_is_created(app):
+    indexes = {index['name'] for index in db.inspect(db.engine).get_indexes('medicines')}
+    assert {'ix_medicines_branch_expiry', 'ix_medicines_expiry_in_stock'} <= indexes
@@ -0,0 +1,74 @@
+import random
+from datetime import date, timedelta
+from fractions import Fraction
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from expiry_forecast import _fefo_sold, _units_demanded, forecast_expiry_risk  # noqa: E402
+from models import db, Medicine, MedicineUsage  # noqa: E402
+from reorder import product_key  # noqa: E402
+
+
+def _fefo_loop(batches):
+    """Plain FEFO: ``batches`` of (product, days, quantity, used, window), sold per batch"""
+    sold, sold_so_far = [], {}
+    for product, days, quantity, used, window in batches:
+        demanded = Fraction(used, window) * days // 1
+        units = max(0, min(quantity, demanded - sold_so_far.get(product, 0)))
+        sold_so_far[product] = sold_so_far.get(product, 0) + units
+        sold.append(units)
+    return sold
+
+
+def test_vectorised_fefo_matches_plain_loop():
+    generator = random.Random(41)
+    for _ in range(2000):
+        batches = sorted(
+            (product, generator.randint(0, 400), generator.randint(0, 100))
+            for product in range(generator.randint(1, 5))
+            for _ in range(generator.randint(1, 6))
+        )
+        window = generator.randint(1, 60)
+        used = {product: generator.randint(0, 500) for product, _, _ in batches}
+        batches = [(product, days, quantity, used[product], window) for product, days, quantity in batches]
+
+        products = np.array([batch[0] for batch in batches])
+        starts = np.ones(len(batches), dtype=bool)
+        starts[1:] = products[1:] != products[:-1]
+        rate = np.array([used / window for _, _, _, used, window in batches])
+        days = np.array([batch[1] for batch in batches], dtype=float)
+        quantity = np.array([batch[2] for batch in batches], dtype=np.int64)
+
+        sold = _fefo_sold(starts, _units_demanded(rate, days), quantity)
+        assert sold.tolist() == _fefo_loop(batches)
+
+
+def test_forecast_uses_recent_demand_fefo(app):
+    today = date.today()
+    med1 = Medicine.query.filter_by(name='Med1').one()
+    med1.quantity = 40
+    # A second, later batch of the same product
+    db.session.add(Medicine(name='Med1', batch_number='B1b', selling_price=11, cost_price=5, quantity=40,
+                            minimum_stock=10, manufacturer_id=1, category_id=1, branch_id=1,
+                            expiry_date=today + timedelta(days=30)))
+    # 31 units over 30 days: 10.33 units in the first batch's 10 days, 31 by day 30
+    db.session.add(MedicineUsage(branch_id=1, product_key=product_key('Med1', '', ''),
+                                 day=today - timedelta(days=1), quantity_used=31))
+    db.session.commit()
+
+    rows = {row['days_to_expiry']: row for row in forecast_expiry_risk(window=30, today=today)
+            if row['medicine_id'] in {m.id for m in Medicine.query.filter_by(name='Med1')}}
+    assert rows[10]['projected_sold'] == 10 and rows[10]['projected_unsold'] == 30
+    assert rows[30]['projected_sold'] == 21 and rows[30]['projected_unsold'] == 19
+
+
+def test_refresh_is_a_post(client):
+    assert client.get('/api/medicines/expiry-risk').json['as_of'] is None
+    assert client.get('/api/medicines/expiry-risk?refresh=true').json['as_of'] is None
+
+    response = client.post('/api/medicines/expiry-risk/refresh')
+    assert response.status_code == 200
+    assert response.json['as_of'] == date.today().isoformat()
+    assert client.get('/api/medicines/expiry-risk').json['batches_at_risk'] == response.json['batches_at_risk']
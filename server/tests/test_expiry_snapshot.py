@@ -0,0 +1,36 @@
+from datetime import date, timedelta
+
+import expiry_snapshot
+from expiry_snapshot import (filter_by_expiry, rebuild_expiry_snapshot, expiry_snapshot_job,
+                             snapshot_is_current, EXPIRED, EXPIRING_SOON)
+from models import db, Medicine
+
+
+def _names(status, branch_id=None):
+    return sorted(m.name for m in filter_by_expiry(Medicine.query, status, branch_id))
+
+
+def test_snapshot_matches_range_scan(app):
+    fallback = {status: _names(status) for status in (EXPIRED, EXPIRING_SOON)}
+    assert not snapshot_is_current()
+
+    rebuild_expiry_snapshot()
+    assert snapshot_is_current()
+    assert {status: _names(status) for status in (EXPIRED, EXPIRING_SOON)} == fallback
+    assert fallback == {EXPIRED: ['Med0'], EXPIRING_SOON: ['Med1']}
+
+
+def test_writes_patch_the_snapshot(app):
+    rebuild_expiry_snapshot()
+    medicine = Medicine.query.filter_by(name='Med2').one()
+    medicine.expiry_date = date.today() - timedelta(days=1)
+    db.session.commit()
+    assert _names(EXPIRED) == ['Med0', 'Med2']
+    assert _names(EXPIRED, branch_id=2) == []
+
+
+def test_job_builds_once_per_day(app):
+    assert expiry_snapshot_job() != 'already current'
+    assert expiry_snapshot_job() == 'already current'
+    expiry_snapshot._current_for = None
+    assert expiry_snapshot_job() == 'already current'
@@ -0,0 +1,106 @@
+from datetime import date, datetime, timedelta
+
+import idempotency
+from admission import get_limiter
+from idempotency import _claim, CLAIMED, IN_PROGRESS, PENDING_TIMEOUT
+from models import db, IdempotencyKey, Medicine
+
+
+def _create(client, key, batch='NEW1'):
+    return client.post('/api/medicines', headers={'Idempotency-Key': key}, json={
+        'name': 'New', 'batch_number': batch, 'selling_price': 12, 'quantity': 20,
+        'manufacturer_id': 1, 'category_id': 1,
+        'expiry_date': (date.today() + timedelta(days=90)).isoformat()
+    })
+
+
+def test_replay_returns_stored_response_and_headers(client):
+    first = _create(client, 'k1')
+    assert first.status_code == 201 and first.headers['ETag']
+
+    replay = _create(client, 'k1')
+    assert replay.status_code == 201
+    assert replay.headers['Idempotent-Replayed'] == 'true'
+    assert replay.headers['ETag'] == first.headers['ETag']
+    assert replay.json == first.json
+    assert Medicine.query.filter_by(batch_number='NEW1').count() == 1
+
+
+def test_reusing_a_key_for_another_body_is_rejected(client):
+    _create(client, 'k1')
+    assert _create(client, 'k1', batch='NEW2').status_code == 422
+
+
+def test_abandoned_claim_is_taken_over_once(app):
+    stale = datetime.utcnow() - PENDING_TIMEOUT - timedelta(seconds=1)
+    db.session.add(IdempotencyKey(key='k1', fingerprint='f', created_at=stale,
+                                  expires_at=stale + timedelta(days=1)))
+    db.session.commit()
+
+    assert _claim('k1', 'f', 3600, 100) == (CLAIMED, None)
+    assert _claim('k1', 'f', 3600, 100) == (IN_PROGRESS, None)
+
+
+def test_claim_enforces_expiry_and_cap(app, client):
+    app.config['IDEMPOTENCY_MAX_KEYS'] = 2
+    app.config['IDEMPOTENCY_PRUNE_EVERY'] = 1
+    past = datetime.utcnow() - timedelta(days=2)
+    db.session.add(IdempotencyKey(key='old', fingerprint='f', created_at=past,
+                                  expires_at=past + timedelta(days=1)))
+    db.session.commit()
+
+    for index in range(4):
+        assert _create(client, f'k{index}', batch=f'NEW{index}').status_code == 201
+
+    keys = {key for key, in db.session.query(IdempotencyKey.key)}
+    assert keys == {'k2', 'k3'}
+
+
+def test_claims_only_prune_every_nth_time(app, client):
+    app.config['IDEMPOTENCY_MAX_KEYS'] = 2
+    app.config['IDEMPOTENCY_PRUNE_EVERY'] = 10 ** 9
+    for index in range(4):
+        _create(client, f'k{index}', batch=f'NEW{index}')
+    assert db.session.query(IdempotencyKey).count() == 4
+
+
+def test_keyed_upload_is_hashed_without_losing_the_body(client, monkeypatch):
+    # Force the spooled copy onto disk
+    monkeypatch.setattr(idempotency, 'SPOOL_MEMORY', 16)
+    body = 'batch_number,counted_quantity\n' + 'B1,3\n' * 50
+    headers = {'Idempotency-Key': 'count-1', 'Content-Type': 'text/csv'}
+
+    first = client.post('/api/stock-take', data=body, headers=headers)
+    assert first.status_code == 200
+    assert first.json['lines_staged'] == 50
+    assert first.json['variances'][0]['counted_quantity'] == 150
+
+    replay = client.post('/api/stock-take', data=body, headers=headers)
+    assert replay.headers['Idempotent-Replayed'] == 'true'
+    assert client.post('/api/stock-take', data=body + 'B2,1\n', headers=headers).status_code == 422
+
+
+def test_errors_are_not_replayed(client):
+    bad = client.post('/api/medicines', headers={'Idempotency-Key': 'k1'}, json={'name': 'New'})
+    assert bad.status_code == 400
+    assert db.session.get(IdempotencyKey, 'k1') is None
+
+    retry = client.post('/api/medicines', headers={'Idempotency-Key': 'k1'}, json={'name': 'New'})
+    assert retry.status_code == 400 and 'Idempotent-Replayed' not in retry.headers
+
+
+def test_admission_rejection_does_not_burn_the_key(app, client, monkeypatch):
+    limiter = get_limiter('report')
+    headers = {'Idempotency-Key': 'count-1', 'Content-Type': 'text/csv'}
+    body = 'B1,3\n'
+
+    # Saturated: every slot busy and the wait queue full
+    monkeypatch.setattr(limiter, 'active', limiter.concurrency)
+    monkeypatch.setattr(limiter, 'waiting', limiter.queue)
+    assert client.post('/api/stock-take', data=body, headers=headers).status_code == 429
+    assert db.session.get(IdempotencyKey, 'count-1') is None
+
+    monkeypatch.setattr(limiter, 'active', 0)
+    monkeypatch.setattr(limiter, 'waiting', 0)
+    retry = client.post('/api/stock-take', data=body, headers=headers)
+    assert retry.status_code == 200 and 'Idempotent-Replayed' not in retry.headers
@@ -0,0 +1,17 @@
+import pytest
+
+
+@pytest.mark.parametrize('archived', ['false', 'true'])
+@pytest.mark.parametrize('per_page, expected', [(0, 1), (-5, 1), (2, 2), (10000, 200)])
+def test_per_page_is_clamped(client, archived, per_page, expected):
+    response = client.get(f'/api/medicines?per_page={per_page}&include_archived={archived}')
+    assert response.status_code == 200
+    assert response.json['per_page'] == expected
+    assert response.json['pages'] == -(-4 // expected)
+    assert len(response.json['medicines']) == min(4, expected)
+
+
+def test_page_below_one_is_the_first_page(client):
+    response = client.get('/api/medicines?page=-3&per_page=2')
+    assert response.json['current_page'] == 1
+    assert [m['name'] for m in response.json['medicines']] == ['Med0', 'Med1']
@@ -0,0 +1,45 @@
+from datetime import date, timedelta
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from models import db, MedicineUsage  # noqa: E402
+from reorder import product_key, reorder_suggestions  # noqa: E402
+
+
+def _usage(name, days_ago, used, branch_id=1):
+    db.session.add(MedicineUsage(branch_id=branch_id, product_key=product_key(name, '', ''),
+                                 day=date.today() - timedelta(days=days_ago), quantity_used=used))
+
+
+def _suggestion(result, name):
+    return next(s for s in result['suggestions'] if s['name'] == name)
+
+
+def test_demand_and_quantities_match_hand_computation(app):
+    for days_ago, used in ((0, 4), (1, 6), (3, 10)):
+        _usage('Med2', days_ago, used)
+    db.session.commit()
+
+    result = reorder_suggestions(window=4, lead_time=10, review=5, service_z=0, include_all=True)
+    med2 = _suggestion(result, 'Med2')
+    assert med2['avg_daily_demand'] == 5.0
+    assert med2['reorder_point'] == 50.0
+    assert med2['days_of_cover'] == 10.0
+    # target 5 * (10 + 5) = 75, 50 on hand
+    assert med2['suggested_quantity'] == 25
+    # Med1 sells nothing but is under its minimum stock
+    assert _suggestion(result, 'Med1')['suggested_quantity'] == 5
+
+
+def test_future_dated_usage_is_ignored(app, client):
+    _usage('Med2', 0, 8)
+    _usage('Med2', -3, 1000)
+    db.session.commit()
+
+    result = reorder_suggestions(window=4, include_all=True)
+    assert _suggestion(result, 'Med2')['avg_daily_demand'] == 2.0
+
+    response = client.get('/api/medicines/reorder?window=4&all=true')
+    assert response.status_code == 200
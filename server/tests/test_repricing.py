@@ -0,0 +1,39 @@
+import pytest
+
+from models import db, Medicine, MedicinePriceHistory
+
+
+def _reprice(client, **body):
+    return client.post('/api/medicines/reprice', json=dict({'category_id': 1, 'percent': 10}, **body))
+
+
+def test_summary_matches_what_was_written(client):
+    preview = _reprice(client, dry_run=True).json
+    applied = _reprice(client).json
+
+    assert applied['affected'] == preview['affected'] == 4
+    assert applied['value_delta'] == preview['value_delta']
+    # 10% of 10, 11, 12 and 13 times 50, 5, 50 and 5 units
+    assert applied['value_delta']['selling_price'] == pytest.approx(50 + 5.5 + 60 + 6.5)
+
+    history = MedicinePriceHistory.query.filter_by(change_id=applied['change_id']).all()
+    assert len(history) == 4
+    for entry in history:
+        medicine = db.session.get(Medicine, entry.medicine_id)
+        assert medicine.selling_price == entry.new_selling_price
+        assert medicine.version == 2
+
+
+@pytest.mark.parametrize('ids', ['1,2', 7, {'id': 1}, [None], ['x'], []])
+def test_malformed_ids_are_a_bad_request(client, ids):
+    response = client.post('/api/medicines/reprice', json={'ids': ids, 'percent': 10})
+    assert response.status_code == 400
+    assert 'ids' in response.json['error']
+
+
+def test_history_records_the_actor(client):
+    change_id = client.post('/api/medicines/reprice', headers={'X-User': 'pricing-lead'},
+                            json={'category_id': 1, 'percent': 5}).json['change_id']
+    history = MedicinePriceHistory.query.filter_by(change_id=change_id).all()
+    assert {entry.actor for entry in history} == {'pricing-lead'}
+    assert history[0].to_dict()['actor'] == 'pricing-lead'
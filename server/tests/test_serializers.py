@@ -0,0 +1,80 @@
+import gzip
+import json
+
+import pytest
+
+from serializers import COLUMNAR_MIMETYPE, COMPRESS_MIN_SIZE
+
+msgpack = pytest.importorskip('msgpack')
+
+
+def _rows(client, **kwargs):
+    return client.get('/api/medicines?per_page=10', **kwargs)
+
+
+def test_row_layout_by_default(client):
+    response = _rows(client)
+    assert response.mimetype == 'application/json'
+    assert [m['name'] for m in response.json['medicines']] == ['Med0', 'Med1', 'Med2', 'Med3']
+    assert 'Accept' in response.vary
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'query_string': {'layout': 'columnar'}},
+    {'headers': {'Accept': COLUMNAR_MIMETYPE}},
+])
+def test_columnar_layout_round_trips(client, kwargs):
+    rows = _rows(client).json['medicines']
+    url = '/api/medicines?per_page=10' + ('&layout=columnar' if 'query_string' in kwargs else '')
+    response = client.get(url, headers=kwargs.get('headers'))
+    assert response.mimetype == COLUMNAR_MIMETYPE
+    payload = response.json['medicines']
+    assert payload['layout'] == 'columnar' and payload['count'] == len(rows)
+    assert payload['dictionaries']['manufacturer'] == ['Cipla']
+
+    columns, dictionaries = payload['columns'], payload['dictionaries']
+    for index, row in enumerate(rows):
+        assert columns['id'][index] == row['id']
+        assert columns['quantity'][index] == row['quantity']
+        for field in ('branch', 'manufacturer', 'category'):
+            assert dictionaries[field][columns[field][index]] == row[field]
+    assert 'manufacturer_info' not in columns
+
+
+def test_msgpack_matches_json(client):
+    expected = _rows(client).json
+    response = _rows(client, headers={'Accept': 'application/msgpack'})
+    assert response.mimetype == 'application/msgpack'
+    decoded = msgpack.unpackb(response.data, raw=False)
+    # Decimals travel as numbers in MessagePack and as strings in JSON
+    for row, packed in zip(expected['medicines'], decoded['medicines']):
+        assert float(packed.pop('profit_margin')) == float(row.pop('profit_margin'))
+    assert decoded == expected
+
+
+def test_gzip_only_when_accepted_and_large(client):
+    plain = _rows(client)
+    assert len(plain.data) >= COMPRESS_MIN_SIZE
+    assert 'Content-Encoding' not in plain.headers
+
+    compressed = _rows(client, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.vary
+    assert json.loads(gzip.decompress(compressed.data)) == plain.json
+
+    small = client.get('/api/medicines?per_page=1&search=nothing-matches', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+    # Identity responses vary on Accept-Encoding too, or caches mix them up
+    assert 'Accept-Encoding' in small.vary and 'Accept-Encoding' in plain.vary
+
+
+@pytest.mark.parametrize('accept_encoding, compressed', [
+    ('gzip;q=0', False),
+    ('br, gzip;q=0, deflate', False),
+    ('identity', False),
+    ('*', True),
+    ('deflate, gzip;q=0.5', True),
+])
+def test_gzip_honours_quality_values(client, accept_encoding, compressed):
+    response = _rows(client, headers={'Accept-Encoding': accept_encoding})
+    assert ('Content-Encoding' in response.headers) == compressed
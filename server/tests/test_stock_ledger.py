@@ -0,0 +1,98 @@
+import time
+import logging
+
+from archival import archive_batches
+from models import db, Medicine, StockMovement
+from stock_ledger import background_compactor, compact_movements, live_balances, record_movements
+from suggest_index import suggest_index
+
+
+def _medicine(name):
+    return Medicine.query.filter_by(name=name).one()
+
+
+def test_movements_are_applied_inline_when_configured(app, client):
+    app.config['STOCK_COMPACT_ON_WRITE'] = True
+    med1 = _medicine('Med1')
+    response = client.post('/api/stock-movements', json={'movements': [
+        {'medicine_id': med1.id, 'kind': 'receipt', 'quantity': 20},
+        {'medicine_id': med1.id, 'kind': 'sale', 'quantity': 3},
+    ]})
+    assert response.status_code == 201
+    assert response.json['compacted'].startswith('2 movements compacted')
+
+    db.session.expire_all()
+    assert _medicine('Med1').quantity == 5 + 20 - 3
+    assert live_balances([med1.id]) == {med1.id: (22, 0)}
+
+
+def test_balance_converges_through_the_background_compactor(app, client):
+    app.config.update(STOCK_COMPACT_IN_BACKGROUND=True, STOCK_COMPACT_DELAY=0.05)
+    med1 = _medicine('Med1')
+    runs = background_compactor.runs
+    for _ in range(5):
+        response = client.post('/api/stock-movements', json={'medicine_id': med1.id, 'kind': 'sale', 'quantity': 1})
+        assert response.status_code == 201
+        # Nothing is compacted inside the request
+        assert response.json['compacted'] is None
+
+    deadline = time.monotonic() + 5
+    while live_balances([med1.id])[med1.id] != (0, 0):
+        assert time.monotonic() < deadline, 'background compaction did not converge'
+        time.sleep(0.01)
+        db.session.expire_all()
+    assert background_compactor.runs > runs
+    assert _medicine('Med1').quantity == 0
+
+
+def test_pending_movements_wait_for_the_job_when_it_runs_elsewhere(app, client):
+    med1 = _medicine('Med1')
+    response = client.post('/api/stock-movements', json={'medicine_id': med1.id, 'kind': 'sale', 'quantity': 2})
+    assert response.json['compacted'] is None
+    assert live_balances([med1.id]) == {med1.id: (5, -2)}
+
+    suggest_index.stale = False
+    assert compact_movements().startswith('1 movements compacted')
+    db.session.expire_all()
+    assert _medicine('Med1').quantity == 3
+    # The typeahead index caches quantities, the Core UPDATE must invalidate it
+    assert suggest_index.stale
+
+
+def test_movements_for_missing_medicines_are_surfaced(app, caplog):
+    med0_id, med1_id = _medicine('Med0').id, _medicine('Med1').id
+    record_movements([{'medicine_id': med0_id, 'kind': 'receipt', 'quantity': 4},
+                      {'medicine_id': med1_id, 'kind': 'receipt', 'quantity': 1}])
+    db.session.commit()
+    db.session.execute(Medicine.__table__.delete().where(Medicine.id == med0_id))
+    db.session.commit()
+
+    with caplog.at_level(logging.WARNING, logger='stock_ledger'):
+        summary = compact_movements()
+    assert summary == '1 movements compacted in 1 chunks (1 medicine updates), 1 orphaned movements for missing medicines'
+    assert f'[{med0_id}]' in caplog.text
+    assert StockMovement.query.filter(StockMovement.compacted_at.is_(None)).count() == 0
+
+
+def test_archival_skips_batches_with_pending_movements(app):
+    med0 = _medicine('Med0')
+    record_movements([{'medicine_id': med0.id, 'kind': 'write_off', 'quantity': 50}])
+    db.session.commit()
+
+    assert archive_batches(retention_days=0) == '0 batches archived in 0 chunks'
+    compact_movements()
+    assert archive_batches(retention_days=0) == '1 batches archived in 1 chunks'
+
+
+def test_movements_record_the_actor(app, client):
+    med1 = _medicine('Med1')
+    client.post('/api/stock-movements', headers={'X-User': 'till-3'},
+                json={'medicine_id': med1.id, 'kind': 'sale', 'quantity': 1})
+    client.post('/api/stock-take?apply=true', headers={'X-User': 'auditor', 'Content-Type': 'text/csv'},
+                data='batch_number,counted_quantity\nB1,2\n')
+
+    movements = StockMovement.query.order_by(StockMovement.id).all()
+    assert [(m.kind, m.reference, m.actor) for m in movements[-2:]] == [
+        ('sale', '', 'till-3'), ('adjustment', 'stock take', 'auditor')]
+    assert movements[-1].to_dict()['actor'] == 'auditor'
+
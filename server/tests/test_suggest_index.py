@@ -0,0 +1,68 @@
+import time
+from datetime import datetime
+
+from models import db, Medicine
+from suggest_index import suggest_index
+
+
+def _names(*args, **kwargs):
+    return [suggestion['name'] for suggestion in suggest_index.search(*args, **kwargs)]
+
+
+def _wait_for_build(builds, timeout=5):
+    deadline = time.monotonic() + timeout
+    while suggest_index.builds == builds:
+        assert time.monotonic() < deadline, 'the refresher never rebuilt the index'
+        time.sleep(0.01)
+
+
+def test_branch_scoped_search_only_sees_its_branch(app):
+    assert _names('med') == ['Med0', 'Med1', 'Med2', 'Med3']
+    assert _names('med', branch_id=2) == ['Med3']
+    assert _names('med', limit=2, branch_id=1) == ['Med0', 'Med1']
+    assert _names('med', branch_id=99) == []
+
+
+def test_committed_writes_patch_the_index(app):
+    medicine = Medicine.query.filter_by(name='Med3').one()
+    medicine.name = 'Aspirin'
+    medicine.branch_id = 1
+    db.session.commit()
+
+    assert _names('asp', branch_id=1) == ['Aspirin']
+    assert _names('asp', branch_id=2) == []
+    assert 'Med3' not in _names('med')
+
+
+def test_stale_index_rebuilds_in_background_and_serves_old_arrays(app):
+    db.session.execute(db.update(Medicine).where(Medicine.name == 'Med2').values(name='Zinc'))
+    db.session.commit()
+    builds = suggest_index.builds
+    suggest_index.stale = True
+
+    assert _names('med2') == ['Med2']
+    _wait_for_build(builds)
+    assert _names('zinc') == ['Zinc']
+    assert _names('med2') == []
+
+
+def test_writes_from_other_processes_are_noticed_after_the_ttl(app):
+    # A Core UPDATE skips the session hooks, like a write made by another worker
+    db.session.execute(db.update(Medicine).where(Medicine.name == 'Med1').values(
+        name='Ibuprofen', updated_at=datetime.utcnow()
+    ))
+    db.session.commit()
+    builds = suggest_index.builds
+    app.config['SUGGEST_REFRESH_TTL'] = 0.05
+
+    # The search itself never queries the table, the refresher notices the change
+    assert _names('ibu') == []
+    _wait_for_build(builds)
+    assert _names('ibu') == ['Ibuprofen']
+
+
+def test_refresh_only_rebuilds_when_something_changed(app):
+    assert suggest_index.refresh() is False
+    db.session.execute(db.update(Medicine).where(Medicine.name == 'Med1').values(updated_at=datetime.utcnow()))
+    db.session.commit()
+    assert suggest_index.refresh() is True
@@ -0,0 +1,27 @@
+from reference_cache import reference_cache
+from suggest_index import suggest_index
+from warmup import warm_up, readiness
+
+
+def _reloaded():
+    raise AssertionError('reloaded')
+
+
+def test_warm_up_reuses_preloaded_data(app, monkeypatch):
+    monkeypatch.setattr(reference_cache, 'load', _reloaded)
+    monkeypatch.setattr(suggest_index, 'build', _reloaded)
+
+    state = warm_up(app)
+    assert state['ready'] and state['error'] is None
+    with app.app_context():
+        assert readiness()[0]
+
+
+def test_warm_up_loads_what_is_missing(app):
+    reference_cache.invalidate()
+    suggest_index.built = False
+    builds = suggest_index.builds
+
+    assert warm_up(app)['ready']
+    assert reference_cache.is_loaded
+    assert suggest_index.built and suggest_index.builds > builds
@@ -0,0 +1,159 @@
+"""
+Inventory valuation time-series.
+
+Once a day the current stock is aggregated (total, per branch, per
+category and per manufacturer) into inventory_valuations 'day' rows, and
+the 'week' (Monday start) and 'month' rows covering that day are re-rolled
+from the day rows.
+Trend queries then read only the rollup rows for the requested range
+instead of scanning medicines. Daily rows older than DAILY_RETENTION_DAYS
+are pruned, weekly and monthly rows are kept.
+
+Record manually with: python scheduler.py --run inventory_valuation
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+from models import db, Medicine, InventoryValuation
+from scheduler import register_job
+
+DAY, WEEK, MONTH = 'day', 'week', 'month'
+PERIODS = (DAY, WEEK, MONTH)
+DIMENSIONS = ('total', 'branch', 'category', 'manufacturer')
+
+DAILY_RETENTION_DAYS = 400
+
+
+def period_start(day, period):
+    """First day of the period containing ``day``"""
+    if period == WEEK:
+        return day - timedelta(days=day.weekday())
+    if period == MONTH:
+        return day.replace(day=1)
+    return day
+
+
+def period_end(day, period):
+    """Last day of the period containing ``day``"""
+    start = period_start(day, period)
+    if period == WEEK:
+        return start + timedelta(days=6)
+    if period == MONTH:
+        next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return next_month - timedelta(days=1)
+    return start
+
+
+def _current_aggregates():
+    """Yield (dimension, dimension_id, count, quantity, selling, cost) for current stock"""
+    measures = (
+        db.func.count(Medicine.id),
+        db.func.coalesce(db.func.sum(Medicine.quantity), 0),
+        db.func.coalesce(db.func.sum(Medicine.selling_price * Medicine.quantity), 0),
+        db.func.coalesce(db.func.sum(Medicine.cost_price * Medicine.quantity), 0)
+    )
+
+    total = db.session.query(*measures).one()
+    yield ('total', 0) + tuple(total)
+
+    for dimension, column in (('branch', Medicine.branch_id),
+                              ('category', Medicine.category_id),
+                              ('manufacturer', Medicine.manufacturer_id)):
+        rows = db.session.query(column, *measures).filter(
+            column.isnot(None)
+        ).group_by(column).all()
+        for row in rows:
+            yield (dimension,) + tuple(row)
+
+
+def _rollup(day, period):
+    """Rebuild the rollup rows of ``period`` containing ``day`` from day rows"""
+    start, end = period_start(day, period), period_end(day, period)
+    day_rows = InventoryValuation.query.filter(
+        InventoryValuation.period == DAY,
+        InventoryValuation.period_start.between(start, end)
+    ).order_by(InventoryValuation.period_start).all()
+
+    series = {}
+    for row in day_rows:
+        series.setdefault((row.dimension, row.dimension_id), []).append(row)
+
+    InventoryValuation.query.filter_by(period=period, period_start=start).delete()
+    for (dimension, dimension_id), rows in series.items():
+        closing = rows[-1]
+        days = len(rows)
+        db.session.add(InventoryValuation(
+            period=period,
+            period_start=start,
+            dimension=dimension,
+            dimension_id=dimension_id,
+            days=days,
+            medicine_count=closing.medicine_count,
+            quantity=closing.quantity,
+            selling_value=closing.selling_value,
+            cost_value=closing.cost_value,
+            avg_quantity=Decimal(sum(r.quantity for r in rows)) / days,
+            avg_selling_value=sum(r.selling_value for r in rows) / days,
+            avg_cost_value=sum(r.cost_value for r in rows) / days
+        ))
+
+
+def record_daily_snapshot(day=None):
+    """Record today's stock value and refresh the week/month rollups"""
+    day = day or date.today()
+
+    InventoryValuation.query.filter_by(period=DAY, period_start=day).delete()
+    count = 0
+    for dimension, dimension_id, medicines, quantity, selling, cost in _current_aggregates():
+        db.session.add(InventoryValuation(
+            period=DAY,
+            period_start=day,
+            dimension=dimension,
+            dimension_id=dimension_id,
+            days=1,
+            medicine_count=medicines,
+            quantity=quantity,
+            selling_value=selling,
+            cost_value=cost,
+            avg_quantity=quantity,
+            avg_selling_value=selling,
+            avg_cost_value=cost
+        ))
+        count += 1
+    db.session.flush()
+
+    _rollup(day, WEEK)
+    _rollup(day, MONTH)
+
+    InventoryValuation.query.filter(
+        InventoryValuation.period == DAY,
+        InventoryValuation.period_start < day - timedelta(days=DAILY_RETENTION_DAYS)
+    ).delete()
+
+    db.session.commit()
+    return f'{count} series recorded for {day.isoformat()}'
+
+
+register_job('inventory_valuation', record_daily_snapshot, at='23:55')
+
+
+def pick_granularity(date_from, date_to):
+    """Coarsest-enough period so a range never returns more than ~100 points"""
+    span = (date_to - date_from).days
+    if span <= 92:
+        return DAY
+    if span <= 730:
+        return WEEK
+    return MONTH
+
+
+def valuation_series(date_from, date_to, period, dimension='total', dimension_id=None):
+    """Rows of one period between two dates, served by ix_inventory_valuation_range"""
+    query = InventoryValuation.query.filter(
+        InventoryValuation.period == period,
+        InventoryValuation.dimension == dimension,
+        InventoryValuation.period_start.between(period_start(date_from, period), date_to)
+    )
+    if dimension_id is not None:
+        query = query.filter(InventoryValuation.dimension_id == dimension_id)
+    return query.order_by(InventoryValuation.period_start, InventoryValuation.dimension_id).all()
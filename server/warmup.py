@@ -0,0 +1,82 @@
+"""
+Worker warm-up and readiness.
+
+A freshly started worker has an empty connection pool, cold reference data
+and SQLAlchemy statement caches, so its first requests are slow. Before a
+worker takes traffic, ``warm_up`` opens WARMUP_CONNECTIONS pooled
+connections (default: the pool size), loads whatever of the reference cache,
+the typeahead index and today's expiry snapshot it did not inherit from a
+preloading master (under gunicorn they are all already there, so a worker
+does not rebuild them) and serves WARMUP_PATHS once through the test client.
+Readiness
+(``GET /api/ready``) stays 503 until that has finished and the database
+answers.
+"""
+
+import time
+import threading
+from sqlalchemy import text
+from models import db
+from reference_cache import reference_cache
+from suggest_index import suggest_index
+from expiry_snapshot import expiry_snapshot_job
+
+DEFAULT_WARMUP_PATHS = (
+    '/api/categories',
+    '/api/manufacturers',
+    '/api/medicines?per_page=20',
+    '/api/medicines/suggest?q=a',
+)
+
+_state = {'ready': False, 'warmed_at': None, 'warmup_seconds': None, 'error': None}
+_lock = threading.Lock()
+
+
+def _pool_size():
+    size = getattr(db.engine.pool, 'size', None)
+    return size() if callable(size) else 1
+
+
+def warm_up(app):
+    """Prime connections, caches and hot code paths; marks the process ready"""
+    started = time.monotonic()
+    with _lock:
+        try:
+            with app.app_context():
+                count = app.config.get('WARMUP_CONNECTIONS') or _pool_size()
+                connections = [db.engine.connect() for _ in range(count)]
+                for connection in connections:
+                    connection.execute(text('SELECT 1'))
+                for connection in connections:
+                    connection.close()
+
+                # Loaded by the preloading master and inherited across fork
+                if not reference_cache.is_loaded:
+                    reference_cache.load()
+                if not suggest_index.built:
+                    suggest_index.build()
+                expiry_snapshot_job()
+
+            client = app.test_client()
+            for path in app.config.get('WARMUP_PATHS', DEFAULT_WARMUP_PATHS):
+                client.get(path)
+
+            _state.update(ready=True, error=None, warmed_at=time.time(),
+                          warmup_seconds=round(time.monotonic() - started, 3))
+        except Exception as e:
+            _state.update(ready=False, error=str(e))
+            app.logger.warning(f"Warm-up failed: {e}")
+    return dict(_state)
+
+
+def readiness():
+    """(ready, details); ready needs a finished warm-up and a reachable database"""
+    details = dict(_state)
+    if not details['ready']:
+        return False, details
+    try:
+        db.session.execute(text('SELECT 1'))
+    except Exception as e:
+        details['error'] = f'database unavailable: {e}'
+        return False, details
+    return True, details
@@ -0,0 +1,20 @@
+"""
+Production WSGI entrypoint.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py preloads this module in the master and forks workers. Each
+worker disposes the inherited connection pool and warms up before it starts
+accepting requests. Run maintenance jobs outside the web workers with
+``python scheduler.py --loop``.
+"""
+
+import os
+import sys
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app  # noqa: E402
+
+application = app